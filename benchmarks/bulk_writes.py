@@ -0,0 +1,76 @@
+import argparse, asyncio, json, os, sys, time
+from pathlib import Path
+import psycopg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'txtform'))
+import database, helper, objects
+
+def percentile(samples : list[float], pct : float):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def make_components(count : int):
+    return [{'type': 'text', 'values': {'text': f'component {i} "quoted" \\ text\n'}} for i in range(count)]
+
+async def save_mogrify(conn : psycopg.AsyncConnection, response : objects.Response, components : list):
+    insert_str = 'INSERT INTO response_component(id, response_id, login_id, resp_type, variables) VALUES (%s, %s, %s, %s, %s)'
+    sql_data = [('DELETE FROM response_component WHERE response_id = %s AND login_id = %s', (response.id, response.login_id))]
+    for index, i in enumerate(components):
+        sql_data.append((insert_str, (index+1, response.id, response.login_id, i['type'], json.dumps(i['values']))))
+    cc = psycopg.ClientCursor(conn)
+    sql_str = ''.join(cc.mogrify(i[0], i[1]) + ';' for i in sql_data)
+    cc.close()
+    await conn.execute(sql_str)
+    await conn.commit()
+
+async def measure(fn, rounds : int):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'p50_ms': round(percentile(samples, 50), 3), 'p99_ms': round(percentile(samples, 99), 3), 'mean_ms': round(sum(samples) / len(samples), 3)}
+
+async def main():
+    parser = argparse.ArgumentParser(description='Compare the legacy mogrify write against the prepared unnest insert and COPY when saving response components. Seeds a new login into the target database.')
+    parser.add_argument('--dsn', default=os.environ.get('POSTGRES_CONNECTION_STRING', None))
+    parser.add_argument('--counts', default='10,100,1000')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+    if not args.dsn: raise SystemError('Pass --dsn or set POSTGRES_CONNECTION_STRING')
+
+    db = database.Database(args.dsn, max_size=2, publish_events=False)
+    await db.startup()
+    login = await db.register_login(helper.generate_string(10), 'Benchmark', int(time.time() * 1000))
+    response = await db.create_empty_response(login, 'bulk')
+    conn = await psycopg.AsyncConnection.connect(args.dsn)
+    copy_threshold = database.COPY_THRESHOLD
+
+    results = []
+    for count in [int(i) for i in args.counts.split(',')]:
+        components = make_components(count)
+        async def save_default(): await db.set_response_components(response, components)
+        async def save_unnest():
+            database.COPY_THRESHOLD = count + 1
+            try: await db.set_response_components(response, components)
+            finally: database.COPY_THRESHOLD = copy_threshold
+        async def save_copy():
+            database.COPY_THRESHOLD = 1
+            try: await db.set_response_components(response, components)
+            finally: database.COPY_THRESHOLD = copy_threshold
+        async def save_legacy(): await save_mogrify(conn, response, components)
+        row = {'components': count}
+        for name, fn in (('mogrify', save_legacy), ('unnest', save_unnest), ('copy', save_copy), ('default', save_default)):
+            await fn()
+            saved = await db.get_response_components(response)
+            if [(i.resp_type, i.variables) for i in saved] != [(i['type'], i['values']) for i in components]: raise SystemError(f'{name} wrote unexpected rows')
+            row[name] = await measure(fn, args.rounds)
+        results.append(row)
+        print(json.dumps(row), file=sys.stderr)
+
+    await conn.close()
+    await db.shutdown()
+    print(json.dumps({'copy_threshold': copy_threshold, 'rounds': args.rounds, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    asyncio.run(main())
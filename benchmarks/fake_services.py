@@ -0,0 +1,110 @@
+import argparse, asyncio, json, random, time
+from aiohttp import web
+
+class FakeBehavior():
+    def __init__(self, latency_ms : float, jitter_ms : float, error_rate : float, unauthorized_rate : float, rate_limit_rate : float, track_ms : int):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.track_ms = track_ms
+        self.counts : dict[str, int] = {}
+
+    async def delay(self, name : str):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0: await asyncio.sleep(latency / 1000)
+
+    def failure(self, *, allow_unauthorized = False):
+        roll = random.random()
+        if roll < self.error_rate: return web.Response(text=json.dumps({'error': {'status': 500, 'message': 'fake error'}}), status=500)
+        roll -= self.error_rate
+        if roll < self.rate_limit_rate: return web.Response(text=json.dumps({'error': {'status': 429, 'message': 'fake rate limit'}}), status=429, headers={'Retry-After': '1'})
+        roll -= self.rate_limit_rate
+        if allow_unauthorized and roll < self.unauthorized_rate: return web.Response(text=json.dumps({'error': {'status': 401, 'message': 'fake expired token'}}), status=401)
+        return None
+
+def json_response(data : dict, status : int = 200):
+    return web.Response(text=json.dumps(data), status=status, content_type='application/json')
+
+def create_app(behavior : FakeBehavior):
+    routes = web.RouteTableDef()
+
+    @routes.get('/v1/me/player/currently-playing')
+    async def spotify_currently_playing(request : web.Request):
+        await behavior.delay('spotify_currently_playing')
+        failure = behavior.failure(allow_unauthorized=True)
+        if failure: return failure
+        now_ms = int(time.time() * 1000)
+        track_index = now_ms // behavior.track_ms
+        return json_response({
+            'is_playing': True,
+            'progress_ms': now_ms % behavior.track_ms,
+            'item': {
+                'name': f'Track {track_index}',
+                'duration_ms': behavior.track_ms,
+                'artists': [{'name': f'Artist {track_index % 7}'}, {'name': f'Artist {track_index % 5}'}]
+            }
+        })
+
+    @routes.get('/v1/me')
+    async def spotify_me(request : web.Request):
+        await behavior.delay('spotify_me')
+        return json_response({'id': f'fake{random.randint(1, 10**9)}', 'display_name': 'Fake Spotify'})
+
+    @routes.post('/api/token')
+    async def spotify_token(request : web.Request):
+        await behavior.delay('spotify_token')
+        failure = behavior.failure()
+        if failure: return failure
+        return json_response({'access_token': f'fake-spotify-{random.randint(1, 10**9)}', 'refresh_token': 'fake-spotify-refresh', 'scope': 'user-read-currently-playing user-read-playback-state', 'expires_in': 3600})
+
+    @routes.post('/oauth2/token')
+    async def twitch_token(request : web.Request):
+        await behavior.delay('twitch_token')
+        failure = behavior.failure()
+        if failure: return failure
+        return json_response({'access_token': f'fake-twitch-{random.randint(1, 10**9)}', 'refresh_token': 'fake-twitch-refresh', 'scope': [], 'expires_in': 14400})
+
+    @routes.get('/helix/users')
+    async def twitch_users(request : web.Request):
+        await behavior.delay('twitch_users')
+        user_id = random.randint(1, 10**9)
+        return json_response({'data': [{'id': str(user_id), 'login': f'fake{user_id}', 'display_name': f'Fake{user_id}'}]})
+
+    @routes.get('/helix/streams')
+    async def twitch_streams(request : web.Request):
+        await behavior.delay('twitch_streams')
+        return json_response({'data': []})
+
+    @routes.post('/helix/eventsub/subscriptions')
+    async def twitch_eventsub(request : web.Request):
+        await behavior.delay('twitch_eventsub')
+        return json_response({'data': []}, status=202)
+
+    @routes.get('/_counts')
+    async def counts(request : web.Request):
+        return json_response(behavior.counts)
+
+    app = web.Application()
+    app.add_routes(routes)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-ins for the Spotify and Twitch APIs used by TXTForm. Point SPOTIFY_API_URL, SPOTIFY_ACCOUNTS_URL, TWITCH_API_URL and TWITCH_ID_URL at this server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--unauthorized-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--track-ms', type=int, default=180000)
+    args = parser.parse_args()
+
+    behavior = FakeBehavior(args.latency_ms, args.jitter_ms, args.error_rate, args.unauthorized_rate, args.rate_limit_rate, args.track_ms)
+    web.run_app(create_app(behavior), host=args.host, port=args.port, print=lambda _: print(f'fake services at http://{args.host}:{args.port}'))
+
+if __name__ == '__main__':
+    main()
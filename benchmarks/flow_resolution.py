@@ -0,0 +1,79 @@
+import argparse, asyncio, datetime, json, os, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'txtform'))
+import database, helper, objects
+
+def percentile(samples : list[float], pct : float):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def seed(db : database.Database, username : str, states_count : int, components_count : int):
+    login = await db.register_login(username, 'Benchmark', int(time.time() * 1000))
+    login = await db.get_login_by_id(login.id)
+    twitch = await db.add_twitch_account(login, login.primary_account_id, login.username, login.username, False, 'a', 'r', [], datetime.datetime.now(datetime.UTC))
+    states = []
+    for i in range(states_count):
+        response = await db.create_empty_response(login, f'resp{i}')
+        await db.set_response_components(response, [{'type': 'text', 'values': {'text': f'component {j} '}} for j in range(components_count)])
+        states.append({'response_id': response.id, 'condition': 'twitchLive', 'values': {'twitch_id': twitch.id}})
+    states[-1]['condition'] = 'always'
+    states[-1]['values'] = {}
+    flow = await db.create_empty_flow(login, 'bench')
+    await db.set_flow_states(flow, states)
+    return login, flow
+
+async def resolve_sequential(db : database.Database, username : str, flowname : str):
+    login = await db.get_login_by_username(username)
+    flows = await db.get_all_login_flows(login)
+    flow = helper.find_by_key('label', flowname, flows, match_lowercase=True)
+    flow_states = await db.get_flow_states(flow)
+    for state in flow_states:
+        if state.flow_type == 'always': break
+        twitch_accounts = await db.get_twitch_accounts_by_login(objects.Login(state.login_id, None, None, None))
+        if helper.find_by_key('id', state.variables['twitch_id'], twitch_accounts).is_live: break
+    return await db.get_response_components(objects.Response(state.response_id, None, state.login_id))
+
+async def resolve_single(db : database.Database, username : str, flowname : str):
+    resolution = await db.get_flow_resolution(username, flowname)
+    for state in resolution.states:
+        if state.flow_type == 'always' or resolution.twitch_live.get(state.variables.get('twitch_id', None), False): break
+    return resolution.components.get(state.response_id, [])
+
+async def run(fn, db : database.Database, username : str, flowname : str, requests : int, concurrency : int):
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await fn(db, username, flowname)
+            samples.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+    return {'requests': requests, 'rps': round(requests / elapsed, 1), 'p50_ms': round(percentile(samples, 50), 3), 'p99_ms': round(percentile(samples, 99), 3)}
+
+async def main():
+    parser = argparse.ArgumentParser(description='Compare the sequential and single-query flow resolution paths. Seeds a new login into the target database.')
+    parser.add_argument('--dsn', default=os.environ.get('POSTGRES_CONNECTION_STRING', None))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--states', type=int, default=3)
+    parser.add_argument('--components', type=int, default=5)
+    args = parser.parse_args()
+    if not args.dsn: raise SystemError('Pass --dsn or set POSTGRES_CONNECTION_STRING')
+
+    db = database.Database(args.dsn, max_size=args.concurrency)
+    await db.startup()
+    login, flow = await seed(db, helper.generate_string(10), args.states, args.components)
+    await resolve_sequential(db, login.username, flow.label)
+    await resolve_single(db, login.username, flow.label)
+    result = {
+        'sequential': await run(resolve_sequential, db, login.username, flow.label, args.requests, args.concurrency),
+        'single_query': await run(resolve_single, db, login.username, flow.label, args.requests, args.concurrency)
+    }
+    await db.shutdown()
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    asyncio.run(main())
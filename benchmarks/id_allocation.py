@@ -0,0 +1,75 @@
+import argparse, asyncio, datetime, json, os, sys, time
+from pathlib import Path
+import psycopg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'txtform'))
+import database, helper
+
+async def legacy_session(conn : psycopg.AsyncConnection, login_id : int):
+    await conn.execute('''INSERT INTO login_session(id, login_id, session_token, validity)
+                       SELECT COALESCE(MAX(id)+1, 1), %s, %s, %s FROM login_session WHERE login_id = %s''',
+                       (login_id, f'{login_id}x{helper.generate_string(20)}', datetime.datetime.now(datetime.UTC), login_id))
+    await conn.commit()
+
+async def hammer(fn, tasks : int, per_task : int):
+    errors = {}
+    async def worker():
+        for _ in range(per_task):
+            try: await fn()
+            except Exception as e: errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(tasks)])
+    elapsed = time.perf_counter() - start
+    return {'calls': tasks * per_task, 'per_second': round(tasks * per_task / elapsed, 1), 'errors': errors}
+
+async def check_ids(conn : psycopg.AsyncConnection, table : str, login_id : int):
+    cur = await conn.execute(f'SELECT COUNT(*), COUNT(DISTINCT id), MIN(id), MAX(id) FROM {table} WHERE login_id = %s', (login_id,))
+    count, distinct, low, high = await cur.fetchone()
+    await conn.commit()
+    return {'rows': count, 'unique': count == distinct, 'contiguous': count == 0 or (low == 1 and high == count)}
+
+async def main():
+    parser = argparse.ArgumentParser(description='Create sessions, responses and flows for one login from many concurrent tasks and check the allocated ids. Seeds new logins into the target database.')
+    parser.add_argument('--dsn', default=os.environ.get('POSTGRES_CONNECTION_STRING', None))
+    parser.add_argument('--tasks', type=int, default=50)
+    parser.add_argument('--per-task', type=int, default=20)
+    parser.add_argument('--pool-size', type=int, default=20)
+    parser.add_argument('--legacy', action='store_true', help='also run the old COALESCE(MAX(id)+1) session insert for comparison')
+    args = parser.parse_args()
+    if not args.dsn: raise SystemError('Pass --dsn or set POSTGRES_CONNECTION_STRING')
+
+    db = database.Database(args.dsn, max_size=args.pool_size, publish_events=False)
+    await db.startup()
+    login = await db.register_login(helper.generate_string(10), 'Benchmark', int(time.time() * 1000))
+    conn = await psycopg.AsyncConnection.connect(args.dsn)
+
+    report = {'tasks': args.tasks, 'per_task': args.per_task}
+    for table, fn in (('login_session', lambda: db.create_login_session(login)),
+                      ('response', lambda: db.create_empty_response(login, 'stress')),
+                      ('flow', lambda: db.create_empty_flow(login, 'stress'))):
+        report[table] = await hammer(fn, args.tasks, args.per_task)
+        report[table].update(await check_ids(conn, table, login.id))
+        print(json.dumps({table: report[table]}), file=sys.stderr)
+
+    if args.legacy:
+        legacy_login = await db.register_login(helper.generate_string(10), 'Benchmark', int(time.time() * 1000) + 1)
+        conns = [await psycopg.AsyncConnection.connect(args.dsn) for _ in range(args.pool_size)]
+        free = asyncio.Queue()
+        for i in conns: free.put_nowait(i)
+        async def legacy():
+            legacy_conn = await free.get()
+            try: await legacy_session(legacy_conn, legacy_login.id)
+            except Exception:
+                await legacy_conn.rollback()
+                raise
+            finally: free.put_nowait(legacy_conn)
+        report['legacy_login_session'] = await hammer(legacy, args.tasks, args.per_task)
+        report['legacy_login_session'].update(await check_ids(conn, 'login_session', legacy_login.id))
+        for i in conns: await i.close()
+
+    await conn.close()
+    await db.shutdown()
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+import argparse, asyncio, hashlib, hmac, itertools, json, random, subprocess, time
+from pathlib import Path
+import aiohttp
+
+def percentile(samples : list[float], pct : float):
+    if not samples: return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 3)
+
+def git_revision():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip() or None
+    except Exception: return None
+
+def text_requests(manifest : dict):
+    targets = [(f'/u/{login["username"]}/flow/{flow["label"]}/text', None) for login in manifest['logins'] for flow in login['flows']]
+    random.shuffle(targets)
+    for path, _ in itertools.cycle(targets):
+        yield 'GET', path, {}, None
+
+def render_requests(manifest : dict):
+    targets = []
+    for login in manifest['logins']:
+        cookies = {'session': login['session']}
+        targets.append(('/dashboard', cookies))
+        targets.append(('/render/bootstrap', cookies))
+        targets.append(('/render/flow/state', cookies))
+        targets.extend((f'/render/components/{i}', cookies) for i in login['response_ids'])
+        targets.extend((f'/render/flows/{i["id"]}', cookies) for i in login['flows'])
+    random.shuffle(targets)
+    for path, cookies in itertools.cycle(targets):
+        yield 'GET', path, {'Cookie': f'session={cookies["session"]}'}, None
+
+def webhook_requests(manifest : dict, secret : str):
+    user_ids = [login['twitch_user_id'] for login in manifest['logins']]
+    for index in itertools.count():
+        body = json.dumps({'type': 'stream.online' if index % 2 == 0 else 'stream.offline', 'condition': {'broadcaster_user_id': str(random.choice(user_ids))}})
+        msg_id = f'bench-{index}'
+        msg_ts = str(int(time.time()))
+        signature = 'sha256=' + hmac.new(secret.encode('utf-8'), (msg_id + msg_ts + body).encode('utf-8'), hashlib.sha256).hexdigest()
+        yield 'POST', '/webhook/twitch_live', {
+            'twitch-eventsub-message-id': msg_id,
+            'twitch-eventsub-message-timestamp': msg_ts,
+            'twitch-eventsub-message-signature': signature,
+            'twitch-eventsub-message-type': 'notification',
+            'Content-Type': 'application/json'
+        }, body
+
+async def fetch_stats(session : aiohttp.ClientSession, base_url : str):
+    try:
+        async with session.get(base_url + '/_stats') as response:
+            if response.status != 200: return None
+            return await response.json()
+    except Exception: return None
+
+async def run_scenario(session : aiohttp.ClientSession, base_url : str, name : str, requests, rps : float, duration : float, max_inflight : int):
+    latencies = []
+    statuses : dict[int, int] = {}
+    errors = 0
+    inflight = asyncio.Semaphore(max_inflight)
+    dropped = 0
+    tasks = set()
+
+    async def one(method : str, path : str, headers : dict, body : str | None):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            async with session.request(method, base_url + path, headers=headers, data=body, allow_redirects=False) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+        except Exception: errors += 1
+        else: latencies.append((time.perf_counter() - start) * 1000)
+        finally: inflight.release()
+
+    stats_before = await fetch_stats(session, base_url)
+    total = int(rps * duration)
+    start = time.perf_counter()
+    for index in range(total):
+        delay = start + index / rps - time.perf_counter()
+        if delay > 0: await asyncio.sleep(delay)
+        if inflight.locked():
+            dropped += 1
+            continue
+        await inflight.acquire()
+        task = asyncio.ensure_future(one(*next(requests)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks: await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    stats_after = await fetch_stats(session, base_url)
+
+    completed = len(latencies)
+    result = {
+        'scenario': name,
+        'target_rps': rps,
+        'duration_s': round(elapsed, 3),
+        'sent': total - dropped,
+        'dropped': dropped,
+        'completed': completed,
+        'errors': errors,
+        'throughput_rps': round(completed / elapsed, 1) if elapsed else 0,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': round(max(latencies), 3) if latencies else None
+        },
+        'db_queries_per_request': None
+    }
+    if stats_before and stats_after and completed:
+        result['db_queries_per_request'] = round((stats_after['db_queries'] - stats_before['db_queries']) / completed, 3)
+    return result
+
+async def main():
+    parser = argparse.ArgumentParser(description='Drive TXTForm endpoints at a target request rate and report JSON. Start the server with BENCHMARK_STATS=1 for DB query counts.')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8080')
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    parser.add_argument('--scenarios', default='text,render,webhook')
+    parser.add_argument('--rps', type=float, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--max-inflight', type=int, default=256)
+    parser.add_argument('--webhook-secret', default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    manifest = json.loads(Path(args.manifest).read_text())
+    generators = {
+        'text': lambda: text_requests(manifest),
+        'render': lambda: render_requests(manifest),
+        'webhook': lambda: webhook_requests(manifest, args.webhook_secret)
+    }
+    scenarios = [i.strip() for i in args.scenarios.split(',') if i.strip()]
+    for i in scenarios:
+        if not i in generators: raise SystemError(f'Unknown scenario {i}')
+    if 'webhook' in scenarios and not args.webhook_secret: raise SystemError('The webhook scenario needs --webhook-secret')
+
+    connector = aiohttp.TCPConnector(limit=args.max_inflight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        results = []
+        for name in scenarios:
+            if args.warmup > 0: await run_scenario(session, args.base_url, name, generators[name](), args.rps, args.warmup, args.max_inflight)
+            results.append(await run_scenario(session, args.base_url, name, generators[name](), args.rps, args.duration, args.max_inflight))
+        report = {
+            'revision': git_revision(),
+            'timestamp': int(time.time()),
+            'base_url': args.base_url,
+            'logins': len(manifest['logins']),
+            'results': results,
+            'server_stats': await fetch_stats(session, args.base_url)
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output: Path(args.output).write_text(output)
+    print(output)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+import argparse, json, os, subprocess, sys, time, urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def wait_ready(url : str, timeout_s : float):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1): return True
+        except Exception: time.sleep(0.25)
+    return False
+
+def run_clients(args, base_url : str):
+    clients = []
+    for i in range(args.clients):
+        clients.append(subprocess.Popen([sys.executable, str(ROOT / 'benchmarks' / 'loadgen.py'), '--base-url', base_url, '--manifest', args.manifest,
+                                         '--scenarios', 'text', '--rps', str(args.rps / args.clients), '--duration', str(args.duration),
+                                         '--warmup', str(args.warmup), '--max-inflight', str(args.max_inflight)], stdout=subprocess.PIPE, text=True))
+    results = [json.loads(i.communicate()[0])['results'][0] for i in clients]
+    return {
+        'throughput_rps': round(sum(i['throughput_rps'] for i in results), 1),
+        'completed': sum(i['completed'] for i in results),
+        'dropped': sum(i['dropped'] for i in results),
+        'errors': sum(i['errors'] for i in results),
+        'p50_ms': max(i['latency_ms']['p50'] or 0 for i in results),
+        'p99_ms': max(i['latency_ms']['p99'] or 0 for i in results)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Start TXTForm with increasing WEB_WORKERS and measure text endpoint throughput. The server reads its configuration from the current environment.')
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('WEB_PORT', 8080)))
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--rps', type=float, default=5000)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--max-inflight', type=int, default=128)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    runs = []
+    for workers in [int(i) for i in args.workers.split(',')]:
+        env = dict(os.environ, WEB_WORKERS=str(workers), WEB_PORT=str(args.port))
+        server = subprocess.Popen([sys.executable, 'txtform.py'], cwd=ROOT / 'txtform', env=env, stdout=subprocess.DEVNULL)
+        try:
+            if not wait_ready(base_url + '/metrics', 60): raise SystemError(f'Server with {workers} workers did not start')
+            time.sleep(1)
+            runs.append({'workers': workers, **run_clients(args, base_url)})
+            print(json.dumps(runs[-1]), file=sys.stderr)
+        finally:
+            server.terminate()
+            server.wait(15)
+
+    report = {'cpus': os.cpu_count(), 'clients': args.clients, 'target_rps': args.rps, 'runs': runs}
+    output = json.dumps(report, indent=2)
+    if args.output: Path(args.output).write_text(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
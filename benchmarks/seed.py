@@ -0,0 +1,72 @@
+import argparse, asyncio, datetime, json, os, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'txtform'))
+import database, helper
+
+async def seed_login(db : database.Database, index : int, run_id : str, flows_count : int, states_count : int, components_count : int):
+    twitch_user_id = int(run_id, 36) % 10**9 * 10**6 + index
+    login = await db.register_login(f'bench{run_id}x{index}', 'Benchmark', twitch_user_id)
+    login = await db.get_login_by_id(login.id)
+    validity = datetime.datetime.now(datetime.UTC) + datetime.timedelta(hours=4)
+    twitch = await db.add_twitch_account(login, twitch_user_id, login.username, login.username, index % 2 == 0, 'fake-access', 'fake-refresh', [], validity)
+    spotify = await db.add_spotify_account(login, 'bench', f'bench{run_id}x{index}', 'fake-access', 'fake-refresh', ['user-read-currently-playing'], validity)
+    session = await db.create_login_session(login)
+
+    response_ids = []
+    for i in range(states_count):
+        response = await db.create_empty_response(login, f'resp{i}')
+        components = []
+        for j in range(components_count):
+            if j % 3 == 1: components.append({'type': 'spotifyCurrentSong', 'values': {'spotify_id': spotify.id}})
+            elif j % 3 == 2: components.append({'type': 'spotifyCurrentArtist', 'values': {'spotify_id': spotify.id}})
+            else: components.append({'type': 'text', 'values': {'text': f'component {j} '}})
+        await db.set_response_components(response, components)
+        response_ids.append(response.id)
+
+    flows = []
+    for i in range(flows_count):
+        flow = await db.create_empty_flow(login, f'flow{i}')
+        states = [{'response_id': response_id, 'condition': 'twitchLive', 'values': {'twitch_id': twitch.id}} for response_id in response_ids]
+        states[-1]['condition'] = 'always'
+        states[-1]['values'] = {}
+        await db.set_flow_states(flow, states)
+        flows.append({'id': flow.id, 'label': flow.label})
+
+    return {
+        'username': login.username,
+        'session': session.session_token,
+        'twitch_user_id': twitch_user_id,
+        'response_ids': response_ids,
+        'flows': flows
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description='Seed logins, flows, states and components for the load generator and write a manifest.')
+    parser.add_argument('--dsn', default=os.environ.get('POSTGRES_CONNECTION_STRING', None))
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--flows', type=int, default=3)
+    parser.add_argument('--states', type=int, default=3)
+    parser.add_argument('--components', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--output', default='bench_manifest.json')
+    args = parser.parse_args()
+    if not args.dsn: raise SystemError('Pass --dsn or set POSTGRES_CONNECTION_STRING')
+
+    db = database.Database(args.dsn, max_size=args.concurrency)
+    await db.startup()
+    run_id = helper.generate_string(6).lower()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async def bounded(index : int):
+        async with semaphore: return await seed_login(db, index, run_id, args.flows, args.states, args.components)
+
+    start = time.perf_counter()
+    logins = await asyncio.gather(*[bounded(i) for i in range(args.logins)])
+    await db.shutdown()
+
+    manifest = {'run_id': run_id, 'seeded_at': int(time.time()), 'logins': logins}
+    Path(args.output).write_text(json.dumps(manifest, indent=2))
+    print(json.dumps({'logins': len(logins), 'seconds': round(time.perf_counter() - start, 2), 'manifest': args.output}))
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import argparse, asyncio, json, multiprocessing, sys, time
+from pathlib import Path
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'txtform'))
+import static_assets
+
+STATIC_FOLDER = (Path(__file__).resolve().parent.parent / 'txtform' / 'web' / 'static').resolve()
+DEFAULT_PATHS = 'js/dashboard.js,css/dashboard.css,css/style.css,img/flow_preview.jpg'
+
+def serve(mode : str, port : int):
+    routes = web.RouteTableDef()
+    if mode == 'legacy':
+        @routes.get('/static/{path:.+}')
+        async def legacy(request : web.Request):
+            try: content_path = (STATIC_FOLDER / request.match_info['path']).resolve()
+            except Exception: return web.Response(status=403)
+            if not content_path.is_relative_to(STATIC_FOLDER): return web.Response(status=403)
+            if not content_path.is_file(): return web.Response(status=404)
+            return web.FileResponse(content_path)
+    else:
+        statics = static_assets.StaticAssets(STATIC_FOLDER)
+        statics.load()
+        @routes.get('/static/{path:.+}')
+        async def memory(request : web.Request):
+            asset = statics.get(static_assets.normalize_path(request.match_info['path']))
+            if asset is None: return web.Response(status=404)
+            encoding, body, etag = asset.select(request.headers.get('Accept-Encoding', ''))
+            if request.if_none_match and any(i.value == etag for i in request.if_none_match): response = web.Response(status=304)
+            else: response = web.Response(body=body, content_type=asset.content_type)
+            response.etag = etag
+            if encoding is not None and response.status == 200: response.headers['Content-Encoding'] = encoding
+            return response
+    app = web.Application()
+    app.add_routes(routes)
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+async def run(base_url : str, paths : list[str], headers : dict, revalidate : bool, concurrency : int, duration : float):
+    completed = 0
+    statuses = {}
+    transferred = 0
+    async with aiohttp.ClientSession(auto_decompress=False) as session:
+        etags = {}
+        if revalidate:
+            for path in paths:
+                async with session.get(f'{base_url}/static/{path}', headers=headers) as resp: etags[path] = resp.headers.get('ETag', '')
+        deadline = time.perf_counter() + duration
+        async def worker(offset : int):
+            nonlocal completed, transferred
+            index = offset
+            while time.perf_counter() < deadline:
+                path = paths[index % len(paths)]
+                index += 1
+                request_headers = {**headers, 'If-None-Match': etags[path]} if revalidate else headers
+                async with session.get(f'{base_url}/static/{path}', headers=request_headers) as resp:
+                    transferred += len(await resp.read())
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                completed += 1
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return {'rps': round(completed / elapsed, 1), 'kb_per_request': round(transferred / max(completed, 1) / 1024, 2), 'statuses': statuses}
+
+def wait_ready(base_url : str, path : str):
+    async def probe():
+        async with aiohttp.ClientSession() as session:
+            for _ in range(100):
+                try:
+                    async with session.get(f'{base_url}/static/{path}') as resp: return resp.status == 200
+                except aiohttp.ClientError: await asyncio.sleep(0.1)
+        return False
+    if not asyncio.run(probe()): raise SystemError(f'{base_url} is not serving /static/{path}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure static asset requests per second, plain, gzip and revalidated with If-None-Match.')
+    parser.add_argument('--base-url', default=None, help='benchmark a running TXTForm instead of starting a standalone server')
+    parser.add_argument('--serve', default='legacy,memory', help='standalone handlers to start and compare when --base-url is not given')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--paths', default=DEFAULT_PATHS)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+    paths = args.paths.split(',')
+
+    targets = [('server', args.base_url, None)] if args.base_url else [(mode, f'http://127.0.0.1:{args.port}', mode) for mode in args.serve.split(',')]
+    report = {'paths': paths, 'concurrency': args.concurrency, 'results': {}}
+    for name, base_url, mode in targets:
+        server = None
+        if mode is not None:
+            server = multiprocessing.Process(target=serve, args=(mode, args.port), daemon=True)
+            server.start()
+        try:
+            wait_ready(base_url, paths[0])
+            report['results'][name] = {
+                'identity': asyncio.run(run(base_url, paths, {'Accept-Encoding': 'identity'}, False, args.concurrency, args.duration)),
+                'gzip': asyncio.run(run(base_url, paths, {'Accept-Encoding': 'gzip, br'}, False, args.concurrency, args.duration)),
+                'revalidate': asyncio.run(run(base_url, paths, {'Accept-Encoding': 'gzip, br'}, True, args.concurrency, args.duration))
+            }
+            print(json.dumps({name: report['results'][name]}), file=sys.stderr)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.join(5)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
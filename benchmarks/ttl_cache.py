@@ -0,0 +1,45 @@
+import argparse, json, sys, time, tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'txtform'))
+import state_management
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure TTLCache store/get throughput and memory.')
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    cache = state_management.TTLCache(max_entries=args.keys)
+    value = {'current_song': 'song', 'current_artists': ['artist']}
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for i in range(args.keys): cache.store((1, i), value, 60)
+    store_elapsed = time.perf_counter() - start
+    memory_current, memory_peak = tracemalloc.get_traced_memory()
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for i in range(args.keys): cache.get((1, i))
+    get_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(args.keys): cache.store((2, i), value, 60)
+    evict_elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+
+    operations = args.keys * args.rounds
+    print(json.dumps({
+        'keys': args.keys,
+        'store_ops_per_s': round(operations / store_elapsed),
+        'get_ops_per_s': round(operations / get_elapsed),
+        'evicting_store_ops_per_s': round(args.keys / evict_elapsed),
+        'memory_bytes': memory_current,
+        'memory_peak_bytes': memory_peak,
+        'stats': cache.stats
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse, copy, json, random, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'txtform'))
+import validation
+from vendor.StructGuard import StructGuard
+
+def make_components(count : int):
+    kinds = [('text', lambda i: {'text': f'component {i} '}), ('spotifyCurrentSong', lambda i: {'spotify_id': '1'}), ('spotifyCurrentArtist', lambda i: {'spotify_id': '2'})]
+    components = []
+    for i in range(count):
+        kind, values = random.choice(kinds)
+        components.append({'type': kind, 'values': values(i)})
+    return components
+
+def make_states(count : int):
+    states = [{'condition': 'twitchLive', 'response_id': str(i + 1), 'values': {'twitch_id': '1'}} for i in range(count - 1)]
+    states.append({'condition': 'always', 'response_id': '1', 'values': {}})
+    return states
+
+def interpreted_components(components : list):
+    if StructGuard.INVALID == StructGuard.verifyListStructure(components, validation.COMPONENTS_STRUCTURE, rebuild=False)[0]: return False
+    for i in components:
+        match_format = validation.COMPONENT_VALUES_STRUCTURES.get(i['type'], None)
+        if match_format is None or StructGuard.INVALID == StructGuard.verifyDictStructure(i['values'], match_format, rebuild=False)[0]: return False
+    return True
+
+def compiled_components(components : list):
+    if validation.INVALID == validation.validate_components(components)[0]: return False
+    for i in components:
+        validate_values = validation.component_values_validators.get(i['type'], None)
+        if validate_values is None or validation.INVALID == validate_values(i['values'])[0]: return False
+    return True
+
+def interpreted_states(states : list):
+    if StructGuard.INVALID == StructGuard.verifyListStructure(states, validation.STATES_STRUCTURE, rebuild=False)[0]: return False
+    for i in states:
+        match_format = validation.STATE_VALUES_STRUCTURES.get(i['condition'], None)
+        if match_format is None or StructGuard.INVALID == StructGuard.verifyDictStructure(i['values'], match_format, rebuild=False)[0]: return False
+    return True
+
+def compiled_states(states : list):
+    if validation.INVALID == validation.validate_states(states)[0]: return False
+    for i in states:
+        validate_values = validation.state_values_validators.get(i['condition'], None)
+        if validate_values is None or validation.INVALID == validate_values(i['values'])[0]: return False
+    return True
+
+def measure(fn, payload : list, rounds : int):
+    copies = [copy.deepcopy(payload) for _ in range(rounds)]
+    start = time.perf_counter()
+    for i in copies: fn(i)
+    return round((time.perf_counter() - start) / rounds * 1e6, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare compiled and interpreted StructGuard validation of dashboard save payloads.')
+    parser.add_argument('--sizes', default='5,20,100')
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+    random.seed(0)
+
+    results = []
+    for size in [int(i) for i in args.sizes.split(',')]:
+        components, states = make_components(size), make_states(size)
+        if not compiled_components(copy.deepcopy(components)) or not compiled_states(copy.deepcopy(states)): raise SystemError('Payload did not validate')
+        results.append({
+            'items': size,
+            'components_us': {'interpreted': measure(interpreted_components, components, args.rounds), 'compiled': measure(compiled_components, components, args.rounds)},
+            'states_us': {'interpreted': measure(interpreted_states, states, args.rounds), 'compiled': measure(compiled_states, states, args.rounds)}
+        })
+    print(json.dumps({'rounds': args.rounds, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
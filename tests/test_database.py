@@ -0,0 +1,109 @@
+import asyncio, datetime, os, secrets
+import psycopg, pytest
+import database, migrations, objects
+
+DSN = os.environ.get('TXTFORM_TEST_DSN', None)
+pytestmark = pytest.mark.skipif(not DSN, reason='TXTFORM_TEST_DSN is not set')
+
+def run_with_db(test):
+    async def run():
+        db = database.Database(DSN, min_size=1, max_size=10, publish_events=False)
+        await db.startup()
+        try: await test(db)
+        finally: await db.shutdown()
+    asyncio.run(run())
+
+async def new_login(db : database.Database):
+    return await db.register_login('test' + secrets.token_hex(6), 'test', secrets.randbelow(2 ** 62))
+
+async def backfill_id_counters(conn : psycopg.AsyncConnection):
+    for statement in next(i[2] for i in migrations.MIGRATIONS if i[0] == 4): await conn.execute(statement)
+
+def test_concurrent_set_token_upserts():
+    async def test(db : database.Database):
+        validity = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0) + datetime.timedelta(hours=1)
+        tokens = await asyncio.gather(*[db.set_token('test_concurrent', f'value{i}', validity) for i in range(20)])
+        stored = await db.get_token('test_concurrent')
+        assert stored.token_value in {i.token_value for i in tokens}
+        await db.set_token('test_concurrent', 'final', validity)
+        assert (await db.get_token('test_concurrent')).token_value == 'final'
+    run_with_db(test)
+
+def test_concurrent_creates_allocate_unique_ids():
+    async def test(db : database.Database):
+        login = await new_login(db)
+        sessions = await asyncio.gather(*[db.create_login_session(login) for _ in range(30)])
+        responses = await asyncio.gather(*[db.create_empty_response(login, 'resp') for _ in range(30)])
+        flows = await asyncio.gather(*[db.create_empty_flow(login, 'flow') for _ in range(30)])
+        for created in (sessions, responses, flows):
+            assert sorted(i.id for i in created) == list(range(1, 31))
+    run_with_db(test)
+
+def test_deleted_ids_are_not_reused():
+    async def test(db : database.Database):
+        login = await new_login(db)
+        responses = [await db.create_empty_response(login, 'resp') for _ in range(3)]
+        flows = [await db.create_empty_flow(login, 'flow') for _ in range(3)]
+        await db.delete_response(responses[-1])
+        await db.delete_flow(flows[-1])
+        assert (await db.create_empty_response(login, 'resp')).id == 4
+        assert (await db.create_empty_flow(login, 'flow')).id == 4
+    run_with_db(test)
+
+def test_counter_backfill_continues_after_existing_ids():
+    async def test(db : database.Database):
+        login = await new_login(db)
+        async with await psycopg.AsyncConnection.connect(DSN) as conn:
+            await conn.execute('INSERT INTO response(id, label, login_id) SELECT i, %s, %s FROM generate_series(1, 5) i', ('legacy', login.id))
+            await conn.execute('INSERT INTO login_id_counter(login_id, kind, last_id) VALUES (%s, %s, 2)', (login.id, 'flow'))
+            await conn.execute('INSERT INTO flow(id, label, login_id) SELECT i, %s, %s FROM generate_series(1, 7) i', ('legacy', login.id))
+            await backfill_id_counters(conn)
+        await db.delete_response(objects.Response(5, 'legacy', login.id))
+        assert (await db.create_empty_response(login, 'resp')).id == 6
+        assert (await db.create_empty_flow(login, 'flow')).id == 8
+    run_with_db(test)
+
+def test_shared_spotify_now_playing():
+    async def test(db : database.Database):
+        login = await new_login(db)
+        validity = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        spotify = await db.add_spotify_account(login, None, 'user', 'access', 'refresh', [], validity)
+        assert await db.get_spotify_now_playing(login.id, spotify.id) is None
+        await db.set_spotify_now_playing(login.id, spotify.id, 'Song', ['A'], 10, 40)
+        current_song, current_artists, refresh_in_s = await db.get_spotify_now_playing(login.id, spotify.id)
+        assert (current_song, current_artists) == ('Song', ['A']) and 9 < refresh_in_s <= 10
+        await db.set_spotify_now_playing(login.id, spotify.id, None, None, 0, 0)
+        assert await db.get_spotify_now_playing(login.id, spotify.id) is None
+        await db.set_spotify_now_playing(login.id, spotify.id + 1, 'Song', ['A'], 10, 40)
+        assert await db.get_spotify_now_playing(login.id, spotify.id + 1) is None
+    run_with_db(test)
+
+def test_pool_exhaustion_fails_fast():
+    async def run():
+        db = database.Database(DSN, min_size=1, max_size=1, acquire_timeout=0.2, publish_events=False)
+        await db.startup()
+        try:
+            async with db._Database__pool.connection():
+                start = asyncio.get_running_loop().time()
+                with pytest.raises(database.DB_POOL_EXHAUSTED): await db.get_token('test_pool_exhaustion')
+                assert asyncio.get_running_loop().time() - start < 1
+            assert await db.get_token('test_pool_exhaustion') is None
+        finally: await db.shutdown()
+    asyncio.run(run())
+
+def test_event_version_ignores_rolled_back_publishes():
+    async def run():
+        db = database.Database(DSN, min_size=1, max_size=2)
+        await db.startup()
+        try:
+            login = await new_login(db)
+            await db.create_empty_response(login, 'resp')
+            before = await db.get_event_version()
+            async with await psycopg.AsyncConnection.connect(DSN) as conn:
+                async with conn.transaction(force_rollback=True):
+                    await conn.execute(database.PUBLISH_EVENTS_SQL, (['{"k":"test"}'], database.EVENT_SLOTS, database.EVENT_CHANNEL))
+            assert await db.get_event_version() == before
+            await db.delete_response(objects.Response(1, 'resp', login.id))
+            assert await db.get_event_version() > before
+        finally: await db.shutdown()
+    asyncio.run(run())
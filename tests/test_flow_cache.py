@@ -0,0 +1,43 @@
+import time
+import flow_cache, objects
+
+def resolution(login_id : int, flow_id : int):
+    return objects.FlowResolution(objects.Login(login_id, f'user{login_id}', None, None), objects.Flow(flow_id, f'flow{flow_id}', login_id, True), [], {}, {})
+
+def test_eviction_removes_least_recently_used():
+    cache = flow_cache.FlowCache(2)
+    cache.store('a', 'f', resolution(1, 1), cache.generation)
+    cache.store('b', 'f', resolution(2, 1), cache.generation)
+    assert cache.get('A', 'F')[0]
+    cache.store('c', 'f', resolution(3, 1), cache.generation)
+    assert cache.get('a', 'f')[0]
+    assert not cache.get('b', 'f')[0]
+    assert cache.get('c', 'f')[0]
+    assert cache.evictions == 1
+
+def test_missing_flows_are_cached_until_ttl_or_flow_change():
+    cache = flow_cache.FlowCache(10, negative_ttl_s=0.05)
+    cache.store('a', 'missing', None, cache.generation)
+    assert cache.get('a', 'missing') == (True, None)
+    time.sleep(0.06)
+    assert cache.get('a', 'missing') == (False, None)
+
+    cache = flow_cache.FlowCache(10)
+    cache.store('a', 'missing', None, cache.generation)
+    cache.store('a', 'kept', resolution(1, 1), cache.generation)
+    cache.invalidate_response(1, 5)
+    assert cache.get('a', 'missing') == (True, None)
+    cache.invalidate_flow(2, 7)
+    assert cache.get('a', 'missing') == (False, None)
+    assert cache.get('a', 'kept')[0]
+    cache.store('a', 'missing', None, cache.generation)
+    cache.invalidate_login(2)
+    assert cache.get('a', 'missing') == (False, None)
+
+def test_stale_generation_is_not_stored():
+    cache = flow_cache.FlowCache(10)
+    generation = cache.generation
+    cache.invalidate_flow(1, 1)
+    cache.store('a', 'f', None, generation)
+    cache.store('a', 'g', resolution(1, 1), generation)
+    assert cache.stats['entries'] == 0
@@ -0,0 +1,33 @@
+import asyncio, os
+import pytest
+import leader
+
+DSN = os.environ.get('TXTFORM_TEST_DSN', None)
+pytestmark = pytest.mark.skipif(not DSN, reason='TXTFORM_TEST_DSN is not set')
+
+async def wait_for(condition, timeout_s : float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout_s
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.05)
+
+def test_one_leader_and_takeover_after_stop():
+    async def run():
+        running = []
+        elections = [leader.LeaderElection(DSN, lock_id=7350199, check_interval_s=0.1) for _ in range(3)]
+        for index, election in enumerate(elections):
+            election.add_elected_handler(lambda index=index: running.append(index))
+            election.add_demoted_handler(lambda index=index: running.remove(index))
+            election.start()
+        try:
+            await wait_for(lambda: len(running) == 1)
+            await asyncio.sleep(0.5)
+            assert len(running) == 1
+            first = running[0]
+            await elections[first].stop()
+            await wait_for(lambda: len(running) == 1 and running[0] != first)
+            assert sum(i.leader for i in elections) == 1
+        finally:
+            for election in elections: await election.stop()
+        assert running == []
+    asyncio.run(run())
@@ -0,0 +1,55 @@
+import asyncio
+import objects, state_management
+
+class LiveStatusDB():
+    def __init__(self, statuses : list[tuple[int, int, int, bool]]):
+        self.statuses = statuses
+
+    async def get_twitch_live_statuses(self):
+        return self.statuses
+
+class NowPlayingDB():
+    def __init__(self, now_playing : dict[tuple[int, int], tuple[str, list[str], float]]):
+        self.now_playing = now_playing
+        self.lookups = 0
+
+    async def get_spotify_now_playing(self, login_id : int, spotify_id : int):
+        self.lookups += 1
+        return self.now_playing.get((login_id, spotify_id), None)
+
+def twitch_live_state(login_id : int, account_id : int):
+    return objects.FlowState(1, 1, login_id, 1, 'twitchLive', {'twitch_id': account_id})
+
+def test_twitch_event_then_live_event_updates_index():
+    async def run():
+        sm = state_management.StateManagement(LiveStatusDB([(1, 1, 100, False)]), None, '')
+        await sm.load_twitch_live_index()
+        state = twitch_live_state(7, 3)
+        assert await sm.get_first_active_state([state]) is None
+
+        sm.apply_event({'k': 'twitch', 'l': 7, 'a': 3, 'u': 700, 'v': False, 'o': 'other'})
+        assert await sm.get_first_active_state([state]) is None
+
+        sm.apply_event({'k': 'live', 'u': 700, 'v': True, 'o': 'other'})
+        assert await sm.get_first_active_state([state]) is state
+
+        sm.apply_event({'k': 'live', 'u': 700, 'v': False, 'o': 'other'})
+        assert await sm.get_first_active_state([state]) is None
+    asyncio.run(run())
+
+def test_twitch_event_ignored_until_index_loaded():
+    sm = state_management.StateManagement(LiveStatusDB([]), None, '')
+    sm.apply_event({'k': 'twitch', 'l': 7, 'a': 3, 'u': 700, 'v': True, 'o': 'other'})
+    assert not sm.twitch_live_index_loaded
+
+def test_shared_now_playing_is_read_without_calling_spotify():
+    async def run():
+        db = NowPlayingDB({(7, 2): ('Song', ['A', 'B', 'C'], 30.0)})
+        sm = state_management.StateManagement(db, None, '', shared_now_playing=True)
+        state = objects.FlowState(1, 1, 7, 1, 'always', {})
+        components = [objects.ResponseComponent(1, 1, 7, 'spotifyCurrentSong', {'spotify_id': 2}), objects.ResponseComponent(2, 1, 7, 'text', {'text': ' by '}),
+                      objects.ResponseComponent(3, 1, 7, 'spotifyCurrentArtist', {'spotify_id': 2})]
+        assert await sm.get_state_text_response(state, components) == 'Song by A, B & C'
+        assert await sm.get_state_text_response(state, components) == 'Song by A, B & C'
+        assert db.lookups == 1
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import gzip, zlib
+
+try: import brotli
+except ImportError: brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+ENCODINGS = ('br', 'gzip', 'deflate') if brotli is not None else ('gzip', 'deflate')
+EXECUTOR_MIN_BYTES = 1024 * 1024
+
+def parse_accept_encoding(header : str):
+    accepted = {}
+    for item in header.split(','):
+        token, _, params = item.strip().partition(';')
+        token = token.strip().lower()
+        if not token: continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try: quality = float(params[2:])
+            except ValueError: quality = 0.0
+        accepted[token] = quality
+    return accepted
+
+def negotiate(accept_encoding : str, available : tuple[str] = ENCODINGS):
+    if not accept_encoding: return None
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get('*', 0)
+    for encoding in available:
+        if accepted.get(encoding, wildcard) > 0: return encoding
+    return None
+
+def compress(body : bytes, encoding : str, *, best : bool = False):
+    if encoding == 'gzip': return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+    if encoding == 'deflate': return zlib.compress(body, 9 if best else 6)
+    if encoding == 'br' and brotli is not None: return brotli.compress(body, quality=11 if best else 4)
+    raise ValueError(f'Unsupported encoding {encoding}')
@@ -1,151 +1,171 @@
-import asyncio, json, datetime, time, secrets
-import psycopg
-import objects, helper
+import asyncio, json, datetime, time, secrets, hashlib
+import psycopg, psycopg_pool
+import objects, helper, flow_cache, session_cache, metrics, tracing, migrations
+
+EVENT_CHANNEL = 'txtform_events'
+EVENT_SLOTS = 64
+PUBLISH_EVENTS_SQL = '''WITH events AS (SELECT nextval('txtform_event_seq') AS seq, payload FROM unnest(%s::text[]) AS payload),
+                        slot AS (INSERT INTO cache_event_slot(slot, seq) SELECT mod(pg_backend_pid(), %s), MAX(seq) FROM events
+                                 ON CONFLICT (slot) DO UPDATE SET seq = GREATEST(cache_event_slot.seq, EXCLUDED.seq))
+                        SELECT pg_notify(%s, seq || ' ' || payload) FROM events ORDER BY seq'''
+COPY_THRESHOLD = 100
+RESPONSE_COMPONENT_COLUMNS = (('id', 'int'), ('response_id', 'int'), ('login_id', 'bigint'), ('resp_type', 'text'), ('variables', 'jsonb'))
+NEXT_ID_SQL = '''WITH next_id AS (INSERT INTO login_id_counter(login_id, kind, last_id) VALUES (%s, %s, 1)
+                 ON CONFLICT (login_id, kind) DO UPDATE SET last_id = login_id_counter.last_id + 1 RETURNING last_id)'''
+FLOW_STATE_COLUMNS = (('id', 'int'), ('flow_id', 'int'), ('login_id', 'bigint'), ('response_id', 'int'), ('flow_type', 'text'), ('variables', 'jsonb'))
 
 class DB_CONNECT_ERROR(Exception): pass
+class DB_POOL_EXHAUSTED(Exception): pass
 
+def session_key(session_token : str):
+    return hashlib.sha256(session_token.encode('utf-8')).hexdigest()[:32]
+
+class QueryCountingCursor(psycopg.AsyncCursor):
+    queries = 0
+
+    async def execute(self, *args, **kwargs):
+        QueryCountingCursor.queries += 1
+        return await super().execute(*args, **kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        QueryCountingCursor.queries += 1
+        return await super().executemany(*args, **kwargs)
+
+    def copy(self, *args, **kwargs):
+        QueryCountingCursor.queries += 1
+        return super().copy(*args, **kwargs)
+
+@metrics.timed_coroutines(metrics.DB_QUERY_SECONDS, metrics.DB_ERRORS)
 class Database:
-    def __init__(self, connectionStr : str):
-        self.__connectionStr = connectionStr
-        self.__adb : psycopg.AsyncConnection = None
-        self.__tryReconnectLock = asyncio.Lock()
-
-    async def startup(self):
-        if self.__adb is None or self.__adb.closed:
-            errorMsg = ''
-            try: self.__adb = await psycopg.AsyncConnection.connect(self.__connectionStr)
-            except Exception as e:
-                self.__adb = None
-                errorMsg = ' ' + e.args[0]
-            if self.__adb is None or self.__adb.closed: raise DB_CONNECT_ERROR('[DB] ERROR' + errorMsg)
-            print('[DB] Connected')
-            await self.__create_database()
-
-    async def __tryReconnect(self):
-        if self.__tryReconnectLock.locked():
-            async with self.__tryReconnectLock:
-                 if self.__adb is None or self.__adb.closed: raise SystemExit
-                 return
-        async with self.__tryReconnectLock:
-            loop = asyncio.get_event_loop()
-            loop.create_task(self.__tryReconnect())
-            tries = 1
-            while True:
-                try:
-                    print(f'Reconnect try {tries}')
-                    await self.startup()
-                    break
-                except DB_CONNECT_ERROR as e:
-                    print(f'Failed reconnect {tries}: {e.args[0]}')
-                    if tries == 7: raise SystemError('[DB] Failed reaching database')
-                    tries += 1
-                    await asyncio.sleep(10)
-
-    async def __create_database(self):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('''CREATE TABLE IF NOT EXISTS login(
-                                id BIGSERIAL PRIMARY KEY,
-                                username TEXT NOT NULL,
-                                primary_account_src TEXT NOT NULL,
-                                primary_account_id BIGINT NOT NULL
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS login_session(
-                                id INT,
-                                login_id BIGINT NOT NULL,
-                                session_token TEXT NOT NULL,
-                                validity TIMESTAMP NOT NULL,
-                                CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
-                                PRIMARY KEY(login_id, id)
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS twitch_account(
-                                id INT,
-                                login_id BIGINT NOT NULL,
-                                label TEXT NOT NULL,
-                                user_id BIGINT NOT NULL,
-                                username TEXT NOT NULL,
-                                display_name TEXT NOT NULL,
-                                is_live BOOLEAN NOT NULL,
-                                access_token TEXT NOT NULL,
-                                refresh_token TEXT NOT NULL,
-                                scopes JSONB NOT NULL,
-                                validity TIMESTAMP NOT NULL,
-                                CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
-                                PRIMARY KEY(login_id, id)
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS spotify_account(
-                                id INT,
-                                login_id BIGINT NOT NULL,
-                                label TEXT NOT NULL,
-                                user_id TEXT NOT NULL,
-                                access_token TEXT NOT NULL,
-                                refresh_token TEXT NOT NULL,
-                                scopes JSONB NOT NULL,
-                                validity TIMESTAMP NOT NULL,
-                                id_token TEXT NOT NULL,
-                                CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
-                                PRIMARY KEY(login_id, id)
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS response(
-                                id INT,
-                                label TEXT NOT NULL,
-                                login_id BIGINT NOT NULL,
-                                CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
-                                PRIMARY KEY(login_id, id)
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS response_component(
-                                id INT,
-                                response_id INT NOT NULL,
-                                login_id BIGINT NOT NULL,
-                                resp_type TEXT NOT NULL,
-                                variables JSONB NOT NULL,
-                                CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
-                                CONSTRAINT fk_response FOREIGN KEY(response_id, login_id) REFERENCES response(id, login_id),
-                                PRIMARY KEY(login_id, response_id, id)
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS flow(
-                                id INT,
-                                label TEXT NOT NULL,
-                                login_id BIGINT NOT NULL,
-                                enabled BOOLEAN NOT NULL DEFAULT True,
-                                CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
-                                PRIMARY KEY(login_id, id)
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS flow_state(
-                                id INT,
-                                flow_id INT NOT NULL,
-                                login_id BIGINT NOT NULL,
-                                response_id INT,
-                                flow_type TEXT,
-                                variables JSONB NOT NULL,
-                                CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
-                                CONSTRAINT fk_flow FOREIGN KEY(flow_id, login_id) REFERENCES flow(id, login_id),
-                                CONSTRAINT fk_response FOREIGN KEY(response_id, login_id) REFERENCES response(id, login_id),
-                                PRIMARY KEY(login_id, flow_id, id)
-                                )''')
-                await c.execute('''CREATE TABLE IF NOT EXISTS token(
-                                token_name TEXT PRIMARY KEY,
-                                token_value TEXT NOT NULL,
-                                validity TIMESTAMP NOT NULL
-                                )''')
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+    def __init__(self, connectionStr : str, *, min_size : int = 2, max_size : int = 10, acquire_timeout : float = 10.0, max_retries : int = 7, flow_cache_size : int = 10000, publish_events : bool = True,
+                 session_cache_ttl : float = 60, session_negative_ttl : float = 30, session_flush_interval : float = 10, flow_negative_ttl : float = 10):
+        self.__pool = psycopg_pool.AsyncConnectionPool(connectionStr, min_size=min_size, max_size=max_size, timeout=acquire_timeout,
+                                                       check=psycopg_pool.AsyncConnectionPool.check_connection, open=False,
+                                                       kwargs={'cursor_factory': QueryCountingCursor})
+        self.__max_retries = max_retries
+        self.__flow_cache = flow_cache.FlowCache(flow_cache_size, flow_negative_ttl)
+        self.__session_cache = session_cache.SessionCache(session_cache_ttl, session_negative_ttl)
+        self.__session_flush_interval = session_flush_interval
+        self.__session_flush_task : asyncio.Task = None
+        self.__publish_events = publish_events
+        self.__origin = secrets.token_hex(6)
+
+    async def startup(self, *, create_schema : bool = True):
+        if not self.__pool.closed: return
+        try:
+            await self.__pool.open(wait=True)
+        except Exception as e:
+            await self.__pool.close()
+            raise DB_CONNECT_ERROR('[DB] ERROR ' + str(e))
+        print('[DB] Connected')
+        if create_schema: await self.__migrate()
+        if self.__session_cache.enabled: self.__session_flush_task = asyncio.ensure_future(self.__session_flush_loop())
+
+    async def shutdown(self):
+        if self.__session_flush_task is not None:
+            self.__session_flush_task.cancel()
+            await asyncio.gather(self.__session_flush_task, return_exceptions=True)
+            self.__session_flush_task = None
+            await self.flush_session_extensions()
+        await self.__pool.close()
+
+    @property
+    def query_count(self): return QueryCountingCursor.queries
+
+    def cache_stats(self):
+        return {'flow': self.__flow_cache.stats, 'session': self.__session_cache.stats}
+
+    @property
+    def origin(self): return self.__origin
+
+    def apply_event(self, event : dict):
+        kind = event.get('k', None)
+        if kind == 'flow': self.__flow_cache.invalidate_flow(event['l'], event['f'])
+        elif kind == 'resp': self.__flow_cache.invalidate_response(event['l'], event['r'])
+        elif kind == 'login':
+            self.__flow_cache.invalidate_login(event['l'])
+            self.__session_cache.evict_login(event['l'])
+        elif kind == 'session': self.__session_cache.evict(event['t'])
+
+    def clear_caches(self):
+        self.__flow_cache.clear()
+        self.__session_cache.clear()
+
+    async def get_event_version(self):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT COALESCE(MAX(seq), 0) FROM cache_event_slot')
+                    data = await c.fetchone()
+                    await c.close()
+                    return data[0]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def __publish(self, c : psycopg.AsyncCursor, kind : str, **data):
+        await self.__publish_many(c, [(kind, data)])
+
+    async def __publish_many(self, c : psycopg.AsyncCursor, events : list[tuple[str, dict]]):
+        if not self.__publish_events or not events: return
+        payloads = [json.dumps({**data, 'k': kind, 'o': self.__origin}, separators=(',', ':')) for kind, data in events]
+        await c.execute(PUBLISH_EVENTS_SQL, (payloads, EVENT_SLOTS, EVENT_CHANNEL), prepare=True)
+
+    async def __retry(self, tries : int, error : psycopg.OperationalError):
+        if isinstance(error, psycopg_pool.PoolTimeout): raise DB_POOL_EXHAUSTED('[DB] No pooled connection available') from error
+        tries += 1
+        print(f'[DB] Connection failed, retry {tries}')
+        if tries >= self.__max_retries: raise SystemError('[DB] Failed reaching database')
+        await asyncio.sleep(min(tries, 5))
+        return tries
+
+    async def __migrate(self):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    try:
+                        await c.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+                        version = (await c.fetchone())[0]
+                    except psycopg.errors.UndefinedTable: version = 0
+                    await conn.rollback()
+                    if version >= migrations.LATEST_VERSION:
+                        await c.close()
+                        return
+                    async with conn.transaction():
+                        await c.execute('SELECT pg_advisory_xact_lock(%s)', (migrations.LOCK_ID,))
+                        await c.execute('''CREATE TABLE IF NOT EXISTS schema_version(
+                                        version INT PRIMARY KEY,
+                                        name TEXT NOT NULL,
+                                        applied_at TIMESTAMP NOT NULL DEFAULT now()
+                                        )''')
+                        await c.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+                        version = (await c.fetchone())[0]
+                        for migration_version, name, statements in migrations.MIGRATIONS:
+                            if migration_version <= version: continue
+                            for i in statements: await c.execute(i)
+                            await c.execute('INSERT INTO schema_version(version, name) VALUES (%s, %s)', (migration_version, name))
+                            print(f'[DB] Applied migration {migration_version} ({name})')
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_taken_usernames(self, username : str):
         parsed_username = helper.strip_string(username, helper.BASE_CHARS)
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT username FROM login WHERE username ~ %s', (fr'^{parsed_username}\d*$',))
-                data = await c.fetchall()
-                await c.close()
-                return [i[0] for i in data]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT username FROM login WHERE username ~ %s', (fr'^{parsed_username}\d*$',))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [i[0] for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def register_login(self, username : str, primary_account_src : str, primary_account_id : int):
         account = await self.get_login(primary_account_src, primary_account_id)
@@ -155,455 +175,816 @@ class Database:
         if len(parsed_username) == 0: parsed_username = helper.generate_string(7)
         taken_usernames = await self.get_taken_usernames(parsed_username)
         unique_username = helper.unique_string(parsed_username, taken_usernames)
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('INSERT INTO login(username, primary_account_src, primary_account_id) VALUES(%s, %s, %s) RETURNING id', (username, primary_account_src, primary_account_id))
-                last_id = await c.fetchone()
-                await self.__adb.commit()
-                await c.close()
-                return objects.Login(last_id[0], unique_username, None, None)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('INSERT INTO login(username, primary_account_src, primary_account_id) VALUES(%s, %s, %s) RETURNING id', (username, primary_account_src, primary_account_id))
+                    last_id = await c.fetchone()
+                    await conn.commit()
+                    await c.close()
+                    return objects.Login(last_id[0], unique_username, None, None)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_login(self, platform : str, account_id : int):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, username, primary_account_src, primary_account_id FROM login WHERE primary_account_src = %s AND primary_account_id = %s LIMIT 1', (platform, account_id))
-                data = await c.fetchone()
-                await c.close()
-                return None if data is None else objects.Login(data[0], data[1], data[2], data[3])
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, username, primary_account_src, primary_account_id FROM login WHERE primary_account_src = %s AND primary_account_id = %s LIMIT 1', (platform, account_id))
+                    data = await c.fetchone()
+                    await c.close()
+                    return None if data is None else objects.Login(data[0], data[1], data[2], data[3])
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_login_by_username(self, username : str):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, username, primary_account_src, primary_account_id FROM login WHERE username ILIKE %s LIMIT 1', (username,))
-                data = await c.fetchone()
-                await c.close()
-                return None if data is None else objects.Login(data[0], data[1], data[2], data[3])
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, username, primary_account_src, primary_account_id FROM login WHERE lower(username) = lower(%s) LIMIT 1', (username,))
+                    data = await c.fetchone()
+                    await c.close()
+                    return None if data is None else objects.Login(data[0], data[1], data[2], data[3])
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_login_by_id(self, _id : int):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, username, primary_account_src, primary_account_id FROM login WHERE id = %s LIMIT 1', (_id,))
-                data = await c.fetchone()
-                await c.close()
-                return None if data is None else objects.Login(data[0], data[1], data[2], data[3])
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, username, primary_account_src, primary_account_id FROM login WHERE id = %s LIMIT 1', (_id,))
+                    data = await c.fetchone()
+                    await c.close()
+                    return None if data is None else objects.Login(data[0], data[1], data[2], data[3])
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def update_username(self, login : objects.Login, username : str):
         parsed_username = helper.strip_string(username, helper.BASE_CHARS)
         taken_usernames = await self.get_taken_usernames(parsed_username)
         unique_username = helper.unique_string(parsed_username, taken_usernames)
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE login SET username = %s WHERE id = %s', (unique_username, login.id))
-                await self.__adb.commit()
-                await c.close()
-                return objects.Login(login.id, unique_username, login.primary_account_src, login.primary_account_id)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE login SET username = %s WHERE id = %s', (unique_username, login.id))
+                    await self.__publish(c, 'login', l=login.id)
+                    await conn.commit()
+                    self.__flow_cache.invalidate_login(login.id)
+                    self.__session_cache.evict_login(login.id)
+                    await c.close()
+                    return objects.Login(login.id, unique_username, login.primary_account_src, login.primary_account_id)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def create_login_session(self, login : objects.Login):
-        while True:
-            try:
-                new_session_token = f'{login.id}x{secrets.token_hex(20)}'
-                validity = datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=30)
-                c = self.__adb.cursor()
-                await c.execute('''INSERT INTO login_session(id, login_id, session_token, validity)
-                                SELECT COALESCE(MAX(id)+1, 1), %s, %s, %s FROM login_session WHERE login_id = %s RETURNING id''', (login.id, new_session_token, validity, login.id))
-                last_id = await c.fetchone()
-                await self.__adb.commit()
-                await c.close()
-                return objects.Login_Session(last_id[0], login.id, new_session_token, validity)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    new_session_token = f'{login.id}x{secrets.token_hex(20)}'
+                    validity = datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=30)
+                    c = conn.cursor()
+                    await c.execute(f'''{NEXT_ID_SQL} INSERT INTO login_session(id, login_id, session_token, validity)
+                                    SELECT last_id, %s, %s, %s FROM next_id RETURNING id''', (login.id, 'login_session', login.id, new_session_token, validity))
+                    last_id = await c.fetchone()
+                    await conn.commit()
+                    await c.close()
+                    return objects.Login_Session(last_id[0], login.id, new_session_token, validity)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def delete_login_session(self, session_token : str):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('DELETE FROM login_session WHERE session_token = %s', (session_token,))
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('DELETE FROM login_session WHERE session_token = %s', (session_token,))
+                    await self.__publish(c, 'session', t=session_key(session_token))
+                    await conn.commit()
+                    self.__session_cache.evict(session_key(session_token))
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_login_by_session(self, session_token : str):
         if session_token is None: return None
-        while True:
-            try:
-                c = self.__adb.cursor()
-                ts = datetime.datetime.now(datetime.UTC)
-                await c.execute('''SELECT login.id, login.username, login.primary_account_src, login.primary_account_id, login_session.validity, login_session.id FROM login
-                                   LEFT JOIN login_session
-                                   ON login_session.login_id = login.id
-                                   WHERE login_session.session_token = %s AND login_session.validity > %s
-                                   LIMIT 1
-                                ''', (session_token, ts))
-                data = await c.fetchone()
-                if data is None: return None
-                update_at_time = datetime.datetime.now(datetime.UTC) + datetime.timedelta(hours=3)
-                update_to_time = update_at_time + datetime.timedelta(hours=3)
-                dbtime = data[4].replace(tzinfo=datetime.UTC)
-                if update_at_time > dbtime:
-                    await c.execute('UPDATE login_session SET validity = %s WHERE id = %s', (update_to_time, data[5]))
-                    await self.__adb.commit()
-                await c.close()
-                return objects.Login(data[0], data[1], data[2], data[3]) if data is not None else None
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        key = session_key(session_token)
+        found, login, session_id, validity = self.__session_cache.get(key)
+        if not found:
+            generation = self.__session_cache.generation
+            data = await self.__load_login_session(session_token)
+            if data is None:
+                self.__session_cache.store(key, generation, None)
+                return None
+            login, session_id, validity = data
+            self.__session_cache.store(key, generation, login, session_id, validity)
+        if login is None: return None
+
+        now = datetime.datetime.now(datetime.UTC)
+        if validity <= now:
+            self.__session_cache.evict(key)
+            return None
+        update_at_time = now + datetime.timedelta(hours=3)
+        if update_at_time > validity:
+            update_to_time = update_at_time + datetime.timedelta(hours=3)
+            if self.__session_cache.enabled: self.__session_cache.extend(key, login.id, session_id, update_to_time)
+            else: await self.__extend_login_sessions({(login.id, session_id): update_to_time})
+        return login
+
+    async def __load_login_session(self, session_token : str):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    ts = datetime.datetime.now(datetime.UTC)
+                    await c.execute('''SELECT login.id, login.username, login.primary_account_src, login.primary_account_id, login_session.validity, login_session.id FROM login
+                                       LEFT JOIN login_session
+                                       ON login_session.login_id = login.id
+                                       WHERE login_session.session_token = %s AND login_session.validity > %s
+                                       LIMIT 1
+                                    ''', (session_token, ts))
+                    data = await c.fetchone()
+                    await c.close()
+                    if data is None: return None
+                    return objects.Login(data[0], data[1], data[2], data[3]), data[5], data[4].replace(tzinfo=datetime.UTC)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def flush_session_extensions(self):
+        pending = self.__session_cache.take_pending()
+        if not pending: return 0
+        try: await self.__extend_login_sessions(pending)
+        except Exception:
+            self.__session_cache.restore_pending(pending)
+            raise
+        return len(pending)
+
+    async def __extend_login_sessions(self, pending : dict[tuple[int, int], datetime.datetime]):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('''UPDATE login_session SET validity = GREATEST(login_session.validity, v.validity)
+                                       FROM unnest(%s::bigint[], %s::int[], %s::timestamptz[]) AS v(login_id, id, validity)
+                                       WHERE login_session.login_id = v.login_id AND login_session.id = v.id''',
+                                    ([i[0] for i in pending], [i[1] for i in pending], list(pending.values())))
+                    await conn.commit()
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def __session_flush_loop(self):
+        while True:
+            await asyncio.sleep(self.__session_flush_interval)
+            try: await self.flush_session_extensions()
+            except Exception as e: print(f'[DB] session flush failed: {e}')
 
     async def bind_primary_account(self, login : objects.Login, primary_account_src : str, primary_account_id : int):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE login SET primary_account_src = %s, primary_account_id = %s WHERE id = %s', (login.id, primary_account_src, primary_account_id))
-                await self.__adb.commit()
-                await c.close()
-                login.primary_account_src = primary_account_src
-                login.primary_account_id = primary_account_id
-                return login
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE login SET primary_account_src = %s, primary_account_id = %s WHERE id = %s', (primary_account_src, primary_account_id, login.id))
+                    await self.__publish(c, 'login', l=login.id)
+                    await conn.commit()
+                    self.__session_cache.evict_login(login.id)
+                    await c.close()
+                    login.primary_account_src = primary_account_src
+                    login.primary_account_id = primary_account_id
+                    return login
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_twitch_accounts_by_login(self, login : objects.Login):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity FROM twitch_account WHERE login_id = %s', (login.id, ))
-                data = await c.fetchall()
-                await c.close()
-                return [objects.Twitch(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8], i[9], i[10]) for i in data]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity FROM twitch_account WHERE login_id = %s', (login.id, ))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.Twitch(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8], i[9], i[10]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_twitch_accounts_by_user_id(self, user_id : int):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity FROM twitch_account WHERE user_id = %s', (user_id, ))
-                data = await c.fetchall()
-                await c.close()
-                return [objects.Twitch(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8], i[9], i[10]) for i in data]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity FROM twitch_account WHERE user_id = %s', (user_id, ))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.Twitch(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8], i[9], i[10]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
-    async def update_twitch_account_live_status_by_uid(self, live_state : bool, user_id : int):
+    async def get_twitch_live_statuses(self):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE twitch_account SET is_live = %s WHERE user_id = %s', (live_state, user_id))
-                await c.close()
-                await self.__adb.commit()
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT login_id, id, user_id, is_live FROM twitch_account')
+                    data = await c.fetchall()
+                    await c.close()
+                    return [(i[0], i[1], i[2], i[3]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def update_twitch_account_live_status_by_uid(self, live_state : bool, user_id : int):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE twitch_account SET is_live = %s WHERE user_id = %s', (live_state, user_id))
+                    await self.__publish(c, 'live', u=user_id, v=live_state)
+                    await c.close()
+                    await conn.commit()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def get_twitch_accounts_expiring(self, before : datetime.datetime, limit : int):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity FROM twitch_account WHERE validity < %s ORDER BY validity LIMIT %s',
+                                    (before, limit))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.Twitch(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8], i[9], i[10]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def update_twitch_tokens_batch(self, twitch_accounts : list[objects.Twitch]):
+        if not twitch_accounts: return
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.executemany('UPDATE twitch_account SET access_token = %s, refresh_token = %s, scopes = %s, validity = %s WHERE login_id = %s AND id = %s',
+                                        [(i.access_token, i.refresh_token, json.dumps(i.scopes), i.validity, i.login_id, i.id) for i in twitch_accounts])
+                    await conn.commit()
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def add_twitch_account(self, login : objects.Login, user_id : int, username : str, display_name : str, is_live : bool, access_token : str, refresh_token : str, scopes : list[str], validity : datetime.datetime):
         accounts = await self.get_twitch_accounts_by_login(login)
         match = helper.find_by_key('user_id', user_id, accounts)
         if match: return match
 
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('''INSERT INTO twitch_account(id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity)
-                                SELECT COALESCE(MAX(id)+1, 1), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s FROM twitch_account WHERE login_id = %s RETURNING id''',
-                                (login.id, username, user_id, username, display_name, is_live, access_token, refresh_token, json.dumps(scopes), validity, login.id))
-                last_id = await c.fetchone()
-                await self.__adb.commit()
-                await c.close()
-                return objects.Twitch(last_id[0], login.id, username, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute(f'''{NEXT_ID_SQL} INSERT INTO twitch_account(id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity)
+                                    SELECT last_id, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s FROM next_id RETURNING id''',
+                                    (login.id, 'twitch_account', login.id, username, user_id, username, display_name, is_live, access_token, refresh_token, json.dumps(scopes), validity))
+                    last_id = await c.fetchone()
+                    await self.__publish(c, 'twitch', l=login.id, a=last_id[0], u=user_id, v=is_live)
+                    await conn.commit()
+                    await c.close()
+                    return objects.Twitch(last_id[0], login.id, username, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_spotify_accounts_by_login(self, login : objects.Login):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token FROM spotify_account WHERE login_id = %s',
-                                (login.id,))
-                accounts = await c.fetchall()
-                await c.close()
-                return [objects.Spotify(data[0], data[1], data[2], data[3], data[4], data[5], data[6], data[7], data[8]) for data in accounts]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token FROM spotify_account WHERE login_id = %s',
+                                    (login.id,))
+                    accounts = await c.fetchall()
+                    await c.close()
+                    return [objects.Spotify(data[0], data[1], data[2], data[3], data[4], data[5], data[6], data[7], data[8]) for data in accounts]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_spotify_account_by_id_token(self, id_token : str):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token FROM spotify_account WHERE id_token = %s',
-                                (id_token,))
-                account = await c.fetchone()
-                await c.close()
-                return objects.Spotify(account[0], account[1], account[2], account[3], account[4], account[5], account[6], account[7], account[8]) if account else None
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token FROM spotify_account WHERE id_token = %s',
+                                    (id_token,))
+                    account = await c.fetchone()
+                    await c.close()
+                    return objects.Spotify(account[0], account[1], account[2], account[3], account[4], account[5], account[6], account[7], account[8]) if account else None
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def get_spotify_accounts_in_enabled_flows(self):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('''SELECT sa.id, sa.label, sa.login_id, sa.user_id, sa.access_token, sa.refresh_token, sa.scopes, sa.validity, sa.id_token FROM spotify_account sa
+                                    WHERE EXISTS (
+                                        SELECT 1 FROM response_component rc
+                                        JOIN flow_state fs ON fs.login_id = rc.login_id AND fs.response_id = rc.response_id
+                                        JOIN flow f ON f.login_id = fs.login_id AND f.id = fs.flow_id
+                                        WHERE rc.login_id = sa.login_id AND f.enabled
+                                        AND rc.resp_type IN ('spotifyCurrentSong', 'spotifyCurrentArtist')
+                                        AND rc.variables->>'spotify_id' = sa.id::TEXT
+                                    )''')
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.Spotify(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def get_spotify_now_playing(self, login_id : int, spotify_id : int):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('''SELECT current_song, current_artists, EXTRACT(EPOCH FROM refresh_at - now()::TIMESTAMP)::FLOAT FROM spotify_now_playing
+                                    WHERE login_id = %s AND spotify_id = %s AND expires_at > now()::TIMESTAMP''', (login_id, spotify_id), prepare=True)
+                    data = await c.fetchone()
+                    await c.close()
+                    return data
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def set_spotify_now_playing(self, login_id : int, spotify_id : int, current_song : str | None, current_artists : list[str] | None, refresh_in_s : float, expires_in_s : float):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('''INSERT INTO spotify_now_playing(login_id, spotify_id, current_song, current_artists, refresh_at, expires_at)
+                                    SELECT login_id, id, %s, %s, now()::TIMESTAMP + make_interval(secs => %s), now()::TIMESTAMP + make_interval(secs => %s)
+                                    FROM spotify_account WHERE login_id = %s AND id = %s
+                                    ON CONFLICT (login_id, spotify_id) DO UPDATE SET current_song = EXCLUDED.current_song, current_artists = EXCLUDED.current_artists,
+                                    refresh_at = EXCLUDED.refresh_at, expires_at = EXCLUDED.expires_at''',
+                                    (current_song, None if current_artists is None else json.dumps(current_artists), refresh_in_s, expires_in_s, login_id, spotify_id), prepare=True)
+                    await conn.commit()
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def add_spotify_account(self, login : objects.Login, label : str | None, user_id : str, access_token : str, refresh_token : str, scopes : list[str], validity : datetime.datetime):
         accounts = await self.get_spotify_accounts_by_login(login)
         match = helper.find_by_key('user_id', user_id, accounts)
         if match: return match
         id_token = f'{login.id}x{user_id}x{secrets.token_hex(20)}'
-        while True:
-            try:
-                if label is None: label = str(int(time.time()))
-                c = self.__adb.cursor()
-                await c.execute('''INSERT INTO spotify_account(id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token)
-                                SELECT COALESCE(MAX(id)+1, 1), %s, %s, %s, %s, %s, %s, %s, %s FROM spotify_account WHERE login_id = %s RETURNING id''',
-                                (label, login.id, user_id, access_token, refresh_token, json.dumps(scopes), validity, id_token, login.id))
-                last_id = await c.fetchone()
-                await self.__adb.commit()
-                await c.close()
-                return objects.Spotify(last_id, label, login.id, user_id, access_token, refresh_token, scopes, validity, id_token)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    if label is None: label = str(int(time.time()))
+                    c = conn.cursor()
+                    await c.execute(f'''{NEXT_ID_SQL} INSERT INTO spotify_account(id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token)
+                                    SELECT last_id, %s, %s, %s, %s, %s, %s, %s, %s FROM next_id RETURNING id''',
+                                    (login.id, 'spotify_account', label, login.id, user_id, access_token, refresh_token, json.dumps(scopes), validity, id_token))
+                    last_id = await c.fetchone()
+                    await conn.commit()
+                    await c.close()
+                    return objects.Spotify(last_id[0], label, login.id, user_id, access_token, refresh_token, scopes, validity, id_token)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def update_spotify_tokens(self, spotify_account : objects.Spotify, access_token : str, refresh_token : str, scopes : list[str], validity : datetime.datetime):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE spotify_account SET access_token = %s, refresh_token = %s, scopes = %s, validity = %s WHERE login_id = %s AND id = %s', (access_token, refresh_token, json.dumps(scopes), validity, spotify_account.login_id, spotify_account.id))
-                await self.__adb.commit()
-                await c.close()
-                return objects.Spotify(spotify_account.id, spotify_account.label, spotify_account.login_id, spotify_account.user_id, access_token, refresh_token, scopes, validity)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE spotify_account SET access_token = %s, refresh_token = %s, scopes = %s, validity = %s WHERE login_id = %s AND id = %s', (access_token, refresh_token, json.dumps(scopes), validity, spotify_account.login_id, spotify_account.id))
+                    await self.__publish(c, 'spotify', l=spotify_account.login_id, a=spotify_account.id)
+                    await conn.commit()
+                    await c.close()
+                    return objects.Spotify(spotify_account.id, spotify_account.label, spotify_account.login_id, spotify_account.user_id, access_token, refresh_token, scopes, validity, spotify_account.id_token)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def update_spotify_tokens_batch(self, spotify_accounts : list[objects.Spotify]):
+        if not spotify_accounts: return
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.executemany('UPDATE spotify_account SET access_token = %s, refresh_token = %s, scopes = %s, validity = %s WHERE login_id = %s AND id = %s',
+                                        [(i.access_token, i.refresh_token, json.dumps(i.scopes), i.validity, i.login_id, i.id) for i in spotify_accounts])
+                    await self.__publish_many(c, [('spotify', {'l': i.login_id, 'a': i.id}) for i in spotify_accounts])
+                    await conn.commit()
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def get_spotify_accounts_expiring(self, before : datetime.datetime, limit : int):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token FROM spotify_account WHERE validity < %s ORDER BY validity LIMIT %s',
+                                    (before, limit))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.Spotify(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def remove_spotify_account(self, spotify_account : objects.Spotify):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('DELETE FROM spotify_account WHERE login_id = %s AND id = %s', (spotify_account.login_id, spotify_account.id))
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('DELETE FROM spotify_account WHERE login_id = %s AND id = %s', (spotify_account.login_id, spotify_account.id))
+                    await self.__publish(c, 'spotify', l=spotify_account.login_id, a=spotify_account.id)
+                    await conn.commit()
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_all_login_responses(self, login : objects.Login):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, label, login_id FROM response WHERE login_id = %s', (login.id,))
-                data = await c.fetchall()
-                await c.close()
-                return [objects.Response(i[0], i[1], i[2]) for i in data]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, label, login_id FROM response WHERE login_id = %s', (login.id,))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.Response(i[0], i[1], i[2]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def create_empty_response(self, login : objects.Login, resp_name : str):
         resps = await self.get_all_login_responses(login)
         names = [i.label for i in resps]
         unique_name = helper.unique_string(resp_name, names)
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('''
-                                INSERT INTO response(id, label, login_id)
-                                SELECT COALESCE(MAX(id)+1, 1), %s, %s FROM response WHERE login_id = %s RETURNING id
-                                ''', (unique_name, login.id, login.id))
-                last_id = await c.fetchone()
-                await self.__adb.commit()
-                await c.close()
-                return objects.Response(last_id[0], unique_name, login.id)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute(f'''{NEXT_ID_SQL}
+                                    INSERT INTO response(id, label, login_id)
+                                    SELECT last_id, %s, %s FROM next_id RETURNING id
+                                    ''', (login.id, 'response', unique_name, login.id))
+                    last_id = await c.fetchone()
+                    await conn.commit()
+                    await c.close()
+                    return objects.Response(last_id[0], unique_name, login.id)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def delete_response(self, response : objects.Response):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE flow_state SET response_id = NULL WHERE response_id = %s AND login_id = %s', (response.id, response.login_id))
-                await c.execute('DELETE FROM response_component WHERE response_id = %s AND login_id = %s', (response.id, response.login_id))
-                await c.execute('DELETE FROM response WHERE login_id = %s AND id = %s', (response.login_id, response.id))
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE flow_state SET response_id = NULL WHERE response_id = %s AND login_id = %s', (response.id, response.login_id))
+                    await c.execute('DELETE FROM response_component WHERE response_id = %s AND login_id = %s', (response.id, response.login_id))
+                    await c.execute('DELETE FROM response WHERE login_id = %s AND id = %s', (response.login_id, response.id))
+                    await self.__publish(c, 'resp', l=response.login_id, r=response.id)
+                    await conn.commit()
+                    self.__flow_cache.invalidate_response(response.login_id, response.id)
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def update_response_label(self, response : objects.Response, label : str):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id FROM response WHERE login_id = %s AND label ILIKE %s LIMIT 1', (response.login_id, label))
-                data = await c.fetchone()
-                if data is not None: return
-                await c.execute('UPDATE response SET label = %s WHERE login_id = %s AND id = %s', (label, response.login_id, response.id))
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id FROM response WHERE login_id = %s AND label ILIKE %s LIMIT 1', (response.login_id, label))
+                    data = await c.fetchone()
+                    if data is not None: return
+                    await c.execute('UPDATE response SET label = %s WHERE login_id = %s AND id = %s', (label, response.login_id, response.id))
+                    await self.__publish(c, 'resp', l=response.login_id, r=response.id)
+                    await conn.commit()
+                    self.__flow_cache.invalidate_response(response.login_id, response.id)
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def set_response_components(self, response : objects.Response, components : list):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                insert_str = 'INSERT INTO response_component(id, response_id, login_id, resp_type, variables) VALUES (%s, %s, %s, %s, %s)'
-                sql_data = [('DELETE FROM response_component WHERE response_id = %s AND login_id = %s', (response.id, response.login_id))]
-                for index, i in enumerate(components):
-                    sql_data.append((insert_str, (index+1, response.id, response.login_id, i['type'], json.dumps(i['values']))))
-                sql_str = self.__mogrify_sql(sql_data)
-                await c.execute(sql_str)
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    rows = [(index+1, response.id, response.login_id, i['type'], json.dumps(i['values'])) for index, i in enumerate(components)]
+                    async with conn.transaction():
+                        await c.execute('DELETE FROM response_component WHERE response_id = %s AND login_id = %s', (response.id, response.login_id))
+                        await self.__insert_rows(c, 'response_component', RESPONSE_COMPONENT_COLUMNS, rows)
+                        await self.__publish(c, 'resp', l=response.login_id, r=response.id)
+                    self.__flow_cache.invalidate_response(response.login_id, response.id)
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_response_components(self, response : objects.Response):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, response_id, login_id, resp_type, variables FROM response_component WHERE response_id = %s AND login_id = %s',
-                                (response.id, response.login_id))
-                data = await c.fetchall()
-                await c.close()
-                return [objects.ResponseComponent(i[0], i[1], i[2], i[3], i[4]) for i in data]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, response_id, login_id, resp_type, variables FROM response_component WHERE response_id = %s AND login_id = %s',
+                                    (response.id, response.login_id))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.ResponseComponent(i[0], i[1], i[2], i[3], i[4]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_all_login_flows(self, login : objects.Login):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, label, login_id, enabled FROM flow WHERE login_id = %s', (login.id,))
-                data = await c.fetchall()
-                await c.close()
-                return [objects.Flow(i[0], i[1], i[2], i[3]) for i in data]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, label, login_id, enabled FROM flow WHERE login_id = %s', (login.id,))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.Flow(i[0], i[1], i[2], i[3]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_flow_states(self, flow : objects.Flow):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT id, flow_id, login_id, response_id, flow_type, variables FROM flow_state WHERE flow_id = %s AND login_id = %s', (flow.id, flow.login_id,))
-                data = await c.fetchall()
-                await c.close()
-                return [objects.FlowState(i[0], i[1], i[2], i[3], i[4], i[5]) for i in data]
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, flow_id, login_id, response_id, flow_type, variables FROM flow_state WHERE flow_id = %s AND login_id = %s', (flow.id, flow.login_id,))
+                    data = await c.fetchall()
+                    await c.close()
+                    return [objects.FlowState(i[0], i[1], i[2], i[3], i[4], i[5]) for i in data]
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def get_dashboard_data(self, login : objects.Login, *, details : bool = False):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    async with conn.pipeline():
+                        cursors = [conn.cursor() for _ in range(6 if details else 4)]
+                        await cursors[0].execute('SELECT id, label, login_id, user_id, access_token, refresh_token, scopes, validity, id_token FROM spotify_account WHERE login_id = %s', (login.id,))
+                        await cursors[1].execute('SELECT id, login_id, label, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity FROM twitch_account WHERE login_id = %s', (login.id,))
+                        await cursors[2].execute('SELECT id, label, login_id FROM response WHERE login_id = %s', (login.id,))
+                        await cursors[3].execute('SELECT id, label, login_id, enabled FROM flow WHERE login_id = %s', (login.id,))
+                        if details:
+                            await cursors[4].execute('SELECT id, response_id, login_id, resp_type, variables FROM response_component WHERE login_id = %s ORDER BY response_id, id', (login.id,))
+                            await cursors[5].execute('SELECT id, flow_id, login_id, response_id, flow_type, variables FROM flow_state WHERE login_id = %s ORDER BY flow_id, id', (login.id,))
+                        data = [await c.fetchall() for c in cursors]
+                    for c in cursors: await c.close()
+                    dashboard = objects.DashboardData([objects.Spotify(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8]) for i in data[0]],
+                                                      [objects.Twitch(i[0], i[1], i[2], i[3], i[4], i[5], i[6], i[7], i[8], i[9], i[10]) for i in data[1]],
+                                                      [objects.Response(i[0], i[1], i[2]) for i in data[2]],
+                                                      [objects.Flow(i[0], i[1], i[2], i[3]) for i in data[3]])
+                    if details:
+                        dashboard.components = {}
+                        for i in data[4]: dashboard.components.setdefault(i[1], []).append(objects.ResponseComponent(i[0], i[1], i[2], i[3], i[4]))
+                        dashboard.flow_states = {}
+                        for i in data[5]: dashboard.flow_states.setdefault(i[1], []).append(objects.FlowState(i[0], i[1], i[2], i[3], i[4], i[5]))
+                    return dashboard
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def get_flow_resolution(self, username : str, flow_label : str):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('''WITH l AS (
+                                        SELECT id, username, primary_account_src, primary_account_id FROM login WHERE lower(username) = lower(%s) LIMIT 1
+                                    ), f AS (
+                                        SELECT flow.id, flow.label, flow.login_id, flow.enabled FROM flow, l
+                                        WHERE flow.login_id = l.id AND lower(flow.label) = lower(%s) AND flow.enabled
+                                        LIMIT 1
+                                    ), s AS (
+                                        SELECT flow_state.id, flow_state.response_id, flow_state.flow_type, flow_state.variables FROM flow_state, f
+                                        WHERE flow_state.flow_id = f.id AND flow_state.login_id = f.login_id
+                                    )
+                                    SELECT l.id, l.username, l.primary_account_src, l.primary_account_id, f.id, f.label, f.enabled,
+                                        (SELECT COALESCE(jsonb_agg(jsonb_build_array(s.id, s.response_id, s.flow_type, s.variables) ORDER BY s.id), '[]') FROM s),
+                                        (SELECT COALESCE(jsonb_object_agg(twitch_account.id, twitch_account.is_live), '{}') FROM twitch_account
+                                            WHERE twitch_account.login_id = l.id
+                                            AND twitch_account.id::TEXT IN (SELECT s.variables->>'twitch_id' FROM s WHERE s.flow_type = 'twitchLive')),
+                                        (SELECT COALESCE(jsonb_agg(jsonb_build_array(rc.id, rc.response_id, rc.resp_type, rc.variables) ORDER BY rc.response_id, rc.id), '[]')
+                                            FROM response_component rc
+                                            WHERE rc.login_id = l.id AND rc.response_id IN (SELECT s.response_id FROM s))
+                                    FROM l, f
+                                ''', (username, flow_label))
+                    data = await c.fetchone()
+                    await c.close()
+                    if data is None: return None
+                    login = objects.Login(data[0], data[1], data[2], data[3])
+                    flow = objects.Flow(data[4], data[5], login.id, data[6])
+                    states = [objects.FlowState(i[0], flow.id, login.id, i[1], i[2], i[3]) for i in data[7]]
+                    twitch_live = {int(k): v for k, v in data[8].items()}
+                    components = {}
+                    for i in data[9]:
+                        components.setdefault(i[1], []).append(objects.ResponseComponent(i[0], i[1], login.id, i[2], i[3]))
+                    return objects.FlowResolution(login, flow, states, twitch_live, components)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def get_compiled_flow(self, username : str, flow_label : str, *, load_twitch_live : bool = True, trace : tracing.Trace | None = None):
+        if trace is None: trace = tracing.NO_TRACE
+        found, cached = self.__flow_cache.get(username, flow_label)
+        if not found:
+            generation = self.__flow_cache.generation
+            with trace.span('flow_query', 'cache miss'): resolution = await self.get_flow_resolution(username, flow_label)
+            self.__flow_cache.store(username, flow_label, resolution, generation)
+            return resolution
+        if cached is None: return None
+        if not load_twitch_live: return cached
+        twitch_ids = [i.variables.get('twitch_id', None) for i in cached.states if i.flow_type == 'twitchLive']
+        if not twitch_ids: return objects.FlowResolution(cached.login, cached.flow, cached.states, {}, cached.components)
+        with trace.span('twitch_live_query'): twitch_live = await self.get_twitch_live_flags(cached.login, twitch_ids)
+        return objects.FlowResolution(cached.login, cached.flow, cached.states, twitch_live, cached.components)
+
+    async def get_twitch_live_flags(self, login : objects.Login, twitch_ids : list[int]):
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT id, is_live FROM twitch_account WHERE login_id = %s AND id = ANY(%s)', (login.id, [i for i in twitch_ids if isinstance(i, int)]))
+                    data = await c.fetchall()
+                    await c.close()
+                    return {i[0]: i[1] for i in data}
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def toggle_flow(self, flow : objects.Flow, enabled : bool):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE flow SET enabled = %s WHERE id = %s AND login_id = %s', (enabled, flow.id, flow.login_id,))
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE flow SET enabled = %s WHERE id = %s AND login_id = %s', (enabled, flow.id, flow.login_id,))
+                    await self.__publish(c, 'flow', l=flow.login_id, f=flow.id)
+                    await conn.commit()
+                    self.__flow_cache.invalidate_flow(flow.login_id, flow.id)
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def update_flow_label(self, flow : objects.Flow, label : str):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE flow SET label = %s WHERE id = %s AND login_id = %s', (label, flow.id, flow.login_id,))
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE flow SET label = %s WHERE id = %s AND login_id = %s', (label, flow.id, flow.login_id,))
+                    await self.__publish(c, 'flow', l=flow.login_id, f=flow.id)
+                    await conn.commit()
+                    self.__flow_cache.invalidate_flow(flow.login_id, flow.id)
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def set_flow_states(self, flow : objects.Flow, states : list):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                insert_str = 'INSERT INTO flow_state(id, flow_id, login_id, response_id, flow_type, variables) VALUES (%s, %s, %s, %s, %s, %s)'
-                sql_data = [('DELETE FROM flow_state WHERE flow_id = %s AND login_id = %s', (flow.id, flow.login_id))]
-                for index, i in enumerate(states):
-                    sql_data.append((insert_str, (index+1, flow.id, flow.login_id, i['response_id'], i['condition'], json.dumps(i['values']))))
-                sql_str = self.__mogrify_sql(sql_data)
-                await c.execute(sql_str)
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    rows = [(index+1, flow.id, flow.login_id, i['response_id'], i['condition'], json.dumps(i['values'])) for index, i in enumerate(states)]
+                    async with conn.transaction():
+                        await c.execute('DELETE FROM flow_state WHERE flow_id = %s AND login_id = %s', (flow.id, flow.login_id))
+                        await self.__insert_rows(c, 'flow_state', FLOW_STATE_COLUMNS, rows)
+                        await self.__publish(c, 'flow', l=flow.login_id, f=flow.id)
+                    self.__flow_cache.invalidate_flow(flow.login_id, flow.id)
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def delete_flow(self, flow : objects.Flow):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('DELETE FROM flow_state WHERE flow_id = %s AND login_id = %s', (flow.id, flow.login_id))
-                await c.execute('DELETE FROM flow WHERE login_id = %s AND id = %s', (flow.login_id, flow.id))
-                await self.__adb.commit()
-                await c.close()
-                return
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('DELETE FROM flow_state WHERE flow_id = %s AND login_id = %s', (flow.id, flow.login_id))
+                    await c.execute('DELETE FROM flow WHERE login_id = %s AND id = %s', (flow.login_id, flow.id))
+                    await self.__publish(c, 'flow', l=flow.login_id, f=flow.id)
+                    await conn.commit()
+                    self.__flow_cache.invalidate_flow(flow.login_id, flow.id)
+                    await c.close()
+                    return
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def create_empty_flow(self, login : objects.Login, resp_name : str):
         resps = await self.get_all_login_flows(login)
         names = [i.label for i in resps]
         unique_name = helper.unique_string(resp_name, names)
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('''
-                                INSERT INTO flow(id, label, login_id)
-                                SELECT COALESCE(MAX(id)+1, 1), %s, %s FROM flow WHERE login_id = %s RETURNING id
-                                ''', (unique_name, login.id, login.id))
-                last_id = await c.fetchone()
-                await self.__adb.commit()
-                await c.close()
-                return objects.Flow(last_id[0], unique_name, login.id, True)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute(f'''{NEXT_ID_SQL}
+                                    INSERT INTO flow(id, label, login_id)
+                                    SELECT last_id, %s, %s FROM next_id RETURNING id
+                                    ''', (login.id, 'flow', unique_name, login.id))
+                    last_id = await c.fetchone()
+                    await self.__publish(c, 'flow', l=login.id, f=last_id[0])
+                    await conn.commit()
+                    self.__flow_cache.invalidate_flow(login.id, last_id[0])
+                    await c.close()
+                    return objects.Flow(last_id[0], unique_name, login.id, True)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def get_token(self, token_name : str):
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('SELECT token_name, token_value, validity FROM token WHERE token_name = %s LIMIT 1', (token_name,))
-                data = await c.fetchone()
-                await c.close()
-                return None if not data else objects.Token(data[0], data[1], data[2])
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('SELECT token_name, token_value, validity FROM token WHERE token_name = %s LIMIT 1', (token_name,))
+                    data = await c.fetchone()
+                    await c.close()
+                    return None if not data else objects.Token(data[0], data[1], data[2])
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def set_token(self, token_name : str, token_value : str, validity : datetime.datetime):
-        found_token = await self.get_token(token_name)
-        if found_token:
-            found_token = await self.edit_token(found_token, token_value, validity)
-            return found_token
+        tries = 0
         while True:
             try:
-                c = self.__adb.cursor()
-                await c.execute('INSERT INTO token(token_name, token_value, validity) VALUES(%s, %s, %s)', (token_name, token_value, validity))
-                await c.close()
-                return objects.Token(token_name, token_value, validity)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('''INSERT INTO token(token_name, token_value, validity) VALUES(%s, %s, %s)
+                                        ON CONFLICT (token_name) DO UPDATE SET token_value = EXCLUDED.token_value, validity = EXCLUDED.validity''', (token_name, token_value, validity))
+                    await c.close()
+                    return objects.Token(token_name, token_value, validity)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
 
     async def edit_token(self, token_name : str, token_value : str, validity : datetime.datetime):
-        while True:
-            try:
-                c = self.__adb.cursor()
-                await c.execute('UPDATE token SET token_value = %s, validity = %s WHERE token_name = %s', (token_value, validity, token_name))
-                await c.close()
-                return objects.Token(token_name, token_value, validity)
-            except psycopg.OperationalError:
-                await self.__tryReconnect()
-
-    def __mogrify_sql(self, data : list[tuple[str, tuple]]):
-        cc = psycopg.ClientCursor(self.__adb)
-        resp = ''
-        for i in data: resp += cc.mogrify(i[0], i[1]) + ';'
-        cc.close()
-        return resp
+        tries = 0
+        while True:
+            try:
+                async with self.__pool.connection() as conn:
+                    c = conn.cursor()
+                    await c.execute('UPDATE token SET token_value = %s, validity = %s WHERE token_name = %s', (token_value, validity, token_name))
+                    await c.close()
+                    return objects.Token(token_name, token_value, validity)
+            except psycopg.OperationalError as e:
+                tries = await self.__retry(tries, e)
+
+    async def __insert_rows(self, c : psycopg.AsyncCursor, table : str, columns : tuple[tuple[str, str]], rows : list[tuple]):
+        if not rows: return
+        columns_str = ', '.join(i[0] for i in columns)
+        if len(rows) >= COPY_THRESHOLD:
+            async with c.copy(f'COPY {table}({columns_str}) FROM STDIN') as copy:
+                for row in rows: await copy.write_row(row)
+            return
+        unnest_str = ', '.join(f'%s::{i[1]}[]' for i in columns)
+        await c.execute(f'INSERT INTO {table}({columns_str}) SELECT * FROM unnest({unnest_str})', [list(i) for i in zip(*rows)], prepare=True)
@@ -0,0 +1,92 @@
+import collections, math, time
+import objects
+
+class FlowCache():
+    def __init__(self, max_entries : int = 10000, negative_ttl_s : float = 10):
+        self.__max_entries = max_entries
+        self.__negative_ttl_s = negative_ttl_s
+        self.__entries : collections.OrderedDict[tuple[str, str], tuple[objects.FlowResolution | None, float]] = collections.OrderedDict()
+        self.__login_keys : dict[int, set[tuple[str, str]]] = {}
+        self.__negative_keys : set[tuple[str, str]] = set()
+        self.__generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def generation(self): return self.__generation
+
+    @property
+    def stats(self):
+        return {'entries': len(self.__entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations, 'negative_entries': len(self.__negative_keys)}
+
+    def get(self, username : str, flow_label : str):
+        key = (username.lower(), flow_label.lower())
+        entry = self.__entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        if entry[1] <= time.monotonic():
+            self.expirations += 1
+            self.__remove(key)
+            self.misses += 1
+            return False, None
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def store(self, username : str, flow_label : str, resolution : objects.FlowResolution | None, generation : int):
+        if generation != self.__generation or self.__max_entries <= 0: return
+        if resolution is None and self.__negative_ttl_s <= 0: return
+        key = (username.lower(), flow_label.lower())
+        self.__remove(key)
+        while len(self.__entries) >= self.__max_entries:
+            self.__remove(next(iter(self.__entries)))
+            self.evictions += 1
+        if resolution is None:
+            self.__entries[key] = (None, time.monotonic() + self.__negative_ttl_s)
+            self.__negative_keys.add(key)
+            return
+        self.__entries[key] = (resolution, math.inf)
+        self.__login_keys.setdefault(resolution.login.id, set()).add(key)
+
+    def invalidate_login(self, login_id : int):
+        self.__generation += 1
+        self.__clear_negative()
+        for key in list(self.__login_keys.get(login_id, ())):
+            self.__remove(key)
+
+    def invalidate_flow(self, login_id : int, flow_id : int):
+        self.__generation += 1
+        self.__clear_negative()
+        for key in list(self.__login_keys.get(login_id, ())):
+            if self.__entries[key][0].flow.id == flow_id: self.__remove(key)
+
+    def invalidate_response(self, login_id : int, response_id : int):
+        self.__generation += 1
+        for key in list(self.__login_keys.get(login_id, ())):
+            resolution = self.__entries[key][0]
+            if response_id in resolution.components or any(i.response_id == response_id for i in resolution.states):
+                self.__remove(key)
+
+    def clear(self):
+        self.__generation += 1
+        self.__entries.clear()
+        self.__login_keys.clear()
+        self.__negative_keys.clear()
+
+    def __clear_negative(self):
+        for key in list(self.__negative_keys): self.__remove(key)
+
+    def __remove(self, key : tuple[str, str]):
+        entry = self.__entries.pop(key, None)
+        if entry is None: return
+        resolution = entry[0]
+        if resolution is None:
+            self.__negative_keys.discard(key)
+            return
+        login_keys = self.__login_keys.get(resolution.login.id, None)
+        if login_keys is None: return
+        login_keys.discard(key)
+        if not login_keys: del self.__login_keys[resolution.login.id]
@@ -1,4 +1,5 @@
-import urllib.parse, aiohttp, string, random, datetime
+import urllib.parse, aiohttp, string, random, datetime, time
+import metrics
 
 BASE_CHARS = string.ascii_lowercase + string.ascii_uppercase + string.digits
 
@@ -12,10 +13,41 @@ def find_by_key(key, match, collection : list, *, match_lowercase = False):
 
 def url_encode(data : str) -> str: return urllib.parse.quote(data)
 
-async def http_request(method : str, url : str, data = None, headers = None):
-    async with aiohttp.ClientSession() as s:
-        async with s.request(method, url, data=data, headers=headers) as response:
-            return await response.text()
+class HttpResponse():
+    def __init__(self, status : int, headers : dict, text : str):
+        self.status = status
+        self.headers = headers
+        self.text = text
+
+class HttpClient():
+    def __init__(self, *, limit : int = 100, limit_per_host : int = 20, total_timeout : float = 10.0, connect_timeout : float = 5.0, dns_cache_ttl : int = 300, keepalive_timeout : float = 30.0):
+        self.__limit = limit
+        self.__limit_per_host = limit_per_host
+        self.__timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.__dns_cache_ttl = dns_cache_ttl
+        self.__keepalive_timeout = keepalive_timeout
+        self.__session : aiohttp.ClientSession = None
+
+    async def startup(self):
+        if self.__session is not None and not self.__session.closed: return
+        connector = aiohttp.TCPConnector(limit=self.__limit, limit_per_host=self.__limit_per_host, ttl_dns_cache=self.__dns_cache_ttl, keepalive_timeout=self.__keepalive_timeout)
+        self.__session = aiohttp.ClientSession(connector=connector, timeout=self.__timeout)
+
+    async def shutdown(self):
+        if self.__session is None: return
+        await self.__session.close()
+        self.__session = None
+
+    async def request(self, method : str, url : str, data = None, headers = None):
+        if self.__session is None: await self.startup()
+        host = urllib.parse.urlsplit(url).netloc
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            async with self.__session.request(method, url, data=data, headers=headers) as response:
+                status = response.status
+                return HttpResponse(response.status, dict(response.headers), await response.text())
+        finally: metrics.OUTBOUND_SECONDS.observe(time.perf_counter() - start, host, status)
 
 def generate_string(str_len : int):
     return ''.join(random.choices(BASE_CHARS, k=str_len))
@@ -0,0 +1,103 @@
+import asyncio, json
+import psycopg
+
+class InvalidationListener():
+    def __init__(self, conninfo : str, channel : str, origin : str, version_getter, *, poll_interval_s : float = 30.0, reconnect_delay_s : float = 1.0, max_reconnect_delay_s : float = 30.0):
+        self.__conninfo = conninfo
+        self.__channel = channel
+        self.__origin = origin
+        self.__version_getter = version_getter
+        self.__poll_interval_s = poll_interval_s
+        self.__reconnect_delay_s = reconnect_delay_s
+        self.__max_reconnect_delay_s = max_reconnect_delay_s
+        self.__handlers = []
+        self.__resync_handlers = []
+        self.__tasks : list[asyncio.Task] = []
+        self.__ready = asyncio.Event()
+        self.__seen_version = 0
+        self.connected = False
+        self.received = 0
+        self.applied = 0
+        self.failed = 0
+        self.resyncs = 0
+        self.reconnects = 0
+
+    def add_handler(self, handler):
+        self.__handlers.append(handler)
+
+    def add_resync_handler(self, handler):
+        self.__resync_handlers.append(handler)
+
+    @property
+    def stats(self):
+        return {'connected': self.connected, 'received': self.received, 'applied': self.applied, 'failed': self.failed, 'resyncs': self.resyncs, 'reconnects': self.reconnects, 'version': self.__seen_version}
+
+    async def start(self, timeout_s : float = 10.0):
+        if self.__tasks: return
+        self.__seen_version = await self.__version_getter()
+        self.__tasks = [asyncio.ensure_future(self.__listen()), asyncio.ensure_future(self.__poll())]
+        try: await asyncio.wait_for(self.__ready.wait(), timeout_s)
+        except asyncio.TimeoutError: print('[Invalidation] LISTEN not ready, continuing with version polling')
+
+    async def stop(self):
+        for i in self.__tasks: i.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+        self.connected = False
+
+    async def __listen(self):
+        delay = self.__reconnect_delay_s
+        resync = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.__conninfo, autocommit=True) as conn:
+                    await conn.execute(f'LISTEN {self.__channel}')
+                    self.connected = True
+                    self.__ready.set()
+                    delay = self.__reconnect_delay_s
+                    if resync: await self.__resync()
+                    async for notify in conn.notifies(): self.__handle(notify.payload)
+            except asyncio.CancelledError: raise
+            except Exception as e: print(f'[Invalidation] listener disconnected: {e}')
+            self.connected = False
+            self.reconnects += 1
+            resync = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.__max_reconnect_delay_s)
+
+    async def __poll(self):
+        pending = None
+        while True:
+            await asyncio.sleep(self.__poll_interval_s)
+            if pending is not None and pending > self.__seen_version:
+                self.__seen_version = pending
+                await self.__resync()
+            try: version = await self.__version_getter()
+            except Exception: continue
+            pending = version if version > self.__seen_version else None
+
+    def __handle(self, payload : str):
+        self.received += 1
+        try:
+            version, data = payload.split(' ', 1)
+            version = int(version)
+            event = json.loads(data)
+        except Exception:
+            self.failed += 1
+            return
+        if version > self.__seen_version: self.__seen_version = version
+        if event.get('o', None) == self.__origin: return
+        try:
+            for handler in self.__handlers: handler(event)
+            self.applied += 1
+        except Exception as e:
+            self.failed += 1
+            print(f'[Invalidation] failed to apply {data}: {e}')
+
+    async def __resync(self):
+        self.resyncs += 1
+        for handler in self.__resync_handlers:
+            try:
+                result = handler()
+                if asyncio.iscoroutine(result): await result
+            except Exception as e: print(f'[Invalidation] resync failed: {e}')
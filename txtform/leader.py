@@ -0,0 +1,70 @@
+import asyncio
+import psycopg
+
+LOCK_ID = 7350127
+
+class LeaderElection():
+    def __init__(self, conninfo : str, *, lock_id : int = LOCK_ID, check_interval_s : float = 5.0):
+        self.__conninfo = conninfo
+        self.__lock_id = lock_id
+        self.__check_interval_s = check_interval_s
+        self.__elected_handlers = []
+        self.__demoted_handlers = []
+        self.__task : asyncio.Task = None
+        self.leader = False
+        self.elections = 0
+
+    def add_elected_handler(self, handler):
+        self.__elected_handlers.append(handler)
+
+    def add_demoted_handler(self, handler):
+        self.__demoted_handlers.append(handler)
+
+    @property
+    def stats(self):
+        return {'leader': self.leader, 'elections': self.elections}
+
+    def start(self):
+        if self.__task is not None: return
+        self.__task = asyncio.ensure_future(self.__run())
+
+    async def stop(self):
+        if self.__task is None: return
+        self.__task.cancel()
+        await asyncio.gather(self.__task, return_exceptions=True)
+        self.__task = None
+        await self.__demote()
+
+    async def __run(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.__conninfo, autocommit=True) as conn:
+                    while True:
+                        if self.leader: await conn.execute('SELECT 1')
+                        else:
+                            cursor = await conn.execute('SELECT pg_try_advisory_lock(%s)', (self.__lock_id,))
+                            if (await cursor.fetchone())[0]: await self.__elect()
+                        await asyncio.sleep(self.__check_interval_s)
+            except asyncio.CancelledError: raise
+            except Exception as e: print(f'[Leader] connection lost: {e}')
+            await self.__demote()
+            await asyncio.sleep(self.__check_interval_s)
+
+    async def __elect(self):
+        self.leader = True
+        self.elections += 1
+        print('[Leader] elected, starting scheduled jobs')
+        await self.__call(self.__elected_handlers)
+
+    async def __demote(self):
+        if not self.leader: return
+        self.leader = False
+        print('[Leader] demoted, stopping scheduled jobs')
+        await self.__call(self.__demoted_handlers)
+
+    async def __call(self, handlers : list):
+        for handler in handlers:
+            try:
+                result = handler()
+                if asyncio.iscoroutine(result): await result
+            except Exception as e: print(f'[Leader] handler failed: {e}')
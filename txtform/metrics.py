@@ -0,0 +1,183 @@
+import asyncio, bisect, functools, time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names : tuple[str], values : tuple):
+    if not names: return ''
+    return '{' + ','.join(f'{name}="{escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+def escape(value : str):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_value(value : float):
+    if value == float('inf'): return '+Inf'
+    if isinstance(value, int) or value.is_integer(): return str(int(value))
+    return repr(value)
+
+class Counter():
+    def __init__(self, name : str, help_text : str, labels : tuple[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.__values : dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount : float = 1):
+        self.__values[label_values] = self.__values.get(label_values, 0) + amount
+
+    def set(self, value : float, *label_values):
+        self.__values[label_values] = value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in self.__values.items():
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+class Gauge():
+    def __init__(self, name : str, help_text : str, labels : tuple[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.__values : dict[tuple, float] = {}
+
+    def set(self, value : float, *label_values):
+        self.__values[label_values] = value
+
+    def inc(self, *label_values, amount : float = 1):
+        self.__values[label_values] = self.__values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount : float = 1):
+        self.__values[label_values] = self.__values.get(label_values, 0) - amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} gauge'
+        for label_values, value in self.__values.items():
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+class Histogram():
+    def __init__(self, name : str, help_text : str, labels : tuple[str] = (), buckets : tuple[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.__series : dict[tuple, list] = {}
+
+    def observe(self, value : float, *label_values):
+        series = self.__series.get(label_values, None)
+        if series is None:
+            series = [[0] * (len(self.buckets) + 1), 0.0]
+            self.__series[label_values] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        bucket_labels = self.labels + ('le',)
+        for label_values, (counts, total) in self.__series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{format_labels(bucket_labels, label_values + (format_value(bound),))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, label_values)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labels, label_values)} {cumulative}'
+
+class Registry():
+    def __init__(self):
+        self.__metrics = []
+        self.__collectors = []
+
+    def counter(self, name : str, help_text : str, labels : tuple[str] = ()):
+        return self.__add(Counter(name, help_text, labels))
+
+    def gauge(self, name : str, help_text : str, labels : tuple[str] = ()):
+        return self.__add(Gauge(name, help_text, labels))
+
+    def histogram(self, name : str, help_text : str, labels : tuple[str] = (), buckets : tuple[float] = LATENCY_BUCKETS):
+        return self.__add(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collector):
+        self.__collectors.append(collector)
+
+    def render(self):
+        for collector in self.__collectors: collector()
+        lines = []
+        for metric in self.__metrics: lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def __add(self, metric):
+        self.__metrics.append(metric)
+        return metric
+
+class LoopLagMonitor():
+    def __init__(self, histogram : Histogram, gauge : Gauge, interval_s : float = 0.5):
+        self.__histogram = histogram
+        self.__gauge = gauge
+        self.__interval_s = interval_s
+        self.__task : asyncio.Task = None
+
+    def start(self):
+        if self.__task is not None: return
+        self.__task = asyncio.ensure_future(self.__loop())
+
+    async def stop(self):
+        if self.__task is None: return
+        self.__task.cancel()
+        await asyncio.gather(self.__task, return_exceptions=True)
+        self.__task = None
+
+    async def __loop(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.__interval_s)
+            lag = max(0.0, time.perf_counter() - start - self.__interval_s)
+            self.__histogram.observe(lag)
+            self.__gauge.set(lag)
+
+def timed_coroutines(histogram : Histogram, errors : Counter):
+    def decorate(cls):
+        for name, func in list(vars(cls).items()):
+            if name.startswith('_') or not asyncio.iscoroutinefunction(func): continue
+            setattr(cls, name, timed(func, name, histogram, errors))
+        return cls
+    return decorate
+
+def timed(func, name : str, histogram : Histogram, errors : Counter):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try: return await func(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally: histogram.observe(time.perf_counter() - start, name)
+    return wrapper
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('txtform_http_request_duration_seconds', 'Time spent handling HTTP requests', ('method', 'route', 'status'))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge('txtform_http_requests_in_flight', 'HTTP requests currently being handled')
+DB_QUERY_SECONDS = REGISTRY.histogram('txtform_db_method_duration_seconds', 'Time spent in Database methods including pool waits and retries', ('method',))
+DB_ERRORS = REGISTRY.counter('txtform_db_method_errors_total', 'Database method calls that raised', ('method',))
+OUTBOUND_SECONDS = REGISTRY.histogram('txtform_outbound_request_duration_seconds', 'Time spent on outbound HTTP requests', ('host', 'status'))
+CACHE_HITS = REGISTRY.counter('txtform_cache_hits_total', 'Cache lookups that returned an entry', ('cache',))
+CACHE_MISSES = REGISTRY.counter('txtform_cache_misses_total', 'Cache lookups that did not return an entry', ('cache',))
+CACHE_EVICTIONS = REGISTRY.counter('txtform_cache_evictions_total', 'Entries removed from a cache to make room', ('cache',))
+CACHE_EXPIRATIONS = REGISTRY.counter('txtform_cache_expirations_total', 'Entries dropped from a cache after expiring', ('cache',))
+INVALIDATION_EVENTS = REGISTRY.counter('txtform_invalidation_events_total', 'Cache invalidation events by outcome, plus full resyncs and listener reconnects', ('outcome',))
+CACHE_ENTRIES = REGISTRY.gauge('txtform_cache_entries', 'Entries currently held by a cache', ('cache',))
+LOOP_LAG_SECONDS = REGISTRY.histogram('txtform_event_loop_lag_seconds', 'Delay between a scheduled event loop wakeup and when it ran', buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+LOOP_LAG_LAST = REGISTRY.gauge('txtform_event_loop_lag_last_seconds', 'Most recently measured event loop lag')
+COMPRESSION_INPUT_BYTES = REGISTRY.counter('txtform_compression_input_bytes_total', 'Response body bytes before compression', ('encoding',))
+COMPRESSION_SAVED_BYTES = REGISTRY.counter('txtform_compression_saved_bytes_total', 'Response body bytes saved by compression', ('encoding',))
+COMPRESSION_SKIPPED = REGISTRY.counter('txtform_compression_skipped_total', 'Compressible responses sent uncompressed', ('reason',))
+FLIGHT_CALLS = REGISTRY.counter('txtform_flight_calls_total', 'Calls that started a shared in-flight request', ('flight',))
+FLIGHT_DEDUPLICATED = REGISTRY.counter('txtform_flight_deduplicated_total', 'Calls that joined an in-flight request instead of starting one', ('flight',))
+FLIGHT_INFLIGHT = REGISTRY.gauge('txtform_flight_inflight', 'Shared requests currently in flight', ('flight',))
+TOKEN_REFRESH_RUNS = REGISTRY.counter('txtform_token_refresh_runs_total', 'Completed background token refresh passes')
+TOKEN_REFRESH_ACCOUNTS = REGISTRY.counter('txtform_token_refresh_accounts_total', 'Accounts handled by the background token refresher by outcome', ('outcome',))
+TOKEN_REFRESH_LAST_RUN_SECONDS = REGISTRY.gauge('txtform_token_refresh_last_run_seconds', 'Duration of the most recent token refresh pass')
+TOKEN_REFRESH_BACKING_OFF = REGISTRY.gauge('txtform_token_refresh_backing_off', 'Accounts skipped by the token refresher after a failed refresh')
+LEADER = REGISTRY.gauge('txtform_leader', 'Whether this worker holds the leader lock and runs the scheduled jobs')
+WORKER = REGISTRY.gauge('txtform_worker_index', 'Index of the worker process that served this scrape')
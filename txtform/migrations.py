@@ -0,0 +1,137 @@
+LOCK_ID = 7350126
+
+ID_COUNTER_TABLES = ('login_session', 'twitch_account', 'spotify_account', 'response', 'flow')
+
+MIGRATIONS : list[tuple[int, str, tuple[str, ...]]] = [
+    (1, 'initial schema', (
+        '''CREATE TABLE IF NOT EXISTS login(
+        id BIGSERIAL PRIMARY KEY,
+        username TEXT NOT NULL,
+        primary_account_src TEXT NOT NULL,
+        primary_account_id BIGINT NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS login_session(
+        id INT,
+        login_id BIGINT NOT NULL,
+        session_token TEXT NOT NULL,
+        validity TIMESTAMP NOT NULL,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        PRIMARY KEY(login_id, id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS twitch_account(
+        id INT,
+        login_id BIGINT NOT NULL,
+        label TEXT NOT NULL,
+        user_id BIGINT NOT NULL,
+        username TEXT NOT NULL,
+        display_name TEXT NOT NULL,
+        is_live BOOLEAN NOT NULL,
+        access_token TEXT NOT NULL,
+        refresh_token TEXT NOT NULL,
+        scopes JSONB NOT NULL,
+        validity TIMESTAMP NOT NULL,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        PRIMARY KEY(login_id, id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS spotify_account(
+        id INT,
+        login_id BIGINT NOT NULL,
+        label TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        access_token TEXT NOT NULL,
+        refresh_token TEXT NOT NULL,
+        scopes JSONB NOT NULL,
+        validity TIMESTAMP NOT NULL,
+        id_token TEXT NOT NULL,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        PRIMARY KEY(login_id, id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS response(
+        id INT,
+        label TEXT NOT NULL,
+        login_id BIGINT NOT NULL,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        PRIMARY KEY(login_id, id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS response_component(
+        id INT,
+        response_id INT NOT NULL,
+        login_id BIGINT NOT NULL,
+        resp_type TEXT NOT NULL,
+        variables JSONB NOT NULL,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        CONSTRAINT fk_response FOREIGN KEY(response_id, login_id) REFERENCES response(id, login_id),
+        PRIMARY KEY(login_id, response_id, id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS flow(
+        id INT,
+        label TEXT NOT NULL,
+        login_id BIGINT NOT NULL,
+        enabled BOOLEAN NOT NULL DEFAULT True,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        PRIMARY KEY(login_id, id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS flow_state(
+        id INT,
+        flow_id INT NOT NULL,
+        login_id BIGINT NOT NULL,
+        response_id INT,
+        flow_type TEXT,
+        variables JSONB NOT NULL,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        CONSTRAINT fk_flow FOREIGN KEY(flow_id, login_id) REFERENCES flow(id, login_id),
+        CONSTRAINT fk_response FOREIGN KEY(response_id, login_id) REFERENCES response(id, login_id),
+        PRIMARY KEY(login_id, flow_id, id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS token(
+        token_name TEXT PRIMARY KEY,
+        token_value TEXT NOT NULL,
+        validity TIMESTAMP NOT NULL
+        )'''
+    )),
+    (2, 'token validity indexes', (
+        'CREATE INDEX IF NOT EXISTS spotify_account_validity_idx ON spotify_account(validity)',
+        'CREATE INDEX IF NOT EXISTS twitch_account_validity_idx ON twitch_account(validity)'
+    )),
+    (3, 'cache event sequence', (
+        'CREATE SEQUENCE IF NOT EXISTS txtform_event_seq',
+    )),
+    (4, 'per-login id counters', (
+        '''CREATE TABLE IF NOT EXISTS login_id_counter(
+        login_id BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        last_id INT NOT NULL,
+        CONSTRAINT fk_login FOREIGN KEY(login_id) REFERENCES login(id),
+        PRIMARY KEY(login_id, kind)
+        )''',
+        *[f'''INSERT INTO login_id_counter(login_id, kind, last_id) SELECT login_id, '{i}', MAX(id) FROM {i} GROUP BY login_id
+        ON CONFLICT (login_id, kind) DO UPDATE SET last_id = GREATEST(login_id_counter.last_id, EXCLUDED.last_id)''' for i in ID_COUNTER_TABLES]
+    )),
+    (5, 'lookup indexes', (
+        'CREATE INDEX IF NOT EXISTS login_username_lower_idx ON login(lower(username))',
+        'CREATE INDEX IF NOT EXISTS login_primary_account_idx ON login(primary_account_src, primary_account_id)',
+        'CREATE INDEX IF NOT EXISTS login_session_token_idx ON login_session(session_token)',
+        'CREATE INDEX IF NOT EXISTS spotify_account_id_token_idx ON spotify_account(id_token)',
+        'CREATE INDEX IF NOT EXISTS twitch_account_user_id_idx ON twitch_account(user_id)'
+    )),
+    (6, 'spotify now playing', (
+        '''CREATE TABLE IF NOT EXISTS spotify_now_playing(
+        login_id BIGINT NOT NULL,
+        spotify_id INT NOT NULL,
+        current_song TEXT,
+        current_artists JSONB,
+        refresh_at TIMESTAMP NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        CONSTRAINT fk_spotify_account FOREIGN KEY(login_id, spotify_id) REFERENCES spotify_account(login_id, id) ON DELETE CASCADE,
+        PRIMARY KEY(login_id, spotify_id)
+        )''',
+    )),
+    (7, 'committed cache event versions', (
+        '''CREATE TABLE IF NOT EXISTS cache_event_slot(
+        slot INT PRIMARY KEY,
+        seq BIGINT NOT NULL
+        )''',
+    ))
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
@@ -104,4 +104,22 @@ class Token():
     def id(self): return self.__token_name
 
     @property
-    def token_name(self): return self.__token_name
\ No newline at end of file
+    def token_name(self): return self.__token_name
+
+class FlowResolution:
+    def __init__(self, login : Login, flow : Flow, states : list[FlowState], twitch_live : dict[int, bool], components : dict[int, list[ResponseComponent]]):
+        self.login = login
+        self.flow = flow
+        self.states = states
+        self.twitch_live = twitch_live
+        self.components = components
+
+class DashboardData:
+    def __init__(self, spotify_accounts : list[Spotify], twitch_accounts : list[Twitch], responses : list[Response], flows : list[Flow],
+                 components : dict[int, list[ResponseComponent]] | None = None, flow_states : dict[int, list[FlowState]] | None = None):
+        self.spotify_accounts = spotify_accounts
+        self.twitch_accounts = twitch_accounts
+        self.responses = responses
+        self.flows = flows
+        self.components = components
+        self.flow_states = flow_states
\ No newline at end of file
@@ -0,0 +1,84 @@
+import collections, time, datetime
+import objects
+
+class SessionCache():
+    def __init__(self, ttl_s : float = 60, negative_ttl_s : float = 30, max_entries : int = 10000):
+        self.__ttl_s = ttl_s
+        self.__negative_ttl_s = negative_ttl_s
+        self.__max_entries = max_entries
+        self.__entries : collections.OrderedDict[str, tuple[objects.Login | None, int | None, datetime.datetime | None, float]] = collections.OrderedDict()
+        self.__login_keys : dict[int, set[str]] = {}
+        self.__pending : dict[tuple[int, int], datetime.datetime] = {}
+        self.__generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def generation(self): return self.__generation
+
+    @property
+    def enabled(self): return self.__ttl_s > 0 and self.__max_entries > 0
+
+    @property
+    def stats(self):
+        return {'entries': len(self.__entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations, 'pending_extensions': len(self.__pending)}
+
+    def get(self, key : str):
+        entry = self.__entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return False, None, None, None
+        if entry[3] <= time.monotonic():
+            self.expirations += 1
+            self.__remove(key)
+            self.misses += 1
+            return False, None, None, None
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0], entry[1], entry[2]
+
+    def store(self, key : str, generation : int, login : objects.Login | None, session_id : int | None = None, validity : datetime.datetime | None = None):
+        if not self.enabled or generation != self.__generation: return
+        self.__remove(key)
+        while len(self.__entries) >= self.__max_entries:
+            self.__remove(next(iter(self.__entries)))
+            self.evictions += 1
+        ttl_s = self.__ttl_s if login is not None else self.__negative_ttl_s
+        self.__entries[key] = (login, session_id, validity, time.monotonic() + ttl_s)
+        if login is not None: self.__login_keys.setdefault(login.id, set()).add(key)
+
+    def extend(self, key : str, login_id : int, session_id : int, validity : datetime.datetime):
+        self.__pending[(login_id, session_id)] = validity
+        entry = self.__entries.get(key, None)
+        if entry is not None: self.__entries[key] = (entry[0], entry[1], validity, entry[3])
+
+    def take_pending(self):
+        pending = self.__pending
+        self.__pending = {}
+        return pending
+
+    def restore_pending(self, pending : dict[tuple[int, int], datetime.datetime]):
+        for key, validity in pending.items(): self.__pending.setdefault(key, validity)
+
+    def evict(self, key : str):
+        self.__generation += 1
+        self.__remove(key)
+
+    def evict_login(self, login_id : int):
+        self.__generation += 1
+        for key in list(self.__login_keys.get(login_id, ())): self.__remove(key)
+
+    def clear(self):
+        self.__generation += 1
+        self.__entries.clear()
+        self.__login_keys.clear()
+
+    def __remove(self, key : str):
+        entry = self.__entries.pop(key, None)
+        if entry is None or entry[0] is None: return
+        login_keys = self.__login_keys.get(entry[0].id, None)
+        if login_keys is None: return
+        login_keys.discard(key)
+        if not login_keys: del self.__login_keys[entry[0].id]
@@ -1,49 +1,203 @@
-import json, datetime, asyncio
-import objects, database, helper
+import json, datetime, asyncio, collections, math, time
+import objects, database, helper, tracing
 
-class SmartCache():
-    def __init__(self):
-        self.__cache = {}
-
-    async def store(self, cache_key, cache_value, timeout_s : int):
-        self.__cache[cache_key] = cache_value
-        await self.release(cache_key,  timeout_s)
+class TTLCache():
+    def __init__(self, max_entries : int = 10000):
+        self.__cache : collections.OrderedDict = collections.OrderedDict()
+        self.__max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
 
-    async def release(self, cache_key, timeout_s : int):
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.release_blocking(cache_key,  timeout_s))
+    def store(self, cache_key, cache_value, timeout_s : float):
+        if cache_key in self.__cache: self.__cache.move_to_end(cache_key)
+        self.__cache[cache_key] = (cache_value, time.monotonic() + timeout_s)
+        while len(self.__cache) > self.__max_entries:
+            self.__cache.popitem(last=False)
+            self.evictions += 1
 
-    async def release_blocking(self, cache_key, timeout_s : int):
-        await asyncio.sleep(timeout_s)
-        self.release_execute(cache_key)
+    def release(self, cache_key, timeout_s : float):
+        entry = self.__cache.get(cache_key, None)
+        if entry is None: return
+        expires_at = time.monotonic() + timeout_s
+        if expires_at < entry[1]: self.__cache[cache_key] = (entry[0], expires_at)
 
     def release_execute(self, cache_key):
         if cache_key in self.__cache: del self.__cache[cache_key]
 
+    def clear(self):
+        self.__cache.clear()
+
     def get(self, cache_key):
-        return self.__cache.get(cache_key, None)
+        entry = self.__cache.get(cache_key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[1] <= time.monotonic():
+            del self.__cache[cache_key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.__cache.move_to_end(cache_key)
+        self.hits += 1
+        return entry[0]
+
+    def __len__(self): return len(self.__cache)
+
+    @property
+    def stats(self):
+        return {'entries': len(self.__cache), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations}
+
+class SingleFlight():
+    def __init__(self):
+        self.__inflight : dict = {}
+        self.calls = 0
+        self.deduplicated = 0
+
+    async def run(self, key, func, *args):
+        task = self.__inflight.get(key, None)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func(*args))
+            self.__inflight[key] = task
+            task.add_done_callback(lambda t: self.__release(key, t))
+        else: self.deduplicated += 1
+        return await asyncio.shield(task)
+
+    def __release(self, key, task : asyncio.Future):
+        if self.__inflight.get(key, None) is task: del self.__inflight[key]
+
+    @property
+    def stats(self):
+        return {'calls': self.calls, 'deduplicated': self.deduplicated, 'inflight': len(self.__inflight)}
+
+class TwitchLiveIndex():
+    def __init__(self):
+        self.__live_by_user : dict[int, bool] = {}
+        self.__user_by_account : dict[tuple[int, int], int] = {}
+        self.loaded = False
+
+    def load(self, statuses : list[tuple[int, int, int, bool]]):
+        self.__live_by_user = {}
+        self.__user_by_account = {}
+        for login_id, account_id, user_id, is_live in statuses:
+            self.__user_by_account[(login_id, account_id)] = user_id
+            self.__live_by_user[user_id] = is_live
+        self.loaded = True
+
+    def add_account(self, twitch : objects.Twitch):
+        self.add_account_status(twitch.login_id, twitch.id, twitch.user_id, twitch.is_live)
+
+    def add_account_status(self, login_id : int, account_id : int, user_id : int, is_live : bool):
+        self.__user_by_account[(login_id, account_id)] = user_id
+        self.__live_by_user[user_id] = is_live
+
+    def tracks(self, user_id : int):
+        return user_id in self.__live_by_user
+
+    def set_live(self, user_id : int, is_live : bool):
+        self.__live_by_user[user_id] = is_live
+
+    def is_live(self, login_id : int, account_id : int | None):
+        user_id = self.__user_by_account.get((login_id, account_id), None)
+        if user_id is None: return False
+        return self.__live_by_user.get(user_id, False)
+
+    def __len__(self): return len(self.__user_by_account)
 
 class StateManagement():
-    def __init__(self, db : database.Database, spotify_basic : str):
+    def __init__(self, db : database.Database, http : helper.HttpClient, spotify_basic : str, *, spotify_api_url : str = 'https://api.spotify.com', spotify_accounts_url : str = 'https://accounts.spotify.com', shared_now_playing : bool = False):
         self.__db = db
+        self.__http = http
         self.__spotify_basic = spotify_basic
-        self.__spotify_cache = SmartCache()
-        self.__spotify_accounts_cache = SmartCache()
+        self.__spotify_api_url = spotify_api_url
+        self.__spotify_accounts_url = spotify_accounts_url
+        self.__shared_now_playing = shared_now_playing
+        self.__spotify_cache = TTLCache()
+        self.__spotify_accounts_cache = TTLCache()
+        self.__spotify_fetch_flight = SingleFlight()
+        self.__spotify_refresh_flight = SingleFlight()
+        self.__poller_task : asyncio.Task = None
+        self.__poll_accounts : dict[tuple[int, int], objects.Spotify] = {}
+        self.__poll_reload = False
+        self.__poll_schedule : dict[tuple[int, int], tuple[float, float]] = {}
+        self.__poll_tasks : set[asyncio.Task] = set()
+        self.__twitch_live_index = TwitchLiveIndex()
+
+    async def load_twitch_live_index(self):
+        self.__twitch_live_index.load(await self.__db.get_twitch_live_statuses())
+
+    @property
+    def twitch_live_index_loaded(self): return self.__twitch_live_index.loaded
 
-    async def get_first_active_state(self, states : list[objects.FlowState]):
+    def add_twitch_account(self, twitch : objects.Twitch):
+        self.__twitch_live_index.add_account(twitch)
+
+    async def set_twitch_live(self, user_id : int, is_live : bool):
+        if not self.__twitch_live_index.tracks(user_id):
+            twitch_accounts = await self.__db.get_twitch_accounts_by_user_id(user_id)
+            if not twitch_accounts: return False
+            for i in twitch_accounts: self.__twitch_live_index.add_account(i)
+        self.__twitch_live_index.set_live(user_id, is_live)
+        await self.__db.update_twitch_account_live_status_by_uid(is_live, user_id)
+        return True
+
+    def apply_event(self, event : dict):
+        kind = event.get('k', None)
+        if kind == 'live':
+            if self.__twitch_live_index.tracks(event['u']): self.__twitch_live_index.set_live(event['u'], event['v'])
+        elif kind == 'twitch':
+            if self.__twitch_live_index.loaded: self.__twitch_live_index.add_account_status(event['l'], event['a'], event['u'], event['v'])
+        elif kind == 'spotify':
+            self.__spotify_accounts_cache.release_execute(event['l'])
+            if (event['l'], event['a']) in self.__poll_accounts: self.__poll_reload = True
+
+    async def resync_caches(self):
+        self.__spotify_accounts_cache.clear()
+        self.__poll_reload = True
+        if self.__twitch_live_index.loaded: await self.load_twitch_live_index()
+
+    def start_spotify_poller(self, *, accounts_interval : float = 30, min_interval : float = 2, max_interval : float = 30, idle_interval : float = 15, idle_max_interval : float = 120, concurrency : int = 10):
+        if self.__poller_task is not None: return
+        self.__poll_accounts_interval = accounts_interval
+        self.__poll_min_interval = min_interval
+        self.__poll_max_interval = max_interval
+        self.__poll_idle_interval = idle_interval
+        self.__poll_idle_max_interval = idle_max_interval
+        self.__poll_semaphore = asyncio.Semaphore(concurrency)
+        self.__poller_task = asyncio.ensure_future(self.__spotify_poller())
+
+    async def stop_spotify_poller(self):
+        if self.__poller_task is None: return
+        self.__poller_task.cancel()
+        for i in list(self.__poll_tasks): i.cancel()
+        await asyncio.gather(self.__poller_task, *self.__poll_tasks, return_exceptions=True)
+        self.__poller_task = None
+        self.__poll_accounts = {}
+        self.__poll_schedule = {}
+
+    async def get_first_active_state(self, states : list[objects.FlowState], twitch_live : dict[int, bool] | None = None, trace : tracing.Trace | None = None):
+        if trace is None: trace = tracing.NO_TRACE
         for state in states:
             if state.flow_type == 'always':
                 return state
             if state.flow_type == 'twitchLive':
-                is_live = await self.__twitch_is_live(objects.Login(state.login_id, None, None, None), state.variables.get('twitch_id', None))
+                twitch_id = state.variables.get('twitch_id', None)
+                if twitch_live is not None: is_live = twitch_live.get(twitch_id, False)
+                elif self.__twitch_live_index.loaded: is_live = self.__twitch_live_index.is_live(state.login_id, twitch_id)
+                else:
+                    with trace.span('twitch_live_query', f'twitch {twitch_id}'): is_live = await self.__twitch_is_live(objects.Login(state.login_id, None, None, None), twitch_id)
                 if is_live: return state
         return None
 
-    async def get_state_text_response(self, state : objects.FlowState):
+    async def get_state_text_response(self, state : objects.FlowState, response_components : list[objects.ResponseComponent] | None = None, trace : tracing.Trace | None = None):
+        if trace is None: trace = tracing.NO_TRACE
         if not state.response_id: return ''
         release_spotify_ids = set()
         text_resp = ''
-        response_components = await self.__db.get_response_components(objects.Response(state.response_id, None, state.login_id))
+        if response_components is None:
+            with trace.span('component_query'): response_components = await self.__db.get_response_components(objects.Response(state.response_id, None, state.login_id))
         simulated_login = objects.Login(state.login_id, None, None, None)
         for response_component in  response_components:
             if response_component.resp_type == 'text':
@@ -51,19 +205,20 @@ class StateManagement():
             elif response_component.resp_type in 'spotifyCurrentSong':
                 spotify_id = response_component.variables.get('spotify_id', None)
                 if isinstance(spotify_id, int):
-                    current_song = await self.__spotify_current_song(simulated_login, spotify_id)
+                    with trace.span('spotify', f'song {spotify_id}'): current_song = await self.__spotify_current_song(simulated_login, spotify_id)
                     release_spotify_ids.add(spotify_id)
                     if isinstance(current_song, str):
                         text_resp += current_song
             elif response_component.resp_type == 'spotifyCurrentArtist':
                 spotify_id = response_component.variables.get('spotify_id', None)
                 if isinstance(spotify_id, int):
-                    current_artist = await self.__spotify_current_artist(simulated_login, spotify_id)
+                    with trace.span('spotify', f'artist {spotify_id}'): current_artist = await self.__spotify_current_artist(simulated_login, spotify_id)
                     release_spotify_ids.add(spotify_id)
                     if isinstance(current_artist, str):
                         text_resp += current_artist
         for i in release_spotify_ids:
-            await self.__spotify_cache.release(i, 5)
+            if (state.login_id, i) in self.__poll_schedule: continue
+            self.__spotify_cache.release((state.login_id, i), 5)
         return text_resp
 
     async def __twitch_is_live(self, login : objects.Login, twitch_id : int | None):
@@ -82,17 +237,32 @@ class StateManagement():
         return current_song if isinstance(current_song, str) else ''
 
     async def __spotify_api_load_song_data(self, login : objects.Login, spotify_id : int | None):
-        cache_data = self.__spotify_cache.get(spotify_id)
-        if isinstance(cache_data, dict) and isinstance(cache_data['current_song'], str) and isinstance(cache_data['current_artists'], list):
+        cache_data = self.__spotify_cache.get((login.id, spotify_id))
+        if isinstance(cache_data, dict):
             return cache_data['current_song'], cache_data['current_artists']
+        return await self.__spotify_fetch_flight.run((login.id, spotify_id), self.__spotify_api_fetch_song_data, login, spotify_id)
+
+    async def __spotify_api_fetch_song_data(self, login : objects.Login, spotify_id : int | None):
+        if self.__shared_now_playing and self.__poller_task is None:
+            shared = await self.__db.get_spotify_now_playing(login.id, spotify_id)
+            if shared is not None:
+                track_name, parsed_artists, refresh_in_s = shared
+                self.__spotify_cache.store((login.id, spotify_id), {'current_song': track_name, 'current_artists': parsed_artists}, max(refresh_in_s, 1))
+                return track_name, parsed_artists
         spotify_accounts = self.__spotify_accounts_cache.get(login.id)
         if spotify_accounts is None:
             spotify_accounts = await self.__db.get_spotify_accounts_by_login(login)
-            await self.__spotify_accounts_cache.store(login.id, spotify_accounts, 10)
+            self.__spotify_accounts_cache.store(login.id, spotify_accounts, 10)
         spotify_match = helper.find_by_key('id', spotify_id, spotify_accounts)
         if not isinstance(spotify_match, objects.Spotify): return None, None
 
         data = await self.__spotify_api_fetch(spotify_match)
+        track_name, parsed_artists = self.__spotify_parse_song_data(data)
+        if track_name is None: return None, None
+        self.__spotify_cache.store((login.id, spotify_id), {'current_song': track_name, 'current_artists': parsed_artists}, 60)
+        return track_name, parsed_artists
+
+    def __spotify_parse_song_data(self, data : dict | None):
         if not isinstance(data, dict): return None, None
 
         track_info = data.get('item', None)
@@ -108,30 +278,88 @@ class StateManagement():
 
         track_name = track_info.get('name', None)
         if not isinstance(track_name, str): return None, None
-        await self.__spotify_cache.store(spotify_id, {'current_song': track_name, 'current_artists': parsed_artists}, 60)
         return track_name, parsed_artists
 
+    async def __spotify_poller(self):
+        accounts_loaded_at = None
+        while True:
+            now = time.monotonic()
+            if accounts_loaded_at is None or self.__poll_reload or now - accounts_loaded_at >= self.__poll_accounts_interval:
+                accounts_loaded_at = now
+                self.__poll_reload = False
+                try: accounts = await self.__db.get_spotify_accounts_in_enabled_flows()
+                except Exception: accounts = None
+                if accounts is not None:
+                    self.__poll_accounts = {(i.login_id, i.id): i for i in accounts}
+                    for key in list(self.__poll_schedule):
+                        if not key in self.__poll_accounts: del self.__poll_schedule[key]
+                    for key in self.__poll_accounts:
+                        if not key in self.__poll_schedule: self.__poll_schedule[key] = (now, self.__poll_idle_interval)
+
+            next_due = now + 1
+            for key, (due_at, idle_interval) in list(self.__poll_schedule.items()):
+                if due_at <= now:
+                    self.__poll_schedule[key] = (math.inf, idle_interval)
+                    task = asyncio.ensure_future(self.__spotify_poll(key, idle_interval))
+                    self.__poll_tasks.add(task)
+                    task.add_done_callback(self.__poll_tasks.discard)
+                elif due_at < next_due: next_due = due_at
+            await asyncio.sleep(max(next_due - time.monotonic(), 0.05))
+
+    async def __spotify_poll(self, key : tuple[int, int], idle_interval : float):
+        data = None
+        try:
+            async with self.__poll_semaphore:
+                account = self.__poll_accounts.get(key, None)
+                if account is None: return
+                data = await self.__spotify_api_fetch(account)
+        finally:
+            delay, idle_interval = self.__spotify_next_poll(data, idle_interval)
+            if key in self.__poll_schedule: self.__poll_schedule[key] = (time.monotonic() + delay, idle_interval)
+        track_name, parsed_artists = self.__spotify_parse_song_data(data)
+        self.__spotify_cache.store(key, {'current_song': track_name, 'current_artists': parsed_artists}, delay + self.__poll_max_interval)
+        if self.__shared_now_playing:
+            try: await self.__db.set_spotify_now_playing(key[0], key[1], track_name, parsed_artists, delay, delay + self.__poll_max_interval)
+            except Exception as e: print(f'[Spotify] failed to share now playing for {key}: {e}')
+
+    def __spotify_next_poll(self, data : dict | None, idle_interval : float):
+        if isinstance(data, dict) and data.get('is_playing', False) is True:
+            progress_ms = data.get('progress_ms', None)
+            duration_ms = (data.get('item', None) or {}).get('duration_ms', None)
+            if isinstance(progress_ms, int) and isinstance(duration_ms, int):
+                remaining = (duration_ms - progress_ms) / 1000 + 0.5
+                return min(max(remaining, self.__poll_min_interval), self.__poll_max_interval), self.__poll_idle_interval
+            return self.__poll_max_interval, self.__poll_idle_interval
+        return idle_interval, min(idle_interval * 2, self.__poll_idle_max_interval)
+
     async def __spotify_api_fetch(self, spotify : objects.Spotify, *, _looped = False):
         try:
-            resp = await helper.http_request('get', 'https://api.spotify.com/v1/me/player/currently-playing', headers={
+            resp = await self.__http.request('get', self.__spotify_api_url + '/v1/me/player/currently-playing', headers={
                 'Authorization': f'Bearer {spotify.access_token}'
             })
-            data = json.loads(resp)
+            if resp.status == 204: return None
 
-            if 'error' in data and data['error']['status'] == 401:
+            if resp.status == 401:
                 # invalid token
-                if data['error']['status'] == 401 and not _looped:
-                    updated_account = await self.__spotify_api_refresh(spotify)
+                if not _looped:
+                    updated_account = await self.__spotify_refresh_flight.run((spotify.login_id, spotify.id), self.__spotify_api_refresh, spotify)
                     if not updated_account: return None
                     resp = await self.__spotify_api_fetch(updated_account, _looped=True)
                     return resp
                 return None
-            return data
+            return json.loads(resp.text)
         except Exception: return None
 
     async def __spotify_api_refresh(self, spotify : objects.Spotify):
+        refreshed = await self.request_spotify_tokens(spotify)
+        if refreshed is None: return None
+        updated_account = await self.__db.update_spotify_tokens(spotify, refreshed.access_token, refreshed.refresh_token, refreshed.scopes, refreshed.validity)
+        self.spotify_tokens_updated([updated_account])
+        return updated_account
+
+    async def request_spotify_tokens(self, spotify : objects.Spotify):
         try:
-            resp = await helper.http_request('post', 'https://accounts.spotify.com/api/token',
+            resp = await self.__http.request('post', self.__spotify_accounts_url + '/api/token',
                 headers={
                     'content-type': 'application/x-www-form-urlencoded',
                     'Authorization': f'Basic {self.__spotify_basic}'
@@ -141,7 +369,7 @@ class StateManagement():
                     'refresh_token': spotify.refresh_token
                 }
             )
-            data = json.loads(resp)
+            data = json.loads(resp.text)
         except Exception: return None
 
         if not isinstance(data, dict): return None
@@ -159,8 +387,20 @@ class StateManagement():
         validity = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=expires_in)
         scopes = scope.split(' ')
 
-        updated_account = await self.__db.update_spotify_tokens(spotify, access_token, refresh_token, scopes, validity)
-        return updated_account
-    
+        return objects.Spotify(spotify.id, spotify.label, spotify.login_id, spotify.user_id, access_token, refresh_token, scopes, validity, spotify.id_token)
+
+    def spotify_tokens_updated(self, accounts : list[objects.Spotify]):
+        for account in accounts:
+            if not account: continue
+            self.__spotify_accounts_cache.release_execute(account.login_id)
+            if (account.login_id, account.id) in self.__poll_accounts:
+                self.__poll_accounts[(account.login_id, account.id)] = account
+
+    def cache_stats(self):
+        return {'spotify': self.__spotify_cache.stats, 'spotify_accounts': self.__spotify_accounts_cache.stats}
+
+    def flight_stats(self):
+        return {'spotify_fetch': self.__spotify_fetch_flight.stats, 'spotify_refresh': self.__spotify_refresh_flight.stats}
+
     async def test_spotify_tokens(self, spotify : objects.Spotify):
         await self.__spotify_api_fetch(spotify)
@@ -0,0 +1,63 @@
+import hashlib, mimetypes, posixpath
+from pathlib import Path
+import compression
+
+PRECOMPRESSED_ENCODINGS = tuple(i for i in ('br', 'gzip') if i in compression.ENCODINGS)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class StaticAsset():
+    def __init__(self, path : str, body : bytes, content_type : str, variants : dict[str, bytes]):
+        self.path = path
+        self.body = body
+        self.content_type = content_type
+        self.variants = variants
+        self.etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+
+    def select(self, accept_encoding : str):
+        if not self.variants: return None, self.body, self.etag
+        encoding = compression.negotiate(accept_encoding, tuple(self.variants))
+        if encoding is None: return None, self.body, self.etag
+        return encoding, self.variants[encoding], f'{self.etag}-{encoding}'
+
+class StaticAssets():
+    def __init__(self, folder : Path, *, min_compress_size : int = 256):
+        self.__folder = folder
+        self.__min_compress_size = min_compress_size
+        self.__assets : dict[str, StaticAsset] = {}
+
+    @property
+    def stats(self):
+        return {'assets': len(self.__assets), 'bytes': sum(len(i.body) for i in self.__assets.values()),
+                'compressed_bytes': sum(len(j) for i in self.__assets.values() for j in i.variants.values())}
+
+    def load(self):
+        assets = {}
+        for file_path in sorted(self.__folder.rglob('*')):
+            if not file_path.is_file(): continue
+            path = file_path.relative_to(self.__folder).as_posix()
+            body = file_path.read_bytes()
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            assets[path] = StaticAsset(path, body, content_type, self.__compress(body, content_type))
+        self.__assets = assets
+        return len(assets)
+
+    def get(self, path : str):
+        return self.__assets.get(path, None)
+
+    def url(self, path : str):
+        asset = self.__assets.get(path, None)
+        if asset is None: return f'/static/{path}'
+        return f'/static/{path}?v={asset.etag}'
+
+    def __compress(self, body : bytes, content_type : str):
+        if len(body) < self.__min_compress_size or not content_type.startswith(compression.COMPRESSIBLE_TYPES): return {}
+        variants = {}
+        for encoding in PRECOMPRESSED_ENCODINGS:
+            compressed = compression.compress(body, encoding, best=True)
+            if len(compressed) < len(body): variants[encoding] = compressed
+        return variants
+
+def normalize_path(raw_path : str):
+    path = posixpath.normpath(raw_path.replace('\\', '/'))
+    if path.startswith('/') or path == '..' or path.startswith('../'): return None
+    return path
@@ -0,0 +1,60 @@
+import multiprocessing, signal, time
+
+class Supervisor():
+    def __init__(self, target, workers : int, *, restart_delay_s : float = 1.0, max_restart_delay_s : float = 30.0, stable_after_s : float = 30.0):
+        self.__target = target
+        self.__workers = workers
+        self.__restart_delay_s = restart_delay_s
+        self.__max_restart_delay_s = max_restart_delay_s
+        self.__stable_after_s = stable_after_s
+        self.__context = multiprocessing.get_context('spawn')
+        self.__processes : dict[int, multiprocessing.Process] = {}
+        self.__started_at : dict[int, float] = {}
+        self.__delays : dict[int, float] = {}
+        self.__restart_at : dict[int, float] = {}
+        self.__stopping = False
+        self.restarts = 0
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.__request_stop)
+        for index in range(self.__workers): self.__spawn(index)
+        try:
+            while not self.__stopping:
+                time.sleep(0.5)
+                self.__check()
+        except KeyboardInterrupt: pass
+        finally: self.__stop_all()
+
+    def __request_stop(self, *_):
+        self.__stopping = True
+
+    def __spawn(self, index : int):
+        process = self.__context.Process(target=self.__target, args=(index,), name=f'txtform-worker-{index}', daemon=False)
+        process.start()
+        self.__processes[index] = process
+        self.__started_at[index] = time.monotonic()
+        self.__restart_at.pop(index, None)
+        print(f'[Supervisor] worker {index} started with pid {process.pid}')
+
+    def __check(self):
+        now = time.monotonic()
+        for index, process in list(self.__processes.items()):
+            if process.is_alive(): continue
+            restart_at = self.__restart_at.get(index, None)
+            if restart_at is None:
+                if now - self.__started_at[index] >= self.__stable_after_s: self.__delays[index] = self.__restart_delay_s
+                else: self.__delays[index] = min(self.__max_restart_delay_s, self.__delays.get(index, self.__restart_delay_s / 2) * 2)
+                self.__restart_at[index] = now + self.__delays[index]
+                print(f'[Supervisor] worker {index} exited with code {process.exitcode}, restarting in {self.__delays[index]:.1f}s')
+                continue
+            if restart_at > now: continue
+            self.restarts += 1
+            self.__spawn(index)
+
+    def __stop_all(self):
+        for process in self.__processes.values():
+            if process.is_alive(): process.terminate()
+        deadline = time.monotonic() + 10
+        for process in self.__processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive(): process.kill()
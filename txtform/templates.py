@@ -0,0 +1,29 @@
+import jinja2
+from pathlib import Path
+
+COMPONENTS_PREFIX = 'components/'
+
+class TemplateRegistry():
+    def __init__(self, template_folder : Path, *, bytecode_cache_folder : str | None = None, auto_reload : bool = False, template_globals : dict | None = None):
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_folder) if bytecode_cache_folder is not None else jinja2.FileSystemBytecodeCache()
+        self.environment = jinja2.Environment(loader=jinja2.FileSystemLoader(template_folder), bytecode_cache=bytecode_cache, auto_reload=auto_reload)
+        if template_globals: self.environment.globals.update(template_globals)
+        self.__auto_reload = auto_reload
+        self.__templates : dict[str, jinja2.Template] = {}
+        self.__components : dict[str, jinja2.Template] = {}
+
+    def load(self):
+        templates = {name: self.environment.get_template(name) for name in self.environment.list_templates(extensions=['html'])}
+        self.__templates = templates
+        self.__components = {name[len(COMPONENTS_PREFIX):-len('.html')]: template for name, template in templates.items() if name.startswith(COMPONENTS_PREFIX)}
+        return len(templates)
+
+    def get(self, name : str):
+        template = self.__templates[name]
+        if self.__auto_reload: return self.environment.get_template(name)
+        return template
+
+    def component(self, component_type : str):
+        template = self.__components.get(component_type, None)
+        if template is None or not self.__auto_reload: return template
+        return self.environment.get_template(COMPONENTS_PREFIX + component_type + '.html')
@@ -0,0 +1,107 @@
+import asyncio, json, datetime, time
+import objects, database, helper, state_management
+
+class TokenRefresher():
+    def __init__(self, db : database.Database, http : helper.HttpClient, sm : state_management.StateManagement, twitch_client_id : str, twitch_client_secret : str,
+                 *, window_s : float = 600, interval_s : float = 60, concurrency : int = 8, batch_limit : int = 500, failure_backoff_s : float = 900, twitch_id_url : str = 'https://id.twitch.tv'):
+        self.__db = db
+        self.__http = http
+        self.__sm = sm
+        self.__twitch_client_id = twitch_client_id
+        self.__twitch_client_secret = twitch_client_secret
+        self.__twitch_id_url = twitch_id_url
+        self.__window_s = window_s
+        self.__interval_s = interval_s
+        self.__concurrency = concurrency
+        self.__batch_limit = batch_limit
+        self.__failure_backoff_s = failure_backoff_s
+        self.__failed_until : dict[tuple[str, int, int], float] = {}
+        self.__task : asyncio.Task = None
+        self.runs = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.last_run_s = 0.0
+
+    def start(self):
+        if self.__task is not None: return
+        self.__task = asyncio.ensure_future(self.__loop())
+
+    async def stop(self):
+        if self.__task is None: return
+        self.__task.cancel()
+        await asyncio.gather(self.__task, return_exceptions=True)
+        self.__task = None
+
+    @property
+    def stats(self):
+        return {'runs': self.runs, 'refreshed': self.refreshed, 'failed': self.failed, 'last_run_s': self.last_run_s, 'backing_off': len(self.__failed_until)}
+
+    async def __loop(self):
+        while True:
+            try: await self.run_once()
+            except Exception as e: print(f'[TokenRefresher] run failed: {e}')
+            await asyncio.sleep(self.__interval_s)
+
+    async def run_once(self):
+        start = time.perf_counter()
+        before = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=self.__window_s)
+        now = time.monotonic()
+        for key in [key for key, until in self.__failed_until.items() if until <= now]: del self.__failed_until[key]
+
+        spotify_accounts = [i for i in await self.__db.get_spotify_accounts_expiring(before, self.__batch_limit) if not ('spotify', i.login_id, i.id) in self.__failed_until]
+        twitch_accounts = [i for i in await self.__db.get_twitch_accounts_expiring(before, self.__batch_limit) if not ('twitch', i.login_id, i.id) in self.__failed_until]
+
+        semaphore = asyncio.Semaphore(self.__concurrency)
+        async def bounded(coro):
+            async with semaphore: return await coro
+
+        spotify_results = await asyncio.gather(*[bounded(self.__sm.request_spotify_tokens(i)) for i in spotify_accounts])
+        twitch_results = await asyncio.gather(*[bounded(self.__request_twitch_tokens(i)) for i in twitch_accounts])
+
+        spotify_updates = self.__collect('spotify', spotify_accounts, spotify_results)
+        twitch_updates = self.__collect('twitch', twitch_accounts, twitch_results)
+
+        await self.__db.update_spotify_tokens_batch(spotify_updates)
+        await self.__db.update_twitch_tokens_batch(twitch_updates)
+        self.__sm.spotify_tokens_updated(spotify_updates)
+
+        self.runs += 1
+        self.last_run_s = time.perf_counter() - start
+        return len(spotify_updates) + len(twitch_updates)
+
+    def __collect(self, platform : str, accounts : list, results : list):
+        updates = []
+        for account, result in zip(accounts, results):
+            if result is None:
+                self.failed += 1
+                self.__failed_until[(platform, account.login_id, account.id)] = time.monotonic() + self.__failure_backoff_s
+                continue
+            self.refreshed += 1
+            updates.append(result)
+        return updates
+
+    async def __request_twitch_tokens(self, twitch : objects.Twitch):
+        try:
+            resp = await self.__http.request('post', self.__twitch_id_url + '/oauth2/token', data={
+                'grant_type': 'refresh_token',
+                'refresh_token': twitch.refresh_token,
+                'client_id': self.__twitch_client_id,
+                'client_secret': self.__twitch_client_secret
+            })
+            data = json.loads(resp.text)
+        except Exception: return None
+
+        if not isinstance(data, dict): return None
+
+        access_token = data.get('access_token', None)
+        refresh_token = data.get('refresh_token', None)
+        scopes = data.get('scope', twitch.scopes)
+        expires_in = data.get('expires_in', None)
+
+        if not isinstance(access_token, str): return None
+        if not isinstance(refresh_token, str): refresh_token = twitch.refresh_token
+        if not isinstance(scopes, list): scopes = twitch.scopes
+        if not isinstance(expires_in, int): return None
+
+        validity = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=expires_in)
+        return objects.Twitch(twitch.id, twitch.login_id, twitch.label, twitch.user_id, twitch.username, twitch.display_name, twitch.is_live, access_token, refresh_token, scopes, validity)
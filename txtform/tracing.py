@@ -0,0 +1,33 @@
+import contextlib, time
+
+class Trace():
+    def __init__(self):
+        self.__start = time.perf_counter()
+        self.spans : list[tuple[str, float, str | None]] = []
+
+    @property
+    def elapsed_ms(self): return (time.perf_counter() - self.__start) * 1000
+
+    @contextlib.contextmanager
+    def span(self, name : str, desc : str | None = None):
+        start = time.perf_counter()
+        try: yield
+        finally: self.spans.append((name, (time.perf_counter() - start) * 1000, desc))
+
+    def server_timing(self):
+        parts = []
+        for name, duration, desc in self.spans:
+            if desc is None: parts.append(f'{name};dur={duration:.2f}')
+            else: parts.append(f'{name};dur={duration:.2f};desc="{desc}"')
+        parts.append(f'total;dur={self.elapsed_ms:.2f}')
+        return ', '.join(parts)
+
+    def as_list(self):
+        return [{'name': name, 'ms': round(duration, 3), 'desc': desc} for name, duration, desc in self.spans]
+
+class NullTrace():
+    __span = contextlib.nullcontext()
+
+    def span(self, name : str, desc : str | None = None): return self.__span
+
+NO_TRACE = NullTrace()
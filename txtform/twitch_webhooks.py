@@ -2,8 +2,12 @@ import json, datetime
 import database, helper
 
 class TwitchWebhookManager():
-    def __init__(self, db : database.Database, url : str, hook_secret : str, twitch_client_id : str, twitch_client_secret : str):
+    def __init__(self, db : database.Database, http : helper.HttpClient, url : str, hook_secret : str, twitch_client_id : str, twitch_client_secret : str,
+                 *, twitch_api_url : str = 'https://api.twitch.tv', twitch_id_url : str = 'https://id.twitch.tv'):
         self.__db = db
+        self.__http = http
+        self.__twitch_api_url = twitch_api_url
+        self.__twitch_id_url = twitch_id_url
         self.__url = url
         self.__hook_secret = hook_secret
         self.__twitch_app_token = None
@@ -17,14 +21,14 @@ class TwitchWebhookManager():
 
     async def __new_app_token(self):
         try:
-            resp = await helper.http_request('post', 'https://id.twitch.tv/oauth2/token', data = {
+            resp = await self.__http.request('post', self.__twitch_id_url + '/oauth2/token', data = {
                 'client_id': self.__twitch_client_id,
                 'client_secret': self.__twitch_client_secret,
                 'grant_type': 'client_credentials'
             })
         except Exception: return None
 
-        try: data = json.loads(resp)
+        try: data = json.loads(resp.text)
         except Exception: return None
 
         if (not isinstance(data, dict) or not 'access_token' in data or not 'expires_in' in data
@@ -38,7 +42,7 @@ class TwitchWebhookManager():
         channel_id_str = str(channel_id)
 
         try:
-            await helper.http_request('post', 'https://api.twitch.tv/helix/eventsub/subscriptions',
+            await self.__http.request('post', self.__twitch_api_url + '/helix/eventsub/subscriptions',
                 data = json.dumps({
                     'type': 'stream.online',
                     'version': '1',
@@ -57,7 +61,7 @@ class TwitchWebhookManager():
             )
         except Exception: return False
         try:
-            await helper.http_request('post', 'https://api.twitch.tv/helix/eventsub/subscriptions',
+            await self.__http.request('post', self.__twitch_api_url + '/helix/eventsub/subscriptions',
                 data = json.dumps({
                     'type': 'stream.offline',
                     'version': '1',
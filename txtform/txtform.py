@@ -1,9 +1,8 @@
-import asyncio, base64, json, os, sys, datetime, re, hmac, hashlib
-import jinja2
+import asyncio, base64, json, os, sys, datetime, re, hmac, hashlib, time, signal
 from pathlib import Path
 from aiohttp import web
-import helper, database, state_management, twitch_webhooks, objects
-from vendor.StructGuard import StructGuard
+from aiohttp.helpers import ETag
+import helper, database, state_management, twitch_webhooks, token_refresh, objects, metrics, tracing, supervisor, invalidation, leader, validation, templates, static_assets, compression
 
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -25,12 +24,61 @@ TWITCH_REDIRECT = os.environ.get('TWITCH_REDIRECT', None)
 
 POSTGRES_CONNECTION_STRING = os.environ.get('POSTGRES_CONNECTION_STRING', None)
 
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com')
+SPOTIFY_ACCOUNTS_URL = os.environ.get('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+TWITCH_API_URL = os.environ.get('TWITCH_API_URL', 'https://api.twitch.tv')
+TWITCH_ID_URL = os.environ.get('TWITCH_ID_URL', 'https://id.twitch.tv')
+
 TWITCH_WEBHOOK_SECRET = os.environ.get('TWITCH_WEBHOOK_SECRET', None)
 WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', None)
 
 try: WEB_PORT = int(os.environ.get('WEB_PORT', None))
 except Exception: WEB_PORT = None
 
+try: POSTGRES_POOL_MIN = int(os.environ.get('POSTGRES_POOL_MIN', 2))
+except Exception: POSTGRES_POOL_MIN = 2
+try: POSTGRES_POOL_MAX = int(os.environ.get('POSTGRES_POOL_MAX', 10))
+except Exception: POSTGRES_POOL_MAX = 10
+try: POSTGRES_POOL_TIMEOUT = float(os.environ.get('POSTGRES_POOL_TIMEOUT', 10))
+except Exception: POSTGRES_POOL_TIMEOUT = 10.0
+
+try: HTTP_LIMIT = int(os.environ.get('HTTP_LIMIT', 100))
+except Exception: HTTP_LIMIT = 100
+try: HTTP_LIMIT_PER_HOST = int(os.environ.get('HTTP_LIMIT_PER_HOST', 20))
+except Exception: HTTP_LIMIT_PER_HOST = 20
+try: HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 10))
+except Exception: HTTP_TIMEOUT = 10.0
+
+SPOTIFY_POLLER = os.environ.get('SPOTIFY_POLLER', '0') == '1'
+BENCHMARK_STATS = os.environ.get('BENCHMARK_STATS', '0') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', None) or None
+TRACE_TOKEN = os.environ.get('TRACE_TOKEN', None) or None
+try: WEB_WORKERS = max(1, int(os.environ.get('WEB_WORKERS', 1)))
+except Exception: WEB_WORKERS = 1
+if WEB_WORKERS > 1 and sys.platform == 'win32':
+    print('WEB_WORKERS is not supported on Windows, running a single worker')
+    WEB_WORKERS = 1
+try: SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+except Exception: SLOW_REQUEST_MS = 500.0
+try: TEXT_CACHE_MAX_AGE = int(os.environ.get('TEXT_CACHE_MAX_AGE', 2))
+except Exception: TEXT_CACHE_MAX_AGE = 2
+try: TEXT_CACHE_STALE = int(os.environ.get('TEXT_CACHE_STALE', 5))
+except Exception: TEXT_CACHE_STALE = 5
+TOKEN_REFRESH = os.environ.get('TOKEN_REFRESH', '1') == '1'
+CACHE_EVENTS = os.environ.get('CACHE_EVENTS', '1') == '1'
+TEMPLATE_RELOAD = os.environ.get('TEMPLATE_RELOAD', '0') == '1'
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', None) or None
+try: COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+except Exception: COMPRESS_MIN_BYTES = 1024
+try: STATIC_CACHE_MAX_AGE = int(os.environ.get('STATIC_CACHE_MAX_AGE', 3600))
+except Exception: STATIC_CACHE_MAX_AGE = 3600
+try: SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 60))
+except Exception: SESSION_CACHE_TTL = 60.0
+try: CACHE_EVENTS_POLL = float(os.environ.get('CACHE_EVENTS_POLL', 30))
+except Exception: CACHE_EVENTS_POLL = 30.0
+try: TOKEN_REFRESH_WINDOW = float(os.environ.get('TOKEN_REFRESH_WINDOW', 600))
+except Exception: TOKEN_REFRESH_WINDOW = 600.0
+
 if (SPOTIFY_CLIENT_ID is None or SPOTIFY_SECRET is None or SPOTIFY_SCOPES is None or SPOTIFY_REDIRECT is None or
     TWITCH_CLIENT_ID is None or TWITCH_SECRET is None or TWITCH_REDIRECT is None or TWITCH_SCOPES is None or
     POSTGRES_CONNECTION_STRING is None or WEB_PORT is None or TWITCH_WEBHOOK_SECRET is None or WEBHOOK_HOST is None):
@@ -39,28 +87,131 @@ if (SPOTIFY_CLIENT_ID is None or SPOTIFY_SECRET is None or SPOTIFY_SCOPES is Non
 SPOTIFY_SCOPES_ENCODED = helper.url_encode(SPOTIFY_SCOPES)
 SPOTIFY_REDIRECT_ENCODED = helper.url_encode(SPOTIFY_REDIRECT)
 SPOTIFY_SECRET_BASE64 = base64.b64encode((SPOTIFY_CLIENT_ID + ':' + SPOTIFY_SECRET).encode('utf-8')).decode()
+TEXT_CACHE_CONTROL = f'public, max-age={TEXT_CACHE_MAX_AGE}, stale-while-revalidate={TEXT_CACHE_STALE}' if TEXT_CACHE_MAX_AGE > 0 else 'no-cache'
+STATIC_CACHE_CONTROL = f'public, max-age={STATIC_CACHE_MAX_AGE}' if STATIC_CACHE_MAX_AGE > 0 else 'no-cache'
 TWITCH_REDIRECT_ENCODED = helper.url_encode(TWITCH_REDIRECT)
 TWITCH_SCOPES_ENCODED = helper.url_encode(TWITCH_SCOPES)
 TWITCH_WEBHOOK_SECRET_ENCODED = TWITCH_WEBHOOK_SECRET.encode('utf-8')
-
-j2 = jinja2.Environment(loader=jinja2.FileSystemLoader(WEB_FOLDER / 'templates'))
-
-db = database.Database(POSTGRES_CONNECTION_STRING)
-sm = state_management.StateManagement(db, SPOTIFY_SECRET_BASE64)
-twh = twitch_webhooks.TwitchWebhookManager(db, WEBHOOK_HOST + '/webhook/twitch_live', TWITCH_WEBHOOK_SECRET, TWITCH_CLIENT_ID, TWITCH_SECRET)
-
-app = web.Application()
+METRICS_AUTHORIZATION_ENCODED = None if METRICS_TOKEN is None else ('Bearer ' + METRICS_TOKEN).encode('utf-8')
+TRACE_TOKEN_ENCODED = None if TRACE_TOKEN is None else TRACE_TOKEN.encode('utf-8')
+
+statics = static_assets.StaticAssets(STATIC_FOLDER)
+statics.load()
+tpl = templates.TemplateRegistry(WEB_FOLDER / 'templates', bytecode_cache_folder=TEMPLATE_CACHE_DIR, auto_reload=TEMPLATE_RELOAD, template_globals={'static_url': statics.url})
+tpl.load()
+
+db = database.Database(POSTGRES_CONNECTION_STRING, min_size=POSTGRES_POOL_MIN, max_size=POSTGRES_POOL_MAX, acquire_timeout=POSTGRES_POOL_TIMEOUT, flow_cache_size=0 if WEB_WORKERS > 1 and not CACHE_EVENTS else 10000,
+                       session_cache_ttl=0 if WEB_WORKERS > 1 and not CACHE_EVENTS else SESSION_CACHE_TTL)
+http = helper.HttpClient(limit=HTTP_LIMIT, limit_per_host=HTTP_LIMIT_PER_HOST, total_timeout=HTTP_TIMEOUT)
+sm = state_management.StateManagement(db, http, SPOTIFY_SECRET_BASE64, spotify_api_url=SPOTIFY_API_URL, spotify_accounts_url=SPOTIFY_ACCOUNTS_URL, shared_now_playing=SPOTIFY_POLLER)
+twh = twitch_webhooks.TwitchWebhookManager(db, http, WEBHOOK_HOST + '/webhook/twitch_live', TWITCH_WEBHOOK_SECRET, TWITCH_CLIENT_ID, TWITCH_SECRET, twitch_api_url=TWITCH_API_URL, twitch_id_url=TWITCH_ID_URL)
+tr = token_refresh.TokenRefresher(db, http, sm, TWITCH_CLIENT_ID, TWITCH_SECRET, window_s=TOKEN_REFRESH_WINDOW, twitch_id_url=TWITCH_ID_URL)
+loop_lag = metrics.LoopLagMonitor(metrics.LOOP_LAG_SECONDS, metrics.LOOP_LAG_LAST)
+inv = invalidation.InvalidationListener(POSTGRES_CONNECTION_STRING, database.EVENT_CHANNEL, db.origin, db.get_event_version, poll_interval_s=CACHE_EVENTS_POLL)
+inv.add_handler(db.apply_event)
+inv.add_handler(sm.apply_event)
+inv.add_resync_handler(db.clear_caches)
+inv.add_resync_handler(sm.resync_caches)
+
+def start_scheduled_jobs():
+    if TOKEN_REFRESH: tr.start()
+    if SPOTIFY_POLLER: sm.start_spotify_poller()
+
+async def stop_scheduled_jobs():
+    await sm.stop_spotify_poller()
+    await tr.stop()
+
+le = leader.LeaderElection(POSTGRES_CONNECTION_STRING)
+le.add_elected_handler(start_scheduled_jobs)
+le.add_demoted_handler(stop_scheduled_jobs)
+
+@web.middleware
+async def metrics_middleware(request : web.Request, handler):
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else 'unmatched'
+    status = 500
+    metrics.HTTP_REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        metrics.HTTP_REQUESTS_IN_FLIGHT.dec()
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route, status)
+
+@web.middleware
+async def compression_middleware(request : web.Request, handler):
+    response = await handler(request)
+    if request.path.startswith('/static/'): return response
+    if COMPRESS_MIN_BYTES <= 0 or type(response) is not web.Response or response.status != 200 or 'Content-Encoding' in response.headers: return response
+    body = response.body
+    if not isinstance(body, bytes) or not response.content_type.startswith(compression.COMPRESSIBLE_TYPES): return response
+    if len(body) < COMPRESS_MIN_BYTES:
+        metrics.COMPRESSION_SKIPPED.inc('small')
+        return response
+
+    vary = response.headers.get('Vary', None)
+    if vary is None: response.headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower(): response.headers['Vary'] = vary + ', Accept-Encoding'
+    encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        metrics.COMPRESSION_SKIPPED.inc('not_accepted')
+        return response
+
+    if len(body) >= compression.EXECUTOR_MIN_BYTES: compressed = await asyncio.get_running_loop().run_in_executor(None, compression.compress, body, encoding)
+    else: compressed = compression.compress(body, encoding)
+    if len(compressed) >= len(body):
+        metrics.COMPRESSION_SKIPPED.inc('no_gain')
+        return response
+
+    response.body = compressed
+    response.headers['Content-Encoding'] = encoding
+    etag = response.etag
+    if etag is not None and not etag.is_weak: response.etag = ETag(value=etag.value, is_weak=True)
+    metrics.COMPRESSION_INPUT_BYTES.inc(encoding, amount=len(body))
+    metrics.COMPRESSION_SAVED_BYTES.inc(encoding, amount=len(body) - len(compressed))
+    return response
+
+@web.middleware
+async def database_busy_middleware(request : web.Request, handler):
+    try: return await handler(request)
+    except database.DB_POOL_EXHAUSTED: return web.Response(text='Service busy, try again shortly', status=503, headers={'Retry-After': '1'})
+
+def collect_cache_metrics():
+    for name, stats in {**sm.cache_stats(), **db.cache_stats()}.items():
+        metrics.CACHE_HITS.set(stats['hits'], name)
+        metrics.CACHE_MISSES.set(stats['misses'], name)
+        metrics.CACHE_EVICTIONS.set(stats['evictions'], name)
+        metrics.CACHE_EXPIRATIONS.set(stats['expirations'], name)
+        metrics.CACHE_ENTRIES.set(stats['entries'], name)
+    for outcome in ('received', 'applied', 'failed', 'resyncs', 'reconnects'): metrics.INVALIDATION_EVENTS.set(getattr(inv, outcome), outcome)
+    for name, stats in sm.flight_stats().items():
+        metrics.FLIGHT_CALLS.set(stats['calls'], name)
+        metrics.FLIGHT_DEDUPLICATED.set(stats['deduplicated'], name)
+        metrics.FLIGHT_INFLIGHT.set(stats['inflight'], name)
+    metrics.LEADER.set(1 if le.leader else 0)
+
+metrics.REGISTRY.add_collector(collect_cache_metrics)
+
+def collect_token_refresh_metrics():
+    stats = tr.stats
+    metrics.TOKEN_REFRESH_RUNS.set(stats['runs'])
+    for outcome in ('refreshed', 'failed'): metrics.TOKEN_REFRESH_ACCOUNTS.set(stats[outcome], outcome)
+    metrics.TOKEN_REFRESH_LAST_RUN_SECONDS.set(stats['last_run_s'])
+    metrics.TOKEN_REFRESH_BACKING_OFF.set(stats['backing_off'])
+
+metrics.REGISTRY.add_collector(collect_token_refresh_metrics)
+
+app = web.Application(middlewares=[metrics_middleware, compression_middleware, database_busy_middleware])
 routes = web.RouteTableDef()
 
-async def get_component_by_name(name : str):
-    component_name = 'components/' + name + '.html'
-    file_path = WEB_FOLDER / ('templates/' + component_name)
-    if not file_path.is_file(): return None
-    return j2.get_template(component_name)
-
 @routes.get('/')
 async def app_root(request : web.Request):
-    t = j2.get_template('index.html')
+    t = tpl.get('index.html')
     login = await db.get_login_by_session(request.cookies.get('session', None))
     return web.Response(text=t.render(login=login), content_type='text/html')
 
@@ -70,13 +221,10 @@ async def app_root(request : web.Request):
     if not session_key: return web.Response(text='no session', status=302, headers={'location': '/?loginError=no%20session'})
     login = await db.get_login_by_session(session_key)
     if not login: return web.Response(text='invalid session', status=302, headers={'location': '/?loginError=invalid%20session'})
-    spotify_accounts = await db.get_spotify_accounts_by_login(login)
-    twitch_accounts = await db.get_twitch_accounts_by_login(login)
-    responses = await db.get_all_login_responses(login)
-    flows = await db.get_all_login_flows(login)
+    data = await db.get_dashboard_data(login)
 
-    t = j2.get_template('dashboard.html')
-    return web.Response(text=t.render(login=login, spotify_accounts=spotify_accounts, twitch_accounts=twitch_accounts, responses=responses, flows=flows), content_type='text/html')
+    t = tpl.get('dashboard.html')
+    return web.Response(text=t.render(login=login, spotify_accounts=data.spotify_accounts, twitch_accounts=data.twitch_accounts, responses=data.responses, flows=data.flows), content_type='text/html')
 
 @routes.post('/myaccount/save')
 async def app_post_responses_verify(request : web.Request):
@@ -156,21 +304,15 @@ async def app_post_responses_save(request : web.Request):
 
     components = data['components']
 
-    if StructGuard.INVALID == StructGuard.verifyListStructure(components, [{ 'type': str, 'values': dict }], rebuild=False)[0]:
+    if validation.INVALID == validation.validate_components(components)[0]:
         return web.Response(text=json.dumps({'success': False, 'message': 'Invalid components data'}))
 
-    type_formats = {
-        'text': {'text': str},
-        'spotifyCurrentArtist': {'spotify_id': str},
-        'spotifyCurrentSong': {'spotify_id': str}
-    }
-
     spotify_ids = None
 
     for i in components:
-        match_format = type_formats.get(i['type'], None)
-        if match_format is None: return web.Response(text=json.dumps({'success': False, 'message': 'Invalid type'}))
-        if StructGuard.INVALID == StructGuard.verifyDictStructure(i['values'], match_format, rebuild=False)[0]:
+        validate_values = validation.component_values_validators.get(i['type'], None)
+        if validate_values is None: return web.Response(text=json.dumps({'success': False, 'message': 'Invalid type'}))
+        if validation.INVALID == validate_values(i['values'])[0]:
             return web.Response(text=json.dumps({'success': False, 'message': 'Invalid state format'}))
         elif i['type'] in ['spotifyCurrentArtist', 'spotifyCurrentSong']:
             try: i['values']['spotify_id'] = int(i['values']['spotify_id'])
@@ -301,21 +443,15 @@ async def app_post_flows_save(request : web.Request):
 
     states = data['states']
 
-    if StructGuard.INVALID == StructGuard.verifyListStructure(states, [{ 'condition': str, 'response_id': str, 'values': dict }], rebuild=False)[0]:
+    if validation.INVALID == validation.validate_states(states)[0]:
         return web.Response(text=json.dumps({'success': False, 'message': 'Invalid states data'}))
 
-    type_formats = {
-        'twitchLive': {'twitch_id': str},
-        'never': {},
-        'always': {}
-    }
-
     twitch_ids = None
 
     for i in states:
-        match_format = type_formats.get(i['condition'], None)
-        if match_format is None: return web.Response(text=json.dumps({'success': False, 'message': 'Invalid condition'}))
-        if StructGuard.INVALID == StructGuard.verifyDictStructure(i['values'], match_format, rebuild=False)[0]:
+        validate_values = validation.state_values_validators.get(i['condition'], None)
+        if validate_values is None: return web.Response(text=json.dumps({'success': False, 'message': 'Invalid condition'}))
+        if validation.INVALID == validate_values(i['values'])[0]:
             return web.Response(text=json.dumps({'success': False, 'message': 'Invalid state format'}))
         elif i['condition'] in ['twitchLive']:
             try: i['values']['twitch_id'] = int(i['values']['twitch_id'])
@@ -344,7 +480,7 @@ async def app_render_component(request : web.Request):
     if not session_key: return web.Response(text='no session', status=302, headers={'location': '/?loginError=no%20session'})
     login = await db.get_login_by_session(session_key)
     if not login: return web.Response(text='invalid session', status=302, headers={'location': '/?loginError=invalid%20session'})
-    t = await get_component_by_name('component_options')
+    t = tpl.component('component_options')
     if not t: return web.Response(status=404)
     spotify_accounts = await db.get_spotify_accounts_by_login(login)
     spotify_connected = bool(spotify_accounts)
@@ -353,13 +489,13 @@ async def app_render_component(request : web.Request):
 @routes.get('/render/component/text')
 async def app_render_component(request : web.Request):
     text = request.query.get('text', '')
-    t = await get_component_by_name('text')
+    t = tpl.component('text')
     if not t: return web.Response(status=404)
     return web.Response(text=t.render(text=text), content_type='text/html')
 
 @routes.get('/render/component/spotifyCurrentArtist')
 async def app_render_component(request : web.Request):
-    t = await get_component_by_name('spotifyCurrentArtist')
+    t = tpl.component('spotifyCurrentArtist')
     if not t: return web.Response(status=404)
 
     try: account_id = int(request.query.get('spotify_id', None))
@@ -378,7 +514,7 @@ async def app_render_component(request : web.Request):
 
 @routes.get('/render/component/spotifyCurrentSong')
 async def app_render_component(request : web.Request):
-    t = await get_component_by_name('spotifyCurrentSong')
+    t = tpl.component('spotifyCurrentSong')
     if not t: return web.Response(status=404)
 
     try: account_id = int(request.query.get('spotify_id', None))
@@ -402,30 +538,13 @@ async def app_render_components(request : web.Request):
     login = await db.get_login_by_session(session_key)
     if not login: return web.Response(text='')
 
-    resp = ''
-    cache = {}
-
     resp_id = int(request.match_info['respID'])
-    responses = await db.get_all_login_responses(login)
+    responses, components, spotify_accounts = await asyncio.gather(db.get_all_login_responses(login),
+                                                                   db.get_response_components(objects.Response(resp_id, None, login.id)),
+                                                                   db.get_spotify_accounts_by_login(login))
     response = helper.find_by_key('id', resp_id, responses)
     if not response: return web.Response(text='')
-    components = await db.get_response_components(response)
-
-    spotify_accounts = None
-
-    for i in components:
-        if i.resp_type in ['spotifyCurrentArtist', 'spotifyCurrentSong']:
-            if spotify_accounts is None: spotify_accounts = await db.get_spotify_accounts_by_login(login)
-            spotify_acc = helper.find_by_key('id', i.variables['spotify_id'], spotify_accounts)
-            if not spotify_acc: continue
-            i.variables['spotify_label'] = spotify_acc.label
-
-        if not i.resp_type in cache: cache[i.resp_type] = await get_component_by_name(i.resp_type)
-        t = cache[i.resp_type]
-        if not isinstance(t, jinja2.Template): continue
-        resp += t.render(i.variables)
-
-    return web.Response(text=resp)
+    return web.Response(text=render_response_components(components, spotify_accounts))
 
 @routes.get('/render/flow/state')
 async def app_render_flows(request : web.Request):
@@ -434,11 +553,8 @@ async def app_render_flows(request : web.Request):
     login = await db.get_login_by_session(session_key)
     if not login: return web.Response(text='')
 
-    responses = await db.get_all_login_responses(login)
-    twitch_accounts = await db.get_twitch_accounts_by_login(login)
-
-    t = j2.get_template('flows/flow_state.html')
-    return web.Response(text=t.render(responses=responses, twitch_accounts=twitch_accounts))
+    responses, twitch_accounts = await asyncio.gather(db.get_all_login_responses(login), db.get_twitch_accounts_by_login(login))
+    return web.Response(text=render_flow_state(responses, twitch_accounts))
 
 @routes.get(r'/render/flows/{flowID:\d+}')
 async def app_render_flows(request : web.Request):
@@ -449,16 +565,51 @@ async def app_render_flows(request : web.Request):
 
     flow_id = int(request.match_info['flowID'])
 
-    responses = await db.get_all_login_responses(login)
-    twitch_accounts = await db.get_twitch_accounts_by_login(login)
-    flows = await db.get_all_login_flows(login)
+    responses, twitch_accounts, flows, flow_states = await asyncio.gather(db.get_all_login_responses(login),
+                                                                          db.get_twitch_accounts_by_login(login),
+                                                                          db.get_all_login_flows(login),
+                                                                          db.get_flow_states(objects.Flow(flow_id, None, login.id, None)))
     flow = helper.find_by_key('id', flow_id, flows)
     if flow is None: return web.Response(text='')
-    flow_states = await db.get_flow_states(flow)
+    return web.Response(text=render_flow(flow, flow_states, responses, twitch_accounts))
+
+@routes.get('/render/bootstrap')
+async def app_render_bootstrap(request : web.Request):
+    session_key = request.cookies.get('session', None)
+    if not session_key: return web.Response(text=json.dumps({'success': False, 'message': 'no session please login'}))
+    login = await db.get_login_by_session(session_key)
+    if not login: return web.Response(text=json.dumps({'success': False, 'message': 'invalid session please login'}))
+
+    data = await db.get_dashboard_data(login, details=True)
+    options_template = tpl.component('component_options')
+    return web.Response(text=json.dumps({
+        'success': True,
+        'component_options': options_template.render(spotify_connected=bool(data.spotify_accounts)) if options_template else '',
+        'flow_state': render_flow_state(data.responses, data.twitch_accounts),
+        'components': {str(i.id): render_response_components(data.components.get(i.id, []), data.spotify_accounts) for i in data.responses},
+        'flows': {str(i.id): render_flow(i, data.flow_states.get(i.id, []), data.responses, data.twitch_accounts) for i in data.flows}
+    }), content_type='application/json')
+
+def render_response_components(components : list[objects.ResponseComponent], spotify_accounts : list[objects.Spotify]):
+    resp = []
+    for i in components:
+        if i.resp_type in ['spotifyCurrentArtist', 'spotifyCurrentSong']:
+            spotify_acc = helper.find_by_key('id', i.variables['spotify_id'], spotify_accounts)
+            if not spotify_acc: continue
+            i.variables['spotify_label'] = spotify_acc.label
+
+        t = tpl.component(i.resp_type)
+        if t is None: continue
+        resp.append(t.render(i.variables))
+    return ''.join(resp)
 
-    t = j2.get_template('flows/flow.html')
-    return web.Response(text=t.render(flow=flow, flow_states=flow_states, responses=responses, twitch_accounts=twitch_accounts))
+def render_flow_state(responses : list[objects.Response], twitch_accounts : list[objects.Twitch]):
+    t = tpl.get('flows/flow_state.html')
+    return t.render(responses=responses, twitch_accounts=twitch_accounts)
 
+def render_flow(flow : objects.Flow, flow_states : list[objects.FlowState], responses : list[objects.Response], twitch_accounts : list[objects.Twitch]):
+    t = tpl.get('flows/flow.html')
+    return t.render(flow=flow, flow_states=flow_states, responses=responses, twitch_accounts=twitch_accounts)
 
 @routes.get('/logout')
 async def app_logout(request : web.Request):
@@ -475,7 +626,7 @@ async def app_spotifyConnect(request : web.Request):
     if not session_key: return web.Response(text='no session', status=302, headers={'location': '/?spotifyConnectError=no%20session'})
     login = await db.get_login_by_session(session_key)
     if not login: web.Response(text='invalid session', status=302, headers={'location': '/?spotifyConnectError=invalid%20session'})
-    location = f'https://accounts.spotify.com/authorize?response_type=code&client_id={SPOTIFY_CLIENT_ID}&scope={SPOTIFY_SCOPES_ENCODED}&redirect_uri={SPOTIFY_REDIRECT_ENCODED}&show_dialog=true'
+    location = f'{SPOTIFY_ACCOUNTS_URL}/authorize?response_type=code&client_id={SPOTIFY_CLIENT_ID}&scope={SPOTIFY_SCOPES_ENCODED}&redirect_uri={SPOTIFY_REDIRECT_ENCODED}&show_dialog=true'
     return web.Response(text='hi', status=302, headers={'location': location})
 
 @routes.get('/apis/spotify/callback')
@@ -488,14 +639,14 @@ async def app_spotifyConnectCallback(request : web.Request):
     if login is None: return web.Response(text='invalid or expired session', status=302, headers={'location': f'/?spotifyConnectError=invalid%20or%20expired%20session'})
 
     try:
-        resp = await helper.http_request(method='post',
-                    url='https://accounts.spotify.com/api/token',
+        resp = await http.request(method='post',
+                    url=SPOTIFY_ACCOUNTS_URL + '/api/token',
                     data={'grant_type': 'authorization_code', 'code': code, 'redirect_uri': SPOTIFY_REDIRECT},
                     headers={'Authorization': f'Basic {SPOTIFY_SECRET_BASE64}'})
     except Exception:
         return web.Response(text='Invalid authentication request', status=302, headers={'location': f'/dashboard?spotifyConnectError=invalid%20authentication%20request'})
 
-    try: resp = json.loads(resp)
+    try: resp = json.loads(resp.text)
     except Exception: return web.Response(text='Invalid authentication format', status=302, headers={'location': f'/dashboard?spotifyConnectError=invalid%authentication%20format'})
 
     if not isinstance(resp, dict):
@@ -518,14 +669,14 @@ async def app_spotifyConnectCallback(request : web.Request):
             return web.Response(text='Missing authentication scopes', status=302, headers={'location': f'/dashboard?spotifyConnectError=missing%20authentication%20scopes'})
 
     try:
-        user_data = await helper.http_request(method='GET', url='https://api.spotify.com/v1/me', headers={
+        user_data = await http.request(method='GET', url=SPOTIFY_API_URL + '/v1/me', headers={
             'Authorization': f'Bearer {access_token}'
         })
     except Exception:
         return web.Response(text='Invalid user request', status=302, headers={'location': f'/dashboard?spotifyConnectError=invalid%20user%20request'})
 
     try:
-        user_data = json.loads(user_data)
+        user_data = json.loads(user_data.text)
     except Exception:
         return web.Response(text='Invalid user request format', status=302, headers={'location': f'/dashboard?spotifyConnectError=invalid%20user%20request%format'})
 
@@ -552,7 +703,7 @@ async def app_apis_spotify_disconnect(request : web.Request):
 
 @routes.get('/login/twitch')
 async def app_twitchLogin(request : web.Request):
-    location = f'https://id.twitch.tv/oauth2/authorize?response_type=code&client_id={TWITCH_CLIENT_ID}&redirect_uri={TWITCH_REDIRECT_ENCODED}&scope={TWITCH_SCOPES_ENCODED}'
+    location = f'{TWITCH_ID_URL}/oauth2/authorize?response_type=code&client_id={TWITCH_CLIENT_ID}&redirect_uri={TWITCH_REDIRECT_ENCODED}&scope={TWITCH_SCOPES_ENCODED}'
     return web.Response(text='hi', status=302, headers={'location': location})
 
 @routes.get('/login/twitch/callback')
@@ -561,8 +712,8 @@ async def app_twitchLoginCallback(request : web.Request):
     if code is None: return web.Response(text='no code')
 
     try:
-        resp = await helper.http_request(method='post',
-                    url='https://id.twitch.tv/oauth2/token',
+        resp = await http.request(method='post',
+                    url=TWITCH_ID_URL + '/oauth2/token',
                     data={
                             'grant_type': 'authorization_code',
                             'code': code,
@@ -573,7 +724,7 @@ async def app_twitchLoginCallback(request : web.Request):
                     )
     except Exception: return web.Response(text='Failed authentication request', status=302, headers={'location': '/?loginError=failed%20authentication%20request'})
 
-    try: resp = json.loads(resp)
+    try: resp = json.loads(resp.text)
     except Exception: return web.Response(text='Invalid authentication format', status=302, headers={'location': '/?loginError=invalid%20authentication%20format'})
 
     if not isinstance(resp, dict) or 'status' in resp and resp['status'] == 400:
@@ -589,13 +740,13 @@ async def app_twitchLoginCallback(request : web.Request):
     scopes = resp.get('scope', list())
 
     try:
-        twitch_data_resp = await helper.http_request(method='GET', url='https://api.twitch.tv/helix/users', headers={
+        twitch_data_resp = await http.request(method='GET', url=TWITCH_API_URL + '/helix/users', headers={
             'Client-Id': TWITCH_CLIENT_ID,
             'Authorization': f'Bearer {access_token}'
         })
     except Exception: return web.Response(text='Invalid Twitch user response', status=302, headers={'location': '/?loginError=invalid%20twitch%20user%20request'})
 
-    try: twitch_user = json.loads(twitch_data_resp)
+    try: twitch_user = json.loads(twitch_data_resp.text)
     except Exception: return web.Response(text='Invalid Twitch user format', status=302, headers={'location': '/?loginError=invalid%20twitch%20user%20format'})
 
     if (not 'data' in twitch_user or not isinstance(twitch_user['data'], list) or
@@ -608,13 +759,13 @@ async def app_twitchLoginCallback(request : web.Request):
     except Exception: return web.Response(text='Invalid Twitch user id', status=302, headers={'location': '/?loginError=invalid%20twitch%20user%20id'})
 
     try:
-        live_resp = await helper.http_request(method='GET', url='https://api.twitch.tv/helix/streams?user_id=' + str(user_id), headers={
+        live_resp = await http.request(method='GET', url=TWITCH_API_URL + '/helix/streams?user_id=' + str(user_id), headers={
             'Client-Id': TWITCH_CLIENT_ID,
             'Authorization': f'Bearer {access_token}'
         })
     except Exception: return web.Response(text='Invalid Twitch live response', status=302, headers={'location': '/?loginError=invalid%20twitch%20live%20request'})
 
-    try: live_data = json.loads(live_resp)
+    try: live_data = json.loads(live_resp.text)
     except Exception: return web.Response(text='Invalid Twitch live format', status=302, headers={'location': '/?loginError=invalid%20twitch%20live%20format'})
 
     if not isinstance(live_data, dict):
@@ -627,7 +778,8 @@ async def app_twitchLoginCallback(request : web.Request):
     is_live = len(live_data) != 0
 
     login = await db.register_login(username, 'Twitch', user_id)
-    await db.add_twitch_account(login, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity)
+    twitch_account = await db.add_twitch_account(login, user_id, username, display_name, is_live, access_token, refresh_token, scopes, validity)
+    sm.add_twitch_account(twitch_account)
     await twh.listen(user_id)
 
     login_session = await db.create_login_session(login)
@@ -641,17 +793,28 @@ async def app_twitchLoginCallback(request : web.Request):
 async def app_u_username_flow_flowname_text(request : web.Request):
     username = request.match_info['username'].lower()
     flowname = request.match_info['flowname'].lower()
-    login = await db.get_login_by_username(username)
-    if not login: return web.Response(text='')
-    flows = await db.get_all_login_flows(login)
-    flow = helper.find_by_key('label', flowname, flows, match_lowercase=True)
-    if not flow or not flow.enabled: return web.Response(text='')
-    flow_states = await db.get_flow_states(flow)
-    active_state = await sm.get_first_active_state(flow_states)
-    if active_state is None: return web.Response(text='')
-    state_text_response = await sm.get_state_text_response(active_state)
-    if not isinstance(state_text_response, str): return web.Response(text='')
-    return web.Response(text=state_text_response)
+    trace = tracing.Trace()
+    text = await resolve_flow_text(username, flowname, trace)
+    etag = hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+    if request.if_none_match and any(i.value == etag or i.value == '*' for i in request.if_none_match): response = web.Response(status=304)
+    else: response = web.Response(text=text)
+    response.etag = etag
+    response.headers['Cache-Control'] = TEXT_CACHE_CONTROL
+    if TRACE_TOKEN_ENCODED is not None and hmac.compare_digest(request.headers.get('X-Trace-Token', request.query.get('trace', '')).encode('utf-8', 'surrogateescape'), TRACE_TOKEN_ENCODED):
+        response.headers['Server-Timing'] = trace.server_timing()
+    elapsed_ms = trace.elapsed_ms
+    if SLOW_REQUEST_MS > 0 and elapsed_ms >= SLOW_REQUEST_MS:
+        print('[SlowRequest] ' + json.dumps({'route': 'flow_text', 'username': username, 'flow': flowname, 'ms': round(elapsed_ms, 3), 'spans': trace.as_list()}))
+    return response
+
+async def resolve_flow_text(username : str, flowname : str, trace : tracing.Trace):
+    with trace.span('resolve'): resolution = await db.get_compiled_flow(username, flowname, load_twitch_live=not sm.twitch_live_index_loaded, trace=trace)
+    if not resolution: return ''
+    with trace.span('state'): active_state = await sm.get_first_active_state(resolution.states, None if sm.twitch_live_index_loaded else resolution.twitch_live, trace)
+    if active_state is None: return ''
+    with trace.span('text'): state_text_response = await sm.get_state_text_response(active_state, resolution.components.get(active_state.response_id, []), trace)
+    if not isinstance(state_text_response, str): return ''
+    return state_text_response
 
 @routes.get('/api/account/{accountType:[a-z]+}/{accountId:[0-9]+}/accountSecret')
 async def app_api_account_accountType_accountId_accountSecret(request : web.Request):
@@ -734,37 +897,87 @@ async def app_webhook_twitch_live_handle_event(request : web.Request, body_data
     if not isinstance(cond, dict): return web.Response(text='No condition', status=400)
     try: req_cond_broadcaster_uid = int(cond.get('broadcaster_user_id'))
     except Exception: return web.Response(text='Invalid condition broadcaster_user_id', status=400)
-    twitch_accounts = await db.get_twitch_accounts_by_user_id(req_cond_broadcaster_uid)
-    if not twitch_accounts: return web.Response(text='Twitch account not tracked', status=404)
-    await db.update_twitch_account_live_status_by_uid(req_type == 'stream.online', req_cond_broadcaster_uid)
+    if not await sm.set_twitch_live(req_cond_broadcaster_uid, req_type == 'stream.online'):
+        return web.Response(text='Twitch account not tracked', status=404)
     return web.Response(status=200)
 
+@routes.get('/metrics')
+async def app_metrics(request : web.Request):
+    if METRICS_AUTHORIZATION_ENCODED is not None and not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8', 'surrogateescape'), METRICS_AUTHORIZATION_ENCODED): return web.Response(status=401)
+    return web.Response(text=metrics.REGISTRY.render(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+@routes.get('/_stats')
+async def app_stats(request : web.Request):
+    if not BENCHMARK_STATS: return web.Response(status=404)
+    stats = {
+        'db_queries': db.query_count,
+        'caches': {**sm.cache_stats(), **db.cache_stats()},
+        'flights': sm.flight_stats(),
+        'statics': statics.stats,
+        'token_refresh': tr.stats,
+        'invalidation': inv.stats,
+        'leader': le.stats
+    }
+    return web.Response(text=json.dumps(stats), content_type='application/json')
+
 @routes.get('/static/{path:.+}')
 async def app_statics(request : web.Request):
-    contentRawPath = request.match_info['path']
+    content_path = static_assets.normalize_path(request.match_info['path'])
+    if content_path is None: return web.Response(text='illegal static resource path', status=403)
 
-    try: contentPath = (STATIC_FOLDER / contentRawPath).resolve()
-    except Exception: return web.Response(text='invalid resource path', status=403)
-    if not contentPath.is_relative_to(STATIC_FOLDER): return web.Response(text='illegal static resource path', status=403)
+    asset = statics.get(content_path)
+    if asset is None: return web.Response(text='the target resource does not exist', status=404)
 
-    if not contentPath.is_file(): return web.Response(text='the target resource does not exist', status=404)
-
-    return web.FileResponse(contentPath)
+    encoding, body, etag = asset.select(request.headers.get('Accept-Encoding', ''))
+    if request.if_none_match and any(i.value == etag or i.value == '*' for i in request.if_none_match): response = web.Response(status=304)
+    else: response = web.Response(body=body, content_type=asset.content_type)
+    response.etag = etag
+    response.headers['Cache-Control'] = static_assets.IMMUTABLE_CACHE_CONTROL if request.query.get('v', None) == asset.etag else STATIC_CACHE_CONTROL
+    if asset.variants: response.headers['Vary'] = 'Accept-Encoding'
+    if encoding is not None and response.status == 200: response.headers['Content-Encoding'] = encoding
+    return response
 
 app.add_routes(routes=routes)
 
-async def start_site():
+async def start_site(reuse_port : bool = False):
     runner = web.AppRunner(app)
     print(f'running at http://localhost:{WEB_PORT}')
     await runner.setup()
-    site = web.TCPSite(runner, host='0.0.0.0', port=WEB_PORT)
+    site = web.TCPSite(runner, host='0.0.0.0', port=WEB_PORT, reuse_port=reuse_port or None)
     await site.start()
 
-async def main():
-    await db.startup()
+async def main(worker_index : int = 0):
+    metrics.WORKER.set(worker_index)
+    await http.startup()
+    await db.startup(create_schema=WEB_WORKERS == 1)
     await twh.startup()
-    await start_site()
-    while True: await asyncio.sleep(10)
+    if CACHE_EVENTS: await inv.start()
+    if WEB_WORKERS == 1 or CACHE_EVENTS: await sm.load_twitch_live_index()
+    loop_lag.start()
+    if TOKEN_REFRESH or SPOTIFY_POLLER: le.start()
+    await start_site(WEB_WORKERS > 1)
+    try:
+        while True: await asyncio.sleep(10)
+    finally:
+        await le.stop()
+        await stop_scheduled_jobs()
+        await loop_lag.stop()
+        await inv.stop()
+        await http.shutdown()
+        await db.shutdown()
+
+async def prepare_database():
+    setup_db = database.Database(POSTGRES_CONNECTION_STRING, min_size=1, max_size=1)
+    await setup_db.startup()
+    await setup_db.shutdown()
+
+def run_worker(worker_index : int):
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try: asyncio.run(main(worker_index))
+    except KeyboardInterrupt: pass
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if WEB_WORKERS > 1:
+        asyncio.run(prepare_database())
+        supervisor.Supervisor(run_worker, WEB_WORKERS).run()
+    else: asyncio.run(main())
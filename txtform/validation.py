@@ -0,0 +1,135 @@
+from vendor.StructGuard import StructGuard
+
+NO_CHANGES = StructGuard.NO_CHANGES
+CHANGES = StructGuard.CHANGES
+INVALID = StructGuard.INVALID
+
+def compile_structure(structure : dict | list, *, rebuild : bool = True):
+    if isinstance(structure, dict): return compile_dict_structure(structure, rebuild)
+    if isinstance(structure, list): return compile_list_structure(structure, rebuild)
+    raise StructGuard.StructFormatError(f'Structure has to be of type dict or list (not {type(structure)})')
+
+def compile_default(value, rebuild : bool, key):
+    valuetype = type(value)
+    if valuetype == type: return value
+    if valuetype == list: return list
+    if valuetype == dict:
+        validator = compile_dict_structure(value, rebuild)
+        return lambda: validator({})[1]
+    if valuetype == StructGuard.AdvancedType: return value.createInstance
+    raise StructGuard.StructValueError(f'Invalid value of type {valuetype} in structure (key: {key})')
+
+def compile_check(value, type_key : bool, rebuild : bool, key):
+    valuetype = type(value)
+    if valuetype == type:
+        def check_type(obj : dict, k):
+            if isinstance(obj[k], value): return NO_CHANGES
+            if type_key: del obj[k]
+            else: obj[k] = value()
+            return CHANGES
+        return check_type
+    if valuetype == StructGuard.AdvancedType:
+        def check_advanced(obj : dict, k):
+            if value.isinstance(obj[k]): return NO_CHANGES
+            obj[k] = value.createInstance()
+            return CHANGES
+        return check_advanced
+    if valuetype == dict or valuetype == list:
+        validator = compile_dict_structure(value, rebuild) if valuetype == dict else compile_list_structure(value, rebuild)
+        def check_nested(obj : dict, k):
+            changes, obj[k] = validator(obj[k])
+            return changes
+        return check_nested
+    raise StructGuard.StructValueError(f'Invalid value of type {valuetype} in structure (key: {key})')
+
+def compile_dict_structure(structure : dict, rebuild : bool):
+    required = [(key, compile_default(value, rebuild, key)) for key, value in structure.items() if type(key) != type]
+    checks = {key: compile_check(value, type(key) == type, rebuild, key) for key, value in structure.items()}
+    has_type_keys = any(type(key) == type for key in structure)
+    type_checks = [(key, value) for key, value in structure.items() if type(key) != type and type(value) == type]
+    other_checks = [(key, checks[key]) for key, value in structure.items() if type(key) != type and type(value) != type]
+
+    def validate(obj : dict):
+        changes = NO_CHANGES
+        if not isinstance(obj, dict):
+            if not rebuild: return INVALID, {}
+            changes = INVALID
+            obj = {}
+
+        for key, default in required:
+            if key in obj: continue
+            if not rebuild: return INVALID, {}
+            obj[key] = default()
+            if changes == NO_CHANGES: changes = CHANGES
+
+        if not has_type_keys and len(obj) == len(required):
+            for key, value in type_checks:
+                if isinstance(obj[key], value): continue
+                obj[key] = value()
+                if changes == NO_CHANGES: changes = CHANGES
+            for key, check in other_checks:
+                sub_changes = check(obj, key)
+                if sub_changes == INVALID: changes = INVALID
+                elif sub_changes == CHANGES and changes == NO_CHANGES: changes = CHANGES
+            return changes, obj
+
+        for key in list(obj):
+            check = checks.get(key, None)
+            if check is None and has_type_keys: check = checks.get(type(key), None)
+            if check is None:
+                del obj[key]
+                if changes == NO_CHANGES: changes = CHANGES
+                continue
+            sub_changes = check(obj, key)
+            if sub_changes == INVALID: changes = INVALID
+            elif sub_changes == CHANGES and changes == NO_CHANGES: changes = CHANGES
+        return changes, obj
+    return validate
+
+def compile_list_structure(structure : list, rebuild : bool):
+    if len(structure) != 1: raise StructGuard.StructFormatError(f'Structure has to be of type list (not {type(structure)}) with length 1')
+    checktype = structure[0]
+    valuetype = type(checktype)
+
+    if valuetype == dict or valuetype == list:
+        item_validator = compile_dict_structure(checktype, rebuild) if valuetype == dict else compile_list_structure(checktype, rebuild)
+        def validate_nested(obj : list):
+            if not isinstance(obj, list): return INVALID, []
+            for index in reversed(range(len(obj))):
+                sub_changes, item = item_validator(obj[index])
+                if sub_changes == INVALID: obj.pop(index)
+                elif sub_changes == CHANGES: obj[index] = item
+            return NO_CHANGES, obj
+        return validate_nested
+
+    if valuetype == type: is_valid = lambda item: isinstance(item, checktype)
+    elif valuetype == StructGuard.AdvancedType: is_valid = checktype.isinstance
+    else: raise StructGuard.StructValueError(f'Invalid value of type {valuetype} in structure (key: [0])')
+
+    def validate_items(obj : list):
+        if not isinstance(obj, list): return INVALID, []
+        kept = [i for i in obj if is_valid(i)]
+        if len(kept) == len(obj): return NO_CHANGES, obj
+        obj[:] = kept
+        return CHANGES, obj
+    return validate_items
+
+COMPONENTS_STRUCTURE = [{'type': str, 'values': dict}]
+COMPONENT_VALUES_STRUCTURES = {
+    'text': {'text': str},
+    'spotifyCurrentArtist': {'spotify_id': str},
+    'spotifyCurrentSong': {'spotify_id': str}
+}
+
+STATES_STRUCTURE = [{'condition': str, 'response_id': str, 'values': dict}]
+STATE_VALUES_STRUCTURES = {
+    'twitchLive': {'twitch_id': str},
+    'never': {},
+    'always': {}
+}
+
+validate_components = compile_structure(COMPONENTS_STRUCTURE, rebuild=False)
+component_values_validators = {key: compile_structure(value, rebuild=False) for key, value in COMPONENT_VALUES_STRUCTURES.items()}
+
+validate_states = compile_structure(STATES_STRUCTURE, rebuild=False)
+state_values_validators = {key: compile_structure(value, rebuild=False) for key, value in STATE_VALUES_STRUCTURES.items()}
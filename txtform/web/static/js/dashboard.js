@@ -312,6 +312,7 @@
         else saveResponseError.innerText = 'Save failed';
         return;
       }
+      bootstrap = null;
 
       var cardE = document.querySelector(
         '#responses > .card[data-id="' + editedResponseID + '"]'
@@ -428,8 +429,12 @@
   }
 
   async function getComponents() {
-    var resp = await fetch('/render/components/' + editedResponseID);
-    var data = await resp.text();
+    if (bootstrap && bootstrap.components[editedResponseID] !== undefined) {
+      var data = bootstrap.components[editedResponseID];
+    } else {
+      var resp = await fetch('/render/components/' + editedResponseID);
+      var data = await resp.text();
+    }
     responseComponentsE.innerHTML =
       data + '<div class="component blankComponent"></div>';
     renderComponents();
@@ -474,6 +479,23 @@
     responseComponentSelect.innerHTML = data;
   }
 
+  var bootstrap = null;
+
+  async function loadBootstrap() {
+    try {
+      var resp = await fetch('/render/bootstrap');
+      var data = await resp.json();
+    } catch (e) {
+      var data = {};
+    }
+    if (!data.success) {
+      getComponentOptions();
+      return;
+    }
+    bootstrap = data;
+    responseComponentSelect.innerHTML = data.component_options;
+  }
+
   /*********
    * FLOWS *
    *********/
@@ -575,8 +597,12 @@
   }
 
   async function getFlowStates() {
-    var resp = await fetch('/render/flows/' + editedFlowID);
-    var data = await resp.text();
+    if (bootstrap && bootstrap.flows[editedFlowID] !== undefined) {
+      var data = bootstrap.flows[editedFlowID];
+    } else {
+      var resp = await fetch('/render/flows/' + editedFlowID);
+      var data = await resp.text();
+    }
     flowStates.innerHTML = data;
     flowStatesListeners();
   }
@@ -648,6 +674,7 @@
   }
 
   async function getDefaultFlowState() {
+    if (!newFlowStateCache && bootstrap) newFlowStateCache = bootstrap.flow_state;
     if (!newFlowStateCache) {
       try {
         var resp = await fetch('/render/flow/state');
@@ -811,6 +838,7 @@
         else saveFlowError.innerText = 'Save failed';
         return;
       }
+      if (bootstrap) delete bootstrap.flows[editedFlowID];
 
       var cardE = document.querySelector(
         '#flows > .card[data-id="' + editedFlowID + '"]'
@@ -828,7 +856,7 @@
    * STARTUP *
    ***********/
 
-  getComponentOptions();
+  loadBootstrap();
   addCancelOverlayListeners();
   addEditListeners();
   enableToggles();